@@ -13,6 +13,8 @@ from pvlib.location import Location
 from pvlib.modelchain import ModelChain
 from pvlib.temperature import TEMPERATURE_MODEL_PARAMETERS
 
+import plotting
+
 
 # Parameters -------------------------------------------------------------------------------------
 
@@ -23,6 +25,7 @@ sur_tilt = 30
 tz = 'Etc/GMT+3'
 lat = 60.45
 lon = 22.29
+plot_path = None # e.g. 'poa.png' or 'poa.svg' renders the plot to a file instead of a window
 
 # ------------------------------------------------------------------------------------------------
 
@@ -88,11 +91,10 @@ if __name__ == '__main__':
     print(result3)
 
     print("plotting...")
-    plt.plot(result['poa_global'], label='POA global East')
-    plt.plot(result2['poa_global'], label='POA global South')
-    plt.plot(result3['poa_global'], label='POA global West')
-    plt.legend()
-    plt.show()
+    plotting.comparison_plot({'POA global East' : result['poa_global'],
+                              'POA global South' : result2['poa_global'],
+                              'POA global West' : result3['poa_global']},
+                             path=plot_path, ylabel='POA irradiance (W/m2)')
     print("Plotting completed!")
 
     print("Finished.")
\ No newline at end of file
@@ -3,8 +3,6 @@ import numpy as np
 from tqdm import tqdm
 import time
 
-from scipy import integrate
-
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 
@@ -15,6 +13,8 @@ from pvlib.location import Location
 from pvlib.modelchain import ModelChain
 from pvlib.temperature import TEMPERATURE_MODEL_PARAMETERS
 
+import energy
+
 
 # Parameters -------------------------------------------------------------------------------------
 
@@ -96,11 +96,14 @@ if __name__ == '__main__':
 
 # ----------------------------------------------------------------------------
 
-    bifacialpower = 0
-    monofacialpower = 0
-
     resolution = '1min'
 
+    # Energy of every system at day, month and year level, computed in one pass
+    rollup = energy.EnergyRollup()
+    for name, i in zip(['E', 'S', 'W'], [mc, mc2, mc3]):
+        rollup.add(name, 'ac', i.results.ac, kwp=energy.rated_kwp(sandia_module))
+    energy_table = rollup.table()
+
 
     for i in [mc, mc2, mc3]:
         df = pd.DataFrame(i.results.ac, columns=['Power'])
@@ -146,13 +149,6 @@ if __name__ == '__main__':
         df_nov_avg.index = pd.to_datetime(df_nov_avg.index).strftime('%H:%M')
         df_dec_avg.index = pd.to_datetime(df_dec_avg.index).strftime('%H:%M')
 
-        # Calculate total powers for bifacial and south facing monofacial
-
-        if i == mc or i == mc3:
-            bifacialpower += integrate.trapezoid(df_jul_avg)
-        else:
-            monofacialpower += integrate.trapezoid(df_jul_avg)
-
 
         #plt.plot(df_jan_avg,  label=('January'))
         #plt.plot(df_feb_avg, label=('February'))
@@ -174,5 +170,7 @@ if __name__ == '__main__':
     plt.xlabel("Time")
     plt.show()   
 
-    print("Bifacial average power:", bifacialpower/(24*60))
-    print("Monofacial average power:", monofacialpower/(24*60))
\ No newline at end of file
+    # Total powers for bifacial (east + west) and south facing monofacial
+    print("Bifacial average power:", energy.average_power(energy_table, ['E', 'W'], '2021-07'))
+    print("Monofacial average power:", energy.average_power(energy_table, ['S'], '2021-07'))
+    print(energy.energy(energy_table, level='month'))
\ No newline at end of file
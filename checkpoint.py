@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+
+# Checkpoints for long runs ----------------------------------------------------------------------
+#
+# Every completed unit of work (a scenario's (site, system, time range), a time chunk of one
+# system, an orientation of a sweep) is written to <directory>/<hash of its key>.pkl as soon as
+# it is done. Writes go to a temporary file in the same directory which is fsynced and then
+# renamed over the target, so a checkpoint is either complete or absent, never half written,
+# even if the run is killed mid-write. A rerun with the same directory loads the completed units
+# and only computes the rest.
+#
+# Keys are JSON-able descriptions of everything a unit depends on (its parameters and a
+# fingerprint of its inputs), so changing a parameter simply misses the old checkpoint.
+#
+# Keys and payloads also carry the format `version`, which is raised whenever what is stored for
+# a unit changes (2: scenario units hold unfinished partial outputs instead of tables).
+# Checkpoints of another version are ignored, so an old directory is recomputed, not misread.
+
+version = 2
+
+
+class CheckpointStore:
+
+    def __init__(self, directory : str, version : int = version):
+        self.directory = directory
+        self.version = version
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        name = hashlib.sha1(json.dumps([self.version, key], sort_keys=True, default=str).encode()).hexdigest()
+        return os.path.join(self.directory, name + '.pkl')
+
+    def done(self, key):
+        return os.path.exists(self._path(key))
+
+    def save(self, key, value, replace : bool = True):
+        # With replace=False the first save of a key wins: returns False and leaves the existing
+        # checkpoint alone if another process saved it first
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump({'version' : self.version, 'key' : key, 'value' : value}, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            if replace:
+                os.replace(temporary, self._path(key))
+                return True
+            try:
+                os.link(temporary, self._path(key))
+                return True
+            except FileExistsError:
+                return False
+            finally:
+                os.remove(temporary)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+    def load(self, key):
+        with open(self._path(key), 'rb') as f:
+            payload = pickle.load(f)
+        if payload.get('version') != self.version:
+            raise KeyError("Checkpoint of format version " + str(payload.get('version')) + ", expected " + str(self.version))
+        return payload['value']
+
+    def keys(self):
+        # Keys of every completed unit of this format version
+        found = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith('.pkl'):
+                with open(os.path.join(self.directory, name), 'rb') as f:
+                    payload = pickle.load(f)
+                if payload.get('version') == self.version:
+                    found.append(payload['key'])
+        return found
+
+
+def fingerprint(*frames):
+    # Cheap content hash of DataFrames/Series: shape, index ends, column names and column sums
+    digest = hashlib.sha1()
+    for frame in frames:
+        frame = frame.to_frame() if isinstance(frame, pd.Series) else frame
+        digest.update(repr((frame.shape, str(frame.index[0]), str(frame.index[-1]), list(frame.columns))).encode())
+        digest.update(np.nansum(frame.to_numpy(dtype=float), axis=0).tobytes())
+    return digest.hexdigest()
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+
+import time_axis
+
+
+# Energy accounting ------------------------------------------------------------------------------
+#
+# Energy is accumulated per day in a single pass over each power series (sum of power times the
+# time step, so it is exact for the simulated step rather than a trapezoid over an average day).
+# Monthly and annual totals are sums of the daily ones, so every report reads from one small
+# rollup table instead of going back to the 1-minute data.
+#
+# Night-time AC is the inverter's negative tare power and is kept, so AC energy is net energy.
+
+day_ns = 86400 * 10**9
+levels = ['day', 'month', 'year']
+
+
+def ns(index : pd.DatetimeIndex):
+    # Integer nanoseconds, independent of the index's resolution (pandas 2+ may use us or s)
+    return np.asarray(index, dtype='datetime64[ns]').view('int64')
+
+
+def step_hours(index : pd.DatetimeIndex):
+    # Time step of a regular index in hours
+    if len(index) < 2:
+        raise ValueError("Cannot infer the time step of an index with fewer than two entries")
+    return float(np.median(np.diff(ns(index[:1000])))) / 3.6e12
+
+
+def local_day_numbers(times):
+    # Days since 1970-01-01 in the local time zone of a DatetimeIndex or time_axis.TimeAxis
+    return time_axis.local_ns(times) // day_ns
+
+
+class EnergyRollup:
+
+    def __init__(self):
+        self.days = {} # (system, quantity) -> Series of Wh indexed by day number
+        self.kwp = {}  # system -> rated power used for specific yield
+
+    def add(self, system : str, quantity : str, power : pd.Series, step : float = None, kwp : float = None):
+        # Adds a power series in W. Adding more data for the same system and quantity (e.g. the
+        # next time chunk) accumulates, so chunked runs produce the same totals as one long run.
+        if step is None:
+            step = step_hours(power.index)
+        self.add_days(system, quantity, local_day_numbers(power.index), power.to_numpy(dtype=float) * step)
+        if kwp is not None:
+            self.kwp[system] = kwp
+
+    def add_axis(self, system : str, quantity : str, power : np.ndarray, axis, kwp : float = None):
+        # Same as add for a plain array of power on a time_axis.TimeAxis
+        self.add_days(system, quantity, axis.day_numbers(), np.asarray(power, dtype=float) * axis.step_hours)
+        if kwp is not None:
+            self.kwp[system] = kwp
+
+    def add_days(self, system : str, quantity : str, days : np.ndarray, energy_wh : np.ndarray):
+        first = int(days.min())
+        sums = np.bincount(days - first, weights=np.nan_to_num(energy_wh))
+        daily = pd.Series(sums, index=np.arange(first, first + len(sums)))
+        key = (system, quantity)
+        self.days[key] = daily if key not in self.days else self.days[key].add(daily, fill_value=0)
+
+    def merge(self, other):
+        for (system, quantity), daily in other.days.items():
+            key = (system, quantity)
+            self.days[key] = daily if key not in self.days else self.days[key].add(daily, fill_value=0)
+        self.kwp.update(other.kwp)
+        return self
+
+    def table(self):
+        # Rollup table with one row per (system, quantity, level, period)
+        frames = []
+        for (system, quantity), daily in self.days.items():
+            dates = np.datetime64('1970-01-01', 'D') + daily.index.to_numpy().astype('timedelta64[D]')
+            periods = {'day' : dates.astype(str),
+                       'month' : dates.astype('datetime64[M]').astype(str),
+                       'year' : dates.astype('datetime64[Y]').astype(str)}
+            for level in levels:
+                totals = daily.groupby(periods[level]).sum() / 1000
+                frames.append(pd.DataFrame({'system' : system, 'quantity' : quantity, 'level' : level,
+                                            'period' : totals.index, 'energy_kwh' : totals.to_numpy()}))
+        table = pd.concat(frames, ignore_index=True)
+        table['specific_yield'] = table['energy_kwh'] / table['system'].map(self.kwp)
+        return table
+
+
+def rated_kwp(module : pd.Series, modules : int = 1):
+    # STC rating of a SAPM module in kWp
+    return module['Impo'] * module['Vmpo'] * modules / 1000
+
+
+def rollup(series : dict, system : str = None, kwp : float = None):
+    # One-off rollup of {quantity: power series} for a single system
+    r = EnergyRollup()
+    for quantity, power in series.items():
+        r.add(system, quantity, power, kwp=kwp)
+    return r.table()
+
+
+# Reports ----------------------------------------------------------------------------------------
+
+def energy(table : pd.DataFrame, level : str = 'month', quantity : str = 'ac'):
+    # Energy in kWh per period (rows) and system (columns)
+    rows = table[(table['level'] == level) & (table['quantity'] == quantity)]
+    return rows.pivot_table(index='period', columns='system', values='energy_kwh', aggfunc='sum')
+
+
+def average_power(table : pd.DataFrame, systems : list, period : str, quantity : str = 'ac', tz : str = None):
+    # Mean power in W of the sum of `systems` over a 'YYYY-MM' month or 'YYYY' year. Periods are
+    # local to `tz` (the time zone the rollup was built in), so a month with a DST change is an
+    # hour shorter or longer than its calendar length.
+    level = 'month' if len(period) == 7 else 'year'
+    rows = table[(table['level'] == level) & (table['quantity'] == quantity) &
+                 (table['period'] == period) & (table['system'].isin(systems))]
+    start = pd.Period(period)
+    hours = (pd.Timestamp((start + 1).start_time, tz=tz) - pd.Timestamp(start.start_time, tz=tz)).total_seconds() / 3600
+    return rows['energy_kwh'].sum() * 1000 / hours
@@ -0,0 +1,305 @@
+import argparse
+import heapq
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import simulation
+import energy
+import time_axis
+import telemetry
+
+
+# Sub-minute resolution --------------------------------------------------------------------------
+#
+# A system-year at 1 second is 31.5M rows, too much to keep as pandas series. This mode streams
+# the input (clear sky computed on a time_axis.TimeAxis, or a measured StarkeDFC file) in chunks
+# of `chunk_rows` steps, models every system on each chunk and keeps only:
+#
+#   ramps      distribution of power changes over `ramp_windows` seconds, in % of the inverter's
+#              rated AC power (fixed-bin histograms, so percentiles come out at the end,
+#              interpolated inside a bin), and how often they exceed `ramp_limit` (% of rated
+#              power per minute)
+#   clipping   seconds at the inverter's AC limit and the DC energy above its DC rating
+#   events     one row per clipping, ramp (over `ramp_limit` on the `ramp_event_window`) and
+#              overirradiance (ghi above `overirradiance_factor` x clear sky, measured input only)
+#              event, with its start, end and peak. Flagged steps less than `event_gap` seconds
+#              apart count as one event.
+#   windows    the full-resolution series around the `max_windows` largest events of every
+#              (kind, system), padded by `window_pad` seconds and at most `max_window` long
+#
+# The last steps of every chunk are carried into the next one, so ramps and events that span a
+# chunk boundary are the same as in one long run. Ramps are only taken between steps exactly
+# the window apart, so gaps in measured data do not produce spurious ramps.
+
+chunk_rows = 86400
+ramp_windows = [1, 10, 60] # seconds
+ramp_event_window = 60
+ramp_limit = 10.0 # % of rated power per minute
+clip_tolerance = 1e-3
+overirradiance_factor = 1.05
+overirradiance_min = 100.0 # W/m2 of clear sky ghi, avoids flagging low sun
+event_gap = 10 # seconds
+window_pad = 60 # seconds
+max_window = 900 # seconds
+max_windows = 20
+
+# |ramp| histogram bins in % of rated power
+ramp_bins = np.linspace(0, 100, 2001)
+percentiles = [50, 95, 99, 99.9]
+
+
+def clearsky_chunks(location, start, end, freq : str = '1s', rows : int = chunk_rows, strategy : str = 'spa'):
+    # (weather, geometry) of clear sky over [start, end], at most `rows` steps at a time
+    axis = time_axis.TimeAxis.from_range(start, end, freq, location.tz)
+    telemetry.add_units(-(-len(axis) // rows))
+    for _, chunk in axis.chunks(rows):
+        geometry = simulation.solar_geometry(location, chunk.to_index(), strategy)
+        yield simulation.clear_sky(location, geometry), geometry
+
+
+def measured_chunks(location, path : str, rows : int = chunk_rows, strategy : str = 'spa'):
+    for weather in simulation.read_weather_chunks(path, location.tz, rows):
+        telemetry.add_units()
+        geometry = simulation.solar_geometry(location, weather.index, strategy, temperature=weather['temp_air'].to_numpy())
+        yield weather, geometry
+
+
+def _lagged_change(values : np.ndarray, times : np.ndarray, lag : int, step : int, n_new : int):
+    # values[i] - values[i - lag] for the last n_new steps; NaN where the earlier step is not
+    # available or not exactly lag steps back in time
+    change = np.full(n_new, np.nan)
+    if len(values) <= lag:
+        return change
+    difference = values[lag:] - values[:-lag]
+    regular = (times[lag:] - times[:-lag]) == lag * step
+    difference = np.where(regular, difference, np.nan)[-n_new:]
+    change[n_new - len(difference):] = difference
+    return change
+
+
+def histogram_percentile(histogram : np.ndarray, q : float, maximum : float):
+    # q-th percentile of the values counted in `histogram` (over ramp_bins), interpolated inside
+    # its bin as if the values were spread evenly across it, and never above the largest value
+    total = histogram.sum()
+    if not total:
+        return np.nan
+    cumulative = np.cumsum(histogram)
+    target = q / 100 * total
+    i = min(int(np.searchsorted(cumulative, target)), len(histogram) - 1)
+    below = cumulative[i - 1] if i > 0 else 0
+    fraction = (target - below) / histogram[i] if histogram[i] else 1.0
+    return min(ramp_bins[i] + fraction * (ramp_bins[i + 1] - ramp_bins[i]), maximum)
+
+
+class HighResolutionStats:
+
+    def __init__(self, systems : dict, inverter : pd.Series, step : int):
+        # step in integer nanoseconds
+        self.systems = systems
+        self.paco = float(inverter['Paco'])
+        self.pdco = float(inverter['Pdco'])
+        self.step = step
+        self.step_s = step / 1e9
+        self.lags = {window: int(round(window / self.step_s)) for window in ramp_windows}
+        if any(lag < 1 or abs(lag * self.step_s - window) > 1e-9 for window, lag in self.lags.items()):
+            raise ValueError("Ramp windows must be whole multiples of the time step")
+        self.keep_rows = int(round((max_window + 2 * window_pad) / self.step_s)) + 1
+
+        self.histograms = {(name, window): np.zeros(len(ramp_bins) - 1, dtype=np.int64)
+                           for name in systems for window in ramp_windows}
+        self.ramp_max = dict.fromkeys(self.histograms, 0.0)
+        self.over_limit = dict.fromkeys(self.histograms, 0)
+        self.clipped_steps = dict.fromkeys(systems, 0)
+        self.clipped_dc_wh = dict.fromkeys(systems, 0.0)
+        self.energy_wh = dict.fromkeys(systems, 0.0)
+
+        self.events = []
+        self.counts = {}
+        self.open = {} # (kind, system) -> [start, last, peak]
+        self.pending = [] # closed events whose window is not yet complete
+        self.windows = {} # (kind, system) -> heap of (peak, event id, window)
+        self.history = None # last keep_rows steps: times and the columns windows are cut from
+
+    def add(self, weather : pd.DataFrame, results : dict, clear_ghi : np.ndarray = None):
+        # One chunk: weather and {system: run_system result} on the same index
+        times = energy.ns(weather.index.tz_convert('UTC').tz_localize(None) if weather.index.tz is not None
+                          else weather.index)
+        frame = pd.DataFrame({'ghi' : weather['ghi'].to_numpy()}, index=times)
+        for name, result in results.items():
+            frame['ac_' + name] = result['ac'].to_numpy()
+            frame['poa_global_' + name] = result['poa_global'].to_numpy()
+        history = self.history.iloc[-max(self.lags.values()):] if self.history is not None else frame.iloc[:0]
+        extended_times = np.concatenate([history.index.to_numpy(), times])
+
+        for name, result in results.items():
+            ac = result['ac'].to_numpy(dtype=float)
+            p_mp = result['p_mp'].to_numpy(dtype=float)
+            extended = np.concatenate([history['ac_' + name].to_numpy(), ac])
+            for window, lag in self.lags.items():
+                ramp = _lagged_change(extended, extended_times, lag, self.step, len(ac)) / self.paco * 100
+                valid = np.abs(ramp[~np.isnan(ramp)])
+                key = (name, window)
+                self.histograms[key] += np.histogram(np.minimum(valid, ramp_bins[-1]), ramp_bins)[0]
+                if len(valid):
+                    self.ramp_max[key] = max(self.ramp_max[key], float(valid.max()))
+                self.over_limit[key] += int((valid > ramp_limit * window / 60).sum())
+                if window == ramp_event_window:
+                    ramp_events = np.abs(np.nan_to_num(ramp)) > ramp_limit * window / 60
+                    self._events('ramp', name, times, ramp_events, np.abs(np.nan_to_num(ramp)))
+
+            clipped = ac >= self.paco * (1 - clip_tolerance)
+            self.clipped_steps[name] += int(clipped.sum())
+            self.clipped_dc_wh[name] += float(np.maximum(p_mp[clipped] - self.pdco, 0).sum()) * self.step_s / 3600
+            self.energy_wh[name] += float(np.nansum(ac)) * self.step_s / 3600
+            self._events('clipping', name, times, clipped, p_mp)
+
+        if clear_ghi is not None:
+            ghi = weather['ghi'].to_numpy(dtype=float)
+            over = (clear_ghi > overirradiance_min) & (ghi > overirradiance_factor * clear_ghi)
+            self._events('overirradiance', 'site', times, over, ghi)
+
+        self.history = pd.concat([self.history, frame]) if self.history is not None else frame
+        self._cut_windows(final=False)
+        self.history = self.history.iloc[-self.keep_rows:]
+
+    def _events(self, kind : str, system : str, times : np.ndarray, flagged : np.ndarray, values : np.ndarray):
+        # Flagged steps less than event_gap apart form one event. An event stays open while it
+        # may still continue into the next chunk.
+        key = (kind, system)
+        gap = int(event_gap * 1e9)
+        flagged_at = np.flatnonzero(flagged)
+        if len(flagged_at):
+            breaks = np.flatnonzero(np.diff(times[flagged_at]) > gap) + 1
+            for run in np.split(flagged_at, breaks):
+                first, last, peak = times[run[0]], times[run[-1]], float(np.nanmax(values[run]))
+                if key in self.open and first - self.open[key][1] <= gap:
+                    start, _, previous = self.open[key]
+                    self.open[key] = [start, last, max(peak, previous)]
+                else:
+                    if key in self.open:
+                        self._close(key, *self.open.pop(key))
+                    self.open[key] = [first, last, peak]
+        if key in self.open and times[-1] - self.open[key][1] > gap:
+            self._close(key, *self.open.pop(key))
+
+    def _close(self, key : tuple, start : int, last : int, peak : float):
+        kind, system = key
+        # Numbered per (kind, system), which closes its events in time order however the input
+        # is chunked
+        self.counts[key] = self.counts.get(key, 0) + 1
+        event = "%s-%s-%d" % (kind, system, self.counts[key])
+        self.events.append({'event' : event, 'kind' : kind, 'system' : system, 'start' : start, 'end' : last,
+                            'duration_s' : (last - start) / 1e9 + self.step_s, 'peak' : peak})
+        self.pending.append((key, event, start, last, peak))
+
+    def _cut_windows(self, final : bool):
+        pad = int(window_pad * 1e9)
+        latest = self.history.index[-1] if len(self.history) else None
+        waiting = []
+        for key, event, start, last, peak in self.pending:
+            if not final and last + pad > latest:
+                waiting.append((key, event, start, last, peak))
+                continue
+            first = max(start - pad, last + pad - int(max_window * 1e9))
+            window = self.history.loc[first:last + pad]
+            heap = self.windows.setdefault(key, [])
+            item = (peak, event, window)
+            if len(heap) < max_windows:
+                heapq.heappush(heap, item)
+            elif peak > heap[0][0]:
+                heapq.heapreplace(heap, item)
+        self.pending = waiting
+
+    def finish(self, tz : str = 'UTC'):
+        # {'ramps', 'clipping', 'events': tables, 'windows': {event id: series around it}}
+        for key, event in list(self.open.items()):
+            self._close(key, *event)
+        self.open = {}
+        if self.history is not None:
+            self._cut_windows(final=True)
+
+        def local(values):
+            return pd.DatetimeIndex(np.asarray(values, dtype=np.int64).astype('datetime64[ns]'), tz='UTC').tz_convert(tz)
+
+        ramps = []
+        for (name, window), histogram in self.histograms.items():
+            row = {'system' : name, 'window_s' : window, 'samples' : int(histogram.sum()),
+                   'max_pct' : self.ramp_max[(name, window)], 'over_limit' : self.over_limit[(name, window)]}
+            for q in percentiles:
+                row['p' + str(q)] = histogram_percentile(histogram, q, row['max_pct'])
+            ramps.append(row)
+
+        clipping = pd.DataFrame({'system' : list(self.systems),
+                                 'energy_kwh' : [self.energy_wh[name] / 1000 for name in self.systems],
+                                 'clipped_s' : [self.clipped_steps[name] * self.step_s for name in self.systems],
+                                 'clipped_dc_kwh' : [self.clipped_dc_wh[name] / 1000 for name in self.systems]})
+        events = pd.DataFrame(self.events, columns=['event', 'kind', 'system', 'start', 'end', 'duration_s', 'peak'])
+        events = events.sort_values(['start', 'kind', 'system'], ignore_index=True)
+        clipping['clipping_events'] = clipping['system'].map(events[events['kind'] == 'clipping']['system'].value_counts()).fillna(0).astype(int)
+        events['start'] = local(events['start'])
+        events['end'] = local(events['end'])
+
+        windows = {}
+        for heap in self.windows.values():
+            for peak, event, window in sorted(heap, reverse=True):
+                windows[event] = window.set_axis(local(window.index))
+        return {'ramps' : pd.DataFrame(ramps), 'clipping' : clipping, 'events' : events, 'windows' : windows}
+
+
+def run_high_resolution(site : dict, systems : dict, weather : str = 'clearsky', start = None, end = None,
+                        freq : str = '1s', rows : int = chunk_rows, strategy : str = 'spa'):
+    # Streams the site's weather (clear sky over [start, end] at `freq`, or a measured file) and
+    # returns HighResolutionStats.finish() for every system {name: (surface_tilt, surface_azimuth)}
+    if rows <= max(ramp_windows) / pd.Timedelta(freq).total_seconds():
+        raise ValueError("Chunks must be longer than the longest ramp window")
+    location = simulation.make_location(site)
+    module, inverter = simulation.load_components()
+    measured = weather != 'clearsky'
+    chunks = (measured_chunks(location, weather, rows, strategy) if measured
+              else clearsky_chunks(location, start, end, freq, rows, strategy))
+
+    stats = None
+    for i, (chunk, geometry) in enumerate(chunks):
+        if stats is None:
+            stats = HighResolutionStats(systems, inverter, int(pd.Timedelta(freq).value) if not measured
+                                        else int(np.median(np.diff(energy.ns(chunk.index[:1000])))))
+        results = {name: simulation.run_system(geometry, chunk, tilt, az, module, inverter)
+                   for name, (tilt, az) in systems.items()}
+        clear_ghi = simulation.clear_sky(location, geometry)['ghi'].to_numpy() if measured else None
+        stats.add(chunk, results, clear_ghi)
+        telemetry.add_rows('model', len(chunk) * len(systems))
+        telemetry.unit_done()
+        print("Chunk", i + 1, "done:", chunk.index[-1])
+    return stats.finish(location.tz)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Ramp and clipping statistics from 1-second simulations")
+    parser.add_argument('--weather', default='clearsky', help="'clearsky' or a StarkeDFC weather file")
+    parser.add_argument('--start', default='2021-06-01')
+    parser.add_argument('--end', default='2021-06-30 23:59:59')
+    parser.add_argument('--freq', default='1s')
+    parser.add_argument('--chunk-rows', type=int, default=chunk_rows)
+    parser.add_argument('--solar-position', default='spa', help="Strategy, see solar_position.py")
+    parser.add_argument('--output-dir', default="HR_" + time.strftime("%Y_%m_%d_%H-%M"))
+    telemetry.add_arguments(parser)
+    args = parser.parse_args()
+
+    site = {'name' : 'Turku', 'latitude' : 60.45, 'longitude' : 22.29, 'altitude' : 50, 'tz' : 'Europe/Helsinki'}
+    systems = {'E' : (90, 90), 'S' : (30, 180), 'W' : (90, 270)}
+
+    start_time = time.time()
+    with telemetry.from_args('high_resolution', args):
+        results = run_high_resolution(site, systems, args.weather, args.start, args.end, args.freq,
+                                      args.chunk_rows, args.solar_position)
+    os.makedirs(os.path.join(args.output_dir, 'windows'), exist_ok=True)
+    for name in ['ramps', 'clipping', 'events']:
+        results[name].to_csv(os.path.join(args.output_dir, name + '.csv'), index=False)
+    for event, window in results['windows'].items():
+        window.to_csv(os.path.join(args.output_dir, 'windows', event + '.csv'))
+    print(results['ramps'].to_string(index=False))
+    print(results['clipping'].to_string(index=False))
+    print("Simulation finished in: ", "{:.2f}".format(time.time() - start_time), "seconds.")
@@ -13,6 +13,8 @@ from pvlib.location import Location
 from pvlib.modelchain import ModelChain
 from pvlib.temperature import TEMPERATURE_MODEL_PARAMETERS
 
+import plotting
+
 
  # Parameters -------------------------------------------------------------------------------------
 
@@ -23,6 +25,7 @@ sur_tilt = 30
 tz = 'Etc/GMT+3'
 lat = 60.45
 lon = 22.29
+plot_path = None # e.g. 'poa.png' or 'poa.svg' renders the plot to a file instead of a window
 
 # ------------------------------------------------------------------------------------------------
 
@@ -163,8 +166,8 @@ if __name__ == '__main__':
         print(result2[500:505])
         print(result3[500:505])
 
-        plt.plot(result['poa_direct'], label='East')
-        plt.plot(result2['poa_direct'], label='South')
-        plt.plot(result3['poa_direct'], label='West')
-        plt.show()
+        plotting.comparison_plot({'East' : result['poa_direct'],
+                                  'South' : result2['poa_direct'],
+                                  'West' : result3['poa_direct']},
+                                 path=plot_path, ylabel='POA direct (W/m2)')
 
@@ -0,0 +1,217 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import simulation
+import energy
+import scenario
+import time_axis
+import telemetry
+
+
+# Multi-year weather batches ---------------------------------------------------------------------
+#
+# Interannual variability needs the same systems run on many weather years. Instead of one run
+# per year, the years of a site are aligned on a common grid of (day of year, minute of day) in
+# local standard time, so DST shifts do not misalign them, and stacked into a (year x time)
+# batch that every system runs through in one pass. Days are counted on a leap calendar, so
+# 1 March is the same grid day in every year and 29 February is simply missing (NaN) in common
+# years.
+#
+# The sun is almost at the same position at the same calendar time of different years: years
+# four apart differ by hundredths of a degree, neighbouring years by up to ~0.3 degrees. Years
+# are grouped so that every year is within `share_tolerance` degrees of its group's first year
+# (checked hourly over the sunlit part of the year), and solar geometry is computed once per
+# group. With share_tolerance=0 every year gets its own geometry and the batch gives the same
+# energy as separate runs. Shared geometry uses the mean air temperature of the group's years
+# for refraction.
+#
+# Monthly energy comes out per year, and across years as mean, min, max and P90 (the energy
+# exceeded in 90 % of the years, i.e. the 10th percentile). Year-months with less than
+# `min_coverage` of their grid steps present are left out of the statistics.
+
+share_tolerance = 0.05 # degrees
+min_coverage = 0.95
+reference_year = 2000 # any leap year
+probe_every = 60 # grid steps between the probes of the geometry check
+block_days = 31
+
+
+def _grid_days():
+    # (month, day) of every grid day of the leap calendar
+    first = time_axis.days_from_civil(reference_year, 1, 1)
+    days = np.arange(first, time_axis.days_from_civil(reference_year + 1, 1, 1))
+    return time_axis.civil_from_days(days)[1:]
+
+
+def standard_offset(index : pd.DatetimeIndex):
+    # The site's local standard time offset in ns: DST only ever adds to it
+    return int((time_axis.local_ns(index) - energy.ns(index.tz_convert('UTC').tz_localize(None))).min()) \
+        if index.tz is not None else 0
+
+
+class YearBatch:
+
+    def __init__(self, weather : pd.DataFrame, years : list = None, step : str = '1min'):
+        # Aligns every local year of `weather` (or the given `years`) on the common grid
+        self.tz = str(weather.index.tz) if weather.index.tz is not None else 'UTC'
+        self.step = pd.Timedelta(step).value
+        self.per_day = int(time_axis.day_ns // self.step)
+        self.day_month, self.day_of_month = _grid_days()
+        self.n = len(self.day_month) * self.per_day
+        self.offset = standard_offset(weather.index)
+
+        local = energy.ns(weather.index.tz_convert('UTC').tz_localize(None)) + self.offset
+        year, month, day = time_axis.civil_from_days(local // time_axis.day_ns)
+        slot = (local % time_axis.day_ns) // self.step
+        position = (time_axis.days_from_civil(reference_year, month, day) -
+                    time_axis.days_from_civil(reference_year, 1, 1)) * self.per_day + slot
+        on_grid = (local % time_axis.day_ns) % self.step == 0
+
+        self.years = sorted(set(year[on_grid].tolist())) if years is None else list(years)
+        columns = [column for column in ['ghi', 'dni', 'dhi', 'temp_air', 'wind_speed'] if column in weather]
+        self.weather = {column: np.full((len(self.years), self.n), np.nan) for column in columns}
+        for i, y in enumerate(self.years):
+            rows = on_grid & (year == y)
+            for column in columns:
+                self.weather[column][i, position[rows]] = weather[column].to_numpy(dtype=float)[rows]
+        self.present = ~np.isnan(self.weather['ghi'])
+
+    @classmethod
+    def from_files(cls, paths : list, tz : str, years : list = None, step : str = '1min'):
+        # One or more StarkeDFC files (e.g. one per year) of the same site
+        weather = pd.concat([scenario.load_weather_file(path, tz) for path in paths])
+        return cls(weather[~weather.index.duplicated()].sort_index(), years, step)
+
+    def grid_times(self, year : int, rows = slice(None)):
+        # The grid's time steps in `year` as a tz-aware index. 29 February of a common year
+        # lands on 1 March, which only matters for geometry that no weather uses.
+        steps = np.arange(self.n)[rows]
+        grid_day = steps // self.per_day
+        days = time_axis.days_from_civil(year, self.day_month[grid_day], self.day_of_month[grid_day])
+        local = days * time_axis.day_ns + (steps % self.per_day) * self.step
+        index = pd.DatetimeIndex((local - self.offset).astype('datetime64[ns]'), tz='UTC')
+        return index.tz_convert(self.tz)
+
+    def geometry_groups(self, location, tolerance : float = share_tolerance):
+        # [[year, ...], ...]: every year within `tolerance` degrees of its group's first year
+        probes = slice(0, None, probe_every)
+
+        def sun(year):
+            geometry = simulation.solar_geometry(location, self.grid_times(year, probes))
+            zenith, azimuth = np.radians(geometry['apparent_zenith'].to_numpy()), np.radians(geometry['azimuth'].to_numpy())
+            return (np.stack([np.sin(zenith) * np.sin(azimuth), np.sin(zenith) * np.cos(azimuth), np.cos(zenith)]),
+                    geometry['apparent_elevation'].to_numpy() > 0)
+
+        groups = []
+        for year in self.years:
+            vectors, up = sun(year)
+            for group in groups:
+                first_vectors, first_up = group[1]
+                angle = np.degrees(np.arccos(np.clip((vectors * first_vectors).sum(axis=0), -1, 1)))
+                if angle[up | first_up].max(initial=0) <= tolerance:
+                    group[0].append(year)
+                    break
+            else:
+                groups.append(([year], (vectors, up)))
+        return [years for years, _ in groups]
+
+    def geometry(self, location, tolerance : float = share_tolerance):
+        # {column: (year, time) array} of solar geometry, computed once per group of years
+        columns = ['apparent_zenith', 'zenith', 'azimuth', 'dni_extra', 'airmass_relative', 'airmass_absolute']
+        batch = {column: np.empty((len(self.years), self.n)) for column in columns}
+        groups = self.geometry_groups(location, tolerance) if tolerance > 0 else [[year] for year in self.years]
+        for group in groups:
+            rows = [self.years.index(year) for year in group]
+            temperature = 12
+            if 'temp_air' in self.weather:
+                temp_air = self.weather['temp_air'][rows]
+                count = (~np.isnan(temp_air)).sum(axis=0)
+                temperature = np.where(count > 0, np.nansum(temp_air, axis=0) / np.maximum(count, 1), 12)
+            shared = simulation.solar_geometry(location, self.grid_times(group[0]), temperature=temperature)
+            for column in columns:
+                batch[column][rows] = shared[column].to_numpy()
+        self.groups = groups
+        return batch
+
+    def monthly_energy(self, power : np.ndarray):
+        # (year, month) energy in kWh of a (year, time) power array in W, and the share of every
+        # year-month's grid steps with data
+        months = np.repeat(self.day_month, self.per_day) - 1
+        totals = np.zeros((len(self.years), 12))
+        coverage = np.zeros((len(self.years), 12))
+        expected = np.bincount(months, minlength=12).astype(float)
+        for i, year in enumerate(self.years):
+            if time_axis.days_from_civil(year, 3, 1) - time_axis.days_from_civil(year, 2, 1) == 28:
+                expected_year = expected - np.eye(12)[1] * self.per_day # no 29 February
+            else:
+                expected_year = expected
+            totals[i] = np.bincount(months, weights=np.nan_to_num(power[i]), minlength=12) * self.step / 3.6e12 / 1000
+            coverage[i] = np.bincount(months, weights=self.present[i], minlength=12) / expected_year
+        return totals, coverage
+
+
+def run_years(site : dict, systems : dict, batch : YearBatch, tolerance : float = share_tolerance):
+    # {'per_year': energy per (system, year, month), 'statistics': across years per (system, month)}
+    location = simulation.make_location(site)
+    geometry = batch.geometry(location, tolerance)
+    module, inverter = simulation.load_components()
+    # The model chain runs on blocks of `block_days` grid days of all years at once, which bounds
+    # its intermediates to a block while still batching the years
+    block = block_days * batch.per_day
+
+    per_year = []
+    statistics = []
+    for name, (tilt, az) in systems.items():
+        ac = np.empty((len(batch.years), batch.n))
+        for start in range(0, batch.n, block):
+            columns = slice(start, start + block)
+            result = simulation.run_arrays({column: values[:, columns].ravel() for column, values in geometry.items()},
+                                           {column: values[:, columns].ravel() for column, values in batch.weather.items()},
+                                           tilt, az, module, inverter)
+            ac[:, columns] = np.asarray(result['ac']).reshape(len(batch.years), -1)
+            telemetry.add_rows('model', ac[:, columns].size)
+        monthly, coverage = batch.monthly_energy(ac)
+        for i, year in enumerate(batch.years):
+            per_year.append(pd.DataFrame({'system' : name, 'year' : year, 'month' : np.arange(1, 13),
+                                          'energy_kwh' : monthly[i], 'coverage' : coverage[i]}))
+
+        complete = np.where(coverage >= min_coverage, monthly, np.nan)
+        with np.errstate(all='ignore'):
+            annual = np.where(np.all(coverage >= min_coverage, axis=1), monthly.sum(axis=1), np.nan)
+        for month, values in [(str(m + 1), complete[:, m]) for m in range(12)] + [('year', annual)]:
+            values = values[~np.isnan(values)]
+            statistics.append({'system' : name, 'month' : month, 'years' : len(values),
+                               'mean_kwh' : values.mean() if len(values) else np.nan,
+                               'min_kwh' : values.min() if len(values) else np.nan,
+                               'max_kwh' : values.max() if len(values) else np.nan,
+                               'p90_kwh' : np.percentile(values, 10) if len(values) else np.nan})
+    return {'per_year' : pd.concat(per_year, ignore_index=True), 'statistics' : pd.DataFrame(statistics)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Monthly energy of several weather years in one batched run")
+    parser.add_argument('weather', nargs='+', help="StarkeDFC files of the site, e.g. one per year")
+    parser.add_argument('--years', type=int, nargs='*', default=None, help="Default: every year in the files")
+    parser.add_argument('--tolerance', type=float, default=share_tolerance,
+                        help="Degrees within which years share solar geometry, 0 to never share")
+    parser.add_argument('--output-dir', default="MY_" + time.strftime("%Y_%m_%d_%H-%M"))
+    telemetry.add_arguments(parser)
+    args = parser.parse_args()
+
+    site = {'name' : 'Turku', 'latitude' : 60.45, 'longitude' : 22.29, 'altitude' : 50, 'tz' : 'Europe/Helsinki'}
+    systems = {'E' : (90, 90), 'S' : (30, 180), 'W' : (90, 270)}
+
+    start_time = time.time()
+    with telemetry.from_args('multi_year', args):
+        batch = YearBatch.from_files(args.weather, site['tz'], args.years)
+        results = run_years(site, systems, batch, args.tolerance)
+    print("Years", batch.years, "in geometry groups", batch.groups)
+    print(results['statistics'].to_string(index=False))
+    os.makedirs(args.output_dir, exist_ok=True)
+    for name, table in results.items():
+        table.to_csv(os.path.join(args.output_dir, name + ".csv"), index=False)
+    print("Simulation finished in: ", "{:.2f}".format(time.time() - start_time), "seconds.")
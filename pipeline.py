@@ -0,0 +1,218 @@
+import argparse
+import calendar
+import os
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import simulation
+import energy
+import time_axis
+import telemetry
+
+
+# Pipelined execution ----------------------------------------------------------------------------
+#
+# Real_weather_production.py reads the whole weather file, then models every system, then writes
+# the month CSVs, so only the disk or only the CPU is busy at any time. Here the same work runs as
+# four stages connected by bounded queues:
+#
+#   read        the weather file, `chunk_rows` rows at a time (simulation.read_weather_chunks)
+#   model       solar geometry and every system of a chunk, on a process pool
+#   aggregate   energy rollup and monthly average day partials, in chunk order
+#   write       month production CSVs, appended chunk by chunk by `writers` I/O threads
+#
+# A queue holds at most `depth` items, so a fast reader cannot pile the year up in memory in
+# front of a slower stage. All stages run at once and the wall time tends to that of the slowest
+# stage instead of the sum of all of them. A file is always written by the same writer thread
+# (picked by a CRC of its path, so the split is the same in every run), so its chunks are
+# appended in order. The busy time of every stage is reported at the end.
+
+site = {'name' : 'Turku', 'latitude' : 60.45, 'longitude' : 22.29, 'altitude' : 50, 'tz' : 'Europe/Helsinki'}
+systems = {'E' : (90, 90), 'S' : (30, 180), 'W' : (90, 270)} # (surface_tilt, surface_azimuth)
+
+chunk_rows = 50000
+depth = 4
+writers = 2
+
+_done = object()
+
+
+class Stages:
+    # Busy seconds and rows per stage, updated from several threads
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds = {}
+        self.rows = {}
+
+    def add(self, stage : str, seconds : float, rows : int):
+        with self._lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+            self.rows[stage] = self.rows.get(stage, 0) + rows
+        telemetry.add_rows(stage, rows)
+
+    def table(self, wall : float):
+        table = pd.DataFrame({'busy_s' : pd.Series(self.seconds), 'rows' : pd.Series(self.rows)})
+        table['rows_per_s'] = table['rows'] / table['busy_s']
+        table['busy_share'] = table['busy_s'] / wall
+        return table
+
+
+def _model_chunk(site : dict, systems : dict, weather : pd.DataFrame):
+    # AC power of every system over one weather chunk (runs in a worker process)
+    begin = time.time()
+    location = simulation.make_location(site)
+    geometry = simulation.solar_geometry(location, weather.index, temperature=weather['temp_air'].to_numpy())
+    ac = pd.DataFrame({name: simulation.run_system(geometry, weather, tilt, az)['ac']
+                       for name, (tilt, az) in systems.items()}, index=weather.index)
+    return ac, time.time() - begin
+
+
+def production_path(output_dir : str, system : str, month : int, kind : str = 'production'):
+    # Same names as Real_weather_production.py, e.g. 1SJanuary_production.csv
+    return os.path.join(output_dir, str(month) + system + calendar.month_name[month] + "_" + kind + ".csv")
+
+
+def _put(q : queue.Queue, item, stop : threading.Event):
+    # Blocks while the queue is full, unless another stage has failed
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def _get(q : queue.Queue, stop : threading.Event):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _done
+
+
+def run_pipeline(weather_path : str, site : dict = site, systems : dict = systems, output_dir : str = None,
+                 chunk_rows : int = chunk_rows, workers : int = None, depth : int = depth, writers : int = writers):
+    # {'energy': rollup table, 'average_day': {system: profile}, 'stages': busy time per stage}
+    workers = workers or os.cpu_count()
+    stages = Stages()
+    stop = threading.Event()
+    errors = []
+    chunks = queue.Queue(depth)
+    modelled = queue.Queue(depth + workers) # futures in chunk order, `workers` of them running
+    writes = [queue.Queue(depth) for _ in range(writers)]
+
+    rollup = energy.EnergyRollup()
+    kwp = energy.rated_kwp(simulation.load_components()[0])
+    average_days = {name: time_axis.AverageDay() for name in systems}
+
+    def stage(function):
+        def run():
+            try:
+                function()
+            except BaseException as error:
+                errors.append(error)
+                stop.set()
+        return threading.Thread(target=run, daemon=True)
+
+    def read():
+        reader = simulation.read_weather_chunks(weather_path, site['tz'], chunk_rows)
+        while True:
+            begin = time.time()
+            weather = next(reader, None)
+            if weather is None:
+                break
+            stages.add('read', time.time() - begin, len(weather))
+            telemetry.add_units()
+            _put(chunks, weather, stop)
+        _put(chunks, _done, stop)
+
+    def model():
+        while (weather := _get(chunks, stop)) is not _done:
+            _put(modelled, pool.submit(_model_chunk, site, systems, weather), stop)
+        _put(modelled, _done, stop)
+
+    def aggregate():
+        started = set()
+        step = None
+        while (future := _get(modelled, stop)) is not _done:
+            ac, seconds = future.result()
+            stages.add('model', seconds, len(ac))
+            begin = time.time()
+            if step is None and len(ac) > 1:
+                step = energy.step_hours(ac.index)
+            for name in systems:
+                rollup.add(name, 'ac', ac[name], step=step, kwp=kwp)
+                average_days[name].add(ac[name].to_numpy(), ac.index)
+            if output_dir is not None:
+                for month, part in ac.groupby(ac.index.month):
+                    for name in systems:
+                        path = production_path(output_dir, name, month)
+                        frame = part[[name]].set_axis(['Power'], axis=1)
+                        _put(writes[zlib.crc32(path.encode()) % writers], (path, frame, path not in started), stop)
+                        started.add(path)
+            stages.add('aggregate', time.time() - begin, len(ac))
+            telemetry.unit_done()
+        for q in writes:
+            _put(q, _done, stop)
+
+    def write(q):
+        def run():
+            while (item := _get(q, stop)) is not _done:
+                path, frame, first = item
+                begin = time.time()
+                frame.to_csv(path, mode='w' if first else 'a', header=first)
+                stages.add('write', time.time() - begin, len(frame))
+        return run
+
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    begin = time.time()
+    with ProcessPoolExecutor(workers) as pool:
+        threads = [stage(read), stage(model), stage(aggregate)] + [stage(write(q)) for q in writes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            for future in list(modelled.queue):
+                if future is not _done:
+                    future.cancel()
+    if errors:
+        raise errors[0]
+
+    profiles = {name: average_day.profile() for name, average_day in average_days.items()}
+    if output_dir is not None:
+        for name, profile in profiles.items():
+            for month in profile.columns:
+                profile[month].rename('Power').to_csv(production_path(output_dir, name, month, 'avg_production'))
+        rollup.table().to_csv(os.path.join(output_dir, 'energy.csv'), index=False)
+    return {'energy' : rollup.table(), 'average_day' : profiles, 'stages' : stages.table(time.time() - begin)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Real weather production with overlapping read, model and write stages")
+    parser.add_argument('weather', nargs='?', default='IrrData2019_StarkeDFC_230704.csv')
+    parser.add_argument('--output-dir', default="RW_" + time.strftime("%Y_%m_%d_%H-%M"))
+    parser.add_argument('--chunk-rows', type=int, default=chunk_rows)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--depth', type=int, default=depth, help="Items each queue holds at most")
+    parser.add_argument('--writers', type=int, default=writers, help="Output I/O threads")
+    telemetry.add_arguments(parser)
+    args = parser.parse_args()
+
+    start_time = time.time()
+    with telemetry.from_args('pipeline', args):
+        results = run_pipeline(args.weather, output_dir=args.output_dir, chunk_rows=args.chunk_rows,
+                               workers=args.workers, depth=args.depth, writers=args.writers)
+    table = results['energy']
+    print(table[table['level'] == 'year'].to_string(index=False))
+    print(results['stages'].to_string())
+    print("Simulation finished in: ", "{:.2f}".format(time.time() - start_time), "seconds.")
@@ -0,0 +1,183 @@
+import re
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+import simulation
+import scenario
+import time_axis
+
+
+# Memory-budgeted execution ----------------------------------------------------------------------
+#
+# Splits every (site, time range) of a scenario into time chunks and system groups whose working
+# set fits a memory budget, runs the chunks (in parallel when several fit at once) and merges the
+# partial outputs. Chunks are cut at local midnight whenever at least a whole day fits, so daily
+# energy is summed over exactly the same rows as in an unchunked run.
+#
+# The working set per time row is measured once per process with tracemalloc on a short probe
+# run: the peak of solar geometry + clear sky (shared by all systems of a chunk) and the peak of
+# one system's model chain. Full-resolution outputs ('ac', 'dc', 'poa_global') are kept for the
+# whole run and are charged against the budget up front; aggregate outputs are negligible.
+#
+# A weather file is parsed once (scenario.load_weather_file) and every chunk slices the same
+# parsed copy, so it is charged once, as `fixed`, however many chunks run at once.
+
+memory_units = {'' : 1, 'K' : 2**10, 'M' : 2**20, 'G' : 2**30, 'T' : 2**40}
+
+probe_rows = 14400
+# Bytes per row of a kept output series (values and its index)
+series_row_bytes = 16
+
+
+def parse_memory(value):
+    # '2GB', '512M', '1.5 GiB' or a number of bytes
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = re.fullmatch(r'\s*([0-9.]+)\s*([kKmMgGtT]?)(i?[bB])?\s*', str(value))
+    if match is None:
+        raise ValueError("Cannot parse memory size: " + str(value))
+    return int(float(match.group(1)) * memory_units[match.group(2).upper()])
+
+
+def format_memory(size : float):
+    for unit in ['T', 'G', 'M', 'K']:
+        if size >= memory_units[unit]:
+            return "{:.1f} {}B".format(size / memory_units[unit], unit)
+    return "{:.0f} B".format(size)
+
+
+@lru_cache(maxsize=None)
+def row_costs():
+    # (shared bytes per row, bytes per row per system) from a probe run
+    location = simulation.make_location({'name' : 'probe', 'latitude' : 60.45, 'longitude' : 22.29,
+                                         'altitude' : 25, 'tz' : 'Etc/GMT-2'})
+    times = pd.date_range('2021-06-01', periods=probe_rows, freq='1min', tz='Etc/GMT-2')
+    # Warm-up, so catalogue loading and other one-off caches are not charged per row
+    geometry = simulation.solar_geometry(location, times[:60])
+    simulation.run_system(geometry, simulation.clear_sky(location, geometry), 30, 180)
+
+    tracemalloc.start()
+    geometry = simulation.solar_geometry(location, times)
+    weather = simulation.clear_sky(location, geometry)
+    shared = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    simulation.run_system(geometry, weather, 30, 180)
+    per_system = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return shared / probe_rows, per_system / probe_rows
+
+
+def plan(n_rows : int, n_systems : int, max_memory : int, workers : int = 1, series : int = 0,
+         fixed : int = 0, min_rows : int = 1440):
+    # Rows per time chunk, systems per group and chunks run at once so that the kept series,
+    # `fixed` bytes (e.g. a loaded weather file) and the running chunks fit in `max_memory`
+    shared, per_system = row_costs()
+    kept = n_rows * n_systems * series * series_row_bytes
+    budget = max_memory - kept - fixed
+    if budget <= 0:
+        raise ValueError("The requested series outputs alone need " + format_memory(kept + fixed) +
+                         "; request aggregate outputs or raise the memory budget")
+
+    # All systems of a chunk share its solar geometry, so groups are only split when not even
+    # `min_rows` rows (a day at 1 minute) fit with every system
+    systems = n_systems
+    if budget < min_rows * (shared + systems * per_system):
+        systems = int(min(max((budget / min_rows - shared) // per_system, 1), n_systems))
+    row = shared + systems * per_system
+    rows = int(budget // row)
+    if rows < 1:
+        raise ValueError("A memory budget of " + format_memory(max_memory) + " cannot fit a single row")
+
+    if rows >= n_rows and systems == n_systems:
+        parallel, rows = 1, n_rows
+    else:
+        parallel = int(max(1, min(workers, rows // min_rows)))
+        rows = rows // parallel
+    return {'rows' : min(rows, n_rows),
+            'systems' : systems,
+            'parallel' : parallel,
+            'row_bytes' : row,
+            'peak' : kept + fixed + parallel * min(rows, n_rows) * row}
+
+
+def split_rows(times, rows : int):
+    # [start, stop) ranges of at most `rows` rows, cut at local midnight whenever a day fits
+    days = time_axis.local_ns(times) // time_axis.day_ns
+    day_starts = np.flatnonzero(np.diff(days)) + 1
+    n = len(days)
+    ranges = []
+    start = 0
+    while start < n:
+        stop = min(start + rows, n)
+        if stop < n:
+            i = np.searchsorted(day_starts, stop, side='right') - 1
+            if i >= 0 and day_starts[i] > start:
+                stop = int(day_starts[i])
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+def range_times(site : dict, time_range : dict):
+    # Time steps of a (site, time range) and the bytes held by its loaded weather file
+    tz = scenario.site_key(site)[3]
+    source = site.get('weather', 'clearsky')
+    if source == 'clearsky':
+        return time_axis.TimeAxis.from_range(time_range['start'], time_range['end'],
+                                             time_range.get('freq', '1min'), tz), 0
+    weather = scenario.load_weather_file(source, tz)
+    selected = scenario.select_weather(weather, time_range['start'], time_range['end'])
+    return selected.index, int(weather.memory_usage(deep=True).sum())
+
+
+def chunk_range(time_range : dict, times, start : int, stop : int):
+    # The time range restricted to rows [start, stop). The ends are tz-aware Timestamps, since
+    # strings with different UTC offsets (across a DST change) cannot slice an index.
+    if isinstance(times, time_axis.TimeAxis):
+        first, last = times.slice(start, stop).to_index()[[0, -1]]
+    else:
+        first, last = times[start], times[stop - 1]
+    return dict(time_range, start=first, end=last)
+
+
+def run_planned_units(config : dict, max_memory, workers : int = 1, checkpoint_dir : str = None):
+    # Same unfinished outputs as scenario.run_units, computed in chunks that fit `max_memory`
+    max_memory = parse_memory(max_memory)
+    series = sum(output in scenario.series_outputs for output in config['outputs'])
+    systems = config['systems']
+    parts = {}
+
+    for site in config['sites']:
+        for time_range in config['time_ranges']:
+            times, fixed = range_times(site, time_range)
+            p = plan(len(times), len(systems), max_memory, workers, series, fixed)
+            ranges = split_rows(times, p['rows'])
+            groups = [systems[i:i + p['systems']] for i in range(0, len(systems), p['systems'])]
+            print(site['name'], time_range['name'] + ":", len(ranges), "time chunks x", len(groups),
+                  "system groups,", p['parallel'], "at once, estimated peak", format_memory(p['peak']))
+
+            jobs = [dict(config, sites=[site], systems=group, time_ranges=[chunk_range(time_range, times, start, stop)])
+                    for start, stop in ranges for group in groups]
+            threads = max(workers // p['parallel'], 1)
+            with ThreadPoolExecutor(p['parallel']) as pool:
+                # map keeps the submission order, so parts of a unit are collected in time order
+                for results in pool.map(lambda job: scenario.run_units(job, threads, checkpoint_dir), jobs):
+                    for unit, unit_outputs in results.items():
+                        for output, value in unit_outputs.items():
+                            parts.setdefault(unit, {}).setdefault(output, []).append(value)
+
+    merged = {unit: {output: scenario.merge_parts(output, values) for output, values in unit_parts.items()}
+              for unit, unit_parts in parts.items()}
+    order = [(site['name'], system['name'], time_range['name']) for site in config['sites']
+             for time_range in config['time_ranges'] for system in systems]
+    return {unit: merged[unit] for unit in order}
+
+
+def run_planned(config : dict, max_memory, workers : int = 1, checkpoint_dir : str = None):
+    # Same results as scenario.run_scenario, computed in chunks that fit `max_memory`
+    return scenario.finish(run_planned_units(config, max_memory, workers, checkpoint_dir))
@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+
+import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+
+
+# Downsampled plotting for long (annual, 1-minute) series -------------------------------------------
+#
+# Drawing 525k points per line is slow and freezes interactive backends, while the figure can only
+# show about one value per pixel column anyway. The helpers below pick a shape-preserving subset of
+# the samples (min/max per pixel or LTTB) sized to the axes' pixel width before anything is drawn.
+
+# Series shorter than this many points per pixel column are drawn as they are
+points_per_pixel = 2
+
+
+def minmax_indices(y : np.ndarray, n_bins : int):
+    # Keeps the first, the minimum and the maximum sample of each bin, so every peak and trough
+    # visible at pixel resolution survives.
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n_bins <= 0 or n <= 2 * n_bins:
+        return np.arange(n)
+
+    size = int(np.ceil(n / n_bins))
+    n_bins = int(np.ceil(n / size))
+
+    # Pad the last bin so the array can be reshaped to (bins, size); NaNs never win min or max
+    padded = np.full(n_bins * size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(n_bins, size)
+    lows = np.where(np.isnan(padded), np.inf, padded).argmin(axis=1)
+    highs = np.where(np.isnan(padded), -np.inf, padded).argmax(axis=1)
+
+    offsets = np.arange(n_bins) * size
+    idx = np.concatenate([offsets, offsets + lows, offsets + highs, [n - 1]])
+    idx = np.unique(idx)
+    return idx[idx < n]
+
+
+def lttb_indices(y : np.ndarray, n_out : int, x : np.ndarray = None):
+    # Largest-Triangle-Three-Buckets (Steinarsson 2013): picks the point of each bucket that forms
+    # the largest triangle with the previous pick and the mean of the next bucket.
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+    n = len(y)
+    if n_out < 3 or n <= n_out:
+        return np.arange(n)
+    x = np.arange(n, dtype=float) if x is None else np.asarray(x, dtype=float)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    idx = np.empty(n_out, dtype=int)
+    idx[0] = 0
+    idx[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        idx[i + 1] = a
+    return idx
+
+
+def downsample(series : pd.Series, n_out : int, method : str = 'minmax'):
+    # Returns the subset of `series` that is drawn in place of the full series
+    if method == 'minmax':
+        idx = minmax_indices(series.to_numpy(), n_out // 2)
+    elif method == 'lttb':
+        idx = lttb_indices(series.to_numpy(), n_out)
+    elif method is None or method == 'none':
+        return series
+    else:
+        raise ValueError("Unknown downsampling method: " + str(method))
+    return series.iloc[idx]
+
+
+def pixel_width(ax):
+    # Width of the axes in display pixels, i.e. the number of columns a line can occupy
+    return max(int(ax.get_window_extent().width), 1)
+
+
+def plot_series(ax, series : pd.Series, *args, method : str = 'minmax', n_out : int = None, **kwargs):
+    # Drop-in replacement for ax.plot(series) that downsamples to the axes' pixel width first
+    if n_out is None:
+        n_out = points_per_pixel * pixel_width(ax)
+    series = downsample(series, n_out, method)
+    return ax.plot(series.index, series.to_numpy(), *args, **kwargs)
+
+
+def comparison_plot(series : dict,
+                    path : str = None,
+                    title : str = None,
+                    xlabel : str = None,
+                    ylabel : str = None,
+                    method : str = 'minmax',
+                    figsize : tuple = (12, 5),
+                    dpi : int = 100):
+    # Plots several labelled series on one axes. With a path the figure is rendered straight to
+    # PNG/SVG (chosen by the file extension) without touching pyplot or an interactive backend.
+    if path is None:
+        fig = plt.figure(figsize=figsize, dpi=dpi)
+    else:
+        fig = Figure(figsize=figsize, dpi=dpi)
+    ax = fig.add_subplot()
+
+    for label, s in series.items():
+        plot_series(ax, s, method=method, label=label)
+
+    if title is not None:
+        ax.set_title(title)
+    if xlabel is not None:
+        ax.set_xlabel(xlabel)
+    if ylabel is not None:
+        ax.set_ylabel(ylabel)
+    ax.legend()
+
+    if path is None:
+        plt.show()
+    else:
+        fig.savefig(path)
+    return fig
@@ -0,0 +1,195 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+
+
+# Resolution pyramid for simulated power ---------------------------------------------------------
+#
+# Each (site, system) series is stored at several pre-aggregated levels, each built from the one
+# below it. Every level keeps sum, min, max and count per bin (the mean is sum / count), so any
+# coarser bin can be rebuilt exactly from any finer one. A query reads only the coarsest level
+# whose bins divide the requested bins and line up with the requested range, e.g. daily energy
+# for a year reads 365 rows instead of 525 600.
+#
+# Layout: <directory>/<site>/<system>/<level>/<column>.npy (bin starts in 'time' and one file per
+# stat) plus meta.json with the time zone and base step. Bin starts are stored as UTC nanoseconds
+# and bins follow the local calendar of the site. Plain .npy files are memory mapped, so a query
+# only reads the rows it selects.
+
+levels = ['1min', '15min', '1h', '1D', '1MS']
+stats = ['sum', 'mean', 'min', 'max', 'count']
+
+
+def _is_month(offset):
+    return isinstance(offset, pd.offsets.MonthBegin)
+
+
+def _check_freq(freq : str):
+    # Bins of a query are a fixed length or whole months; weeks, years etc. have no stored level
+    offset = to_offset(freq)
+    if _is_month(offset):
+        return offset
+    try:
+        offset.nanos
+    except ValueError:
+        raise ValueError("Bins must be a fixed length (e.g. '15min', '1h', '1D') or month starts "
+                         "(e.g. '1MS'), not " + str(freq)) from None
+    return offset
+
+
+def _divides(level : str, freq : str):
+    # True if every bin of `freq` is made of whole bins of `level`
+    level, freq = to_offset(level), to_offset(freq)
+    if _is_month(freq):
+        return (_is_month(level) and freq.n % level.n == 0) or (not _is_month(level) and 86400 * 10**9 % level.nanos == 0)
+    if _is_month(level):
+        return False
+    return freq.nanos % level.nanos == 0
+
+
+def _aligned(timestamp : pd.Timestamp, level : str):
+    if timestamp is None:
+        return True
+    offset = to_offset(level)
+    if _is_month(offset):
+        return timestamp == timestamp.normalize() and timestamp.day == 1
+    return timestamp == timestamp.floor(offset)
+
+
+def _combine(frame : pd.DataFrame, freq : str):
+    # Re-aggregates sum/min/max/count bins into coarser `freq` bins
+    grouped = frame.resample(freq)
+    combined = pd.DataFrame({'sum' : grouped['sum'].sum(),
+                             'min' : grouped['min'].min(),
+                             'max' : grouped['max'].max(),
+                             'count' : grouped['count'].sum()})
+    combined = combined[combined['count'] > 0]
+    combined['mean'] = combined['sum'] / combined['count']
+    return combined[stats]
+
+
+class PyramidStore:
+
+    def __init__(self, directory : str):
+        self.directory = directory
+
+    def _path(self, site : str, system : str, name : str = None):
+        path = os.path.join(self.directory, str(site).replace(os.sep, '_'), str(system).replace(os.sep, '_'))
+        return path if name is None else os.path.join(path, name)
+
+    def write(self, site : str, system : str, power : pd.Series):
+        # Builds and stores every level at or coarser than the step of a series with a regular,
+        # time zone aware index. Finer levels would only repeat the input under a wrong bin width.
+        path = self._path(site, system)
+        os.makedirs(path, exist_ok=True)
+        tz = str(power.index.tz) if power.index.tz is not None else None
+        step = float(np.median(np.diff(np.asarray(power.index[:1000], dtype='datetime64[ns]').view('int64')))) / 1e9
+
+        frame = pd.DataFrame({'sum' : power.to_numpy(dtype=float), 'min' : power.to_numpy(dtype=float),
+                              'max' : power.to_numpy(dtype=float), 'count' : (~power.isna()).to_numpy(dtype=float)},
+                             index=power.index)
+        frame['sum'] = frame['sum'].fillna(0)
+        stored = [level for level in levels if _is_month(to_offset(level)) or to_offset(level).nanos >= round(step * 1e9)]
+        for level in stored:
+            frame = _combine(frame, level)
+            os.makedirs(self._path(site, system, level), exist_ok=True)
+            columns = {'time' : np.asarray(frame.index.tz_convert('UTC') if tz else frame.index, dtype='datetime64[ns]').view('int64')}
+            columns.update({stat: frame[stat].to_numpy() for stat in stats})
+            for column, values in columns.items():
+                np.save(self._path(site, system, os.path.join(level, column + '.npy')), values)
+            frame = frame.drop(columns='mean')
+
+        with open(self._path(site, system, 'meta.json'), 'w') as f:
+            json.dump({'tz' : tz, 'step_seconds' : step, 'levels' : stored}, f)
+
+    def meta(self, site : str, system : str):
+        with open(self._path(site, system, 'meta.json')) as f:
+            return json.load(f)
+
+    def entries(self):
+        # Stored (site, system) pairs
+        found = []
+        for site in sorted(os.listdir(self.directory)):
+            if not os.path.isdir(os.path.join(self.directory, site)):
+                continue
+            for system in sorted(os.listdir(os.path.join(self.directory, site))):
+                if os.path.isdir(self._path(site, system)) and os.path.exists(self._path(site, system, 'meta.json')):
+                    found.append((site, system))
+        return found
+
+    def choose_level(self, freq : str, start : pd.Timestamp = None, end : pd.Timestamp = None, available : list = None):
+        # Coarsest level that can answer `freq` bins over [start, end), out of the `available`
+        # levels of a series (see meta()['levels']; default every level)
+        _check_freq(freq)
+        for level in reversed(levels if available is None else available):
+            if _divides(level, freq) and _aligned(start, level) and _aligned(end, level):
+                return level
+        raise ValueError("No stored level can answer " + str(freq) + " bins for this range")
+
+    def read_level(self, site : str, system : str, level : str, start=None, end=None):
+        # Rows of one level with bin start in [start, end), as a DataFrame of all stats
+        tz = self.meta(site, system)['tz']
+
+        def column(name):
+            return np.load(self._path(site, system, os.path.join(level, name + '.npy')), mmap_mode='r')
+
+        time = column('time')
+        lo = 0 if start is None else int(np.searchsorted(time, _utc_ns(start, tz)))
+        hi = len(time) if end is None else int(np.searchsorted(time, _utc_ns(end, tz)))
+        # Only the selected rows are copied out of the maps, which are released with them
+        index = pd.DatetimeIndex(np.array(time[lo:hi]).astype('datetime64[ns]'))
+        index = index.tz_localize('UTC').tz_convert(tz) if tz else index
+        return pd.DataFrame({stat: np.array(column(stat)[lo:hi]) for stat in stats}, index=index)
+
+    def query(self, site : str, system : str, freq : str, start=None, end=None, stat : str = None):
+        # Aggregates over `freq` bins with bin start in [start, end). `stat` selects one column.
+        meta = self.meta(site, system)
+        start, end = _timestamp(start, meta['tz']), _timestamp(end, meta['tz'])
+        level = self.choose_level(freq, start, end, meta['levels'])
+        frame = self.read_level(site, system, level, start, end)
+        if level != freq:
+            frame = _combine(frame, freq)
+        return frame if stat is None else frame[stat]
+
+    def energy(self, site : str, system : str, freq : str = '1D', start=None, end=None):
+        # Energy in kWh per bin
+        step_hours = self.meta(site, system)['step_seconds'] / 3600
+        return self.query(site, system, freq, start, end, stat='sum') * step_hours / 1000
+
+    def profile(self, site : str, system : str, month : int, freq : str = '15min', year : int = None):
+        # Average day profile of a month in `freq` bins, indexed by 'HH:MM'
+        meta = self.meta(site, system)
+        tz = meta['tz']
+        level = self.choose_level(freq, available=meta['levels'])
+        if year is None:
+            frame = self.read_level(site, system, level)
+            frame = frame[frame.index.month == month]
+        else:
+            start = pd.Timestamp(year=year, month=month, day=1, tz=tz)
+            frame = self.read_level(site, system, level, start, start + pd.offsets.MonthBegin(1))
+        if level != freq:
+            frame = _combine(frame, freq)
+        minute = frame.index.hour * 60 + frame.index.minute
+        grouped = frame.groupby(minute)
+        mean = grouped['sum'].sum() / grouped['count'].sum()
+        mean.index = ["%02d:%02d" % (m // 60, m % 60) for m in mean.index]
+        return mean
+
+
+def _timestamp(value, tz : str):
+    if value is None:
+        return None
+    value = pd.Timestamp(value)
+    if tz and value.tz is None:
+        value = value.tz_localize(tz)
+    return value
+
+
+def _utc_ns(value, tz : str):
+    value = _timestamp(value, tz)
+    if value.tz is not None:
+        value = value.tz_convert('UTC').tz_localize(None)
+    return np.datetime64(value, 'ns').view('int64')
@@ -0,0 +1,523 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial, lru_cache
+
+import pandas as pd
+
+import simulation
+import energy
+import result_store
+import time_axis
+import checkpoint
+import shading
+import telemetry
+
+
+# Scenario files ---------------------------------------------------------------------------------
+#
+# A scenario is a JSON file listing sites, systems, time ranges and requested outputs, e.g.
+#
+# {
+#     "name": "december_comparison",
+#     "sites": [{"name": "Turku", "latitude": 60.45, "longitude": 22.29, "altitude": 25,
+#                "tz": "Etc/GMT-2", "weather": "clearsky"}],
+#     "systems": [{"name": "E", "surface_tilt": 90, "surface_azimuth": 90},
+#                 {"name": "S", "surface_tilt": 30, "surface_azimuth": 180}],
+#     "time_ranges": [{"name": "2021", "start": "2021-01-01", "end": "2021-12-31", "freq": "1min"}],
+#     "outputs": ["ac", "monthly_average_day", "energy"]
+# }
+#
+# An optional top-level "solar_position" selects a strategy from solar_position.py, either as a
+# name ("interpolated") or with arguments ({"strategy": "interpolated", "step": "10min"}).
+#
+# A site's "weather" is either "clearsky" (default) or the path of a StarkeDFC weather file, in
+# which case the time range selects rows of the file. Sites may describe a "horizon" and
+# "obstructions" for shading (see shading.py). Systems may override "module", "inverter" and
+# "albedo".
+#
+# Instead of (or next to) "outputs", a scenario may list "requests" for specific results, e.g.
+#
+#     "requests": [{"name": "december_bifacial_vs_monofacial", "output": "monthly_average_day",
+#                   "months": [12], "groups": {"bifacial": ["E", "W"], "monofacial": ["S"]}}]
+#
+# A request only simulates the requested months of each time range (plus "warmup", if the
+# temperature model needs one) and only the systems in its groups (all systems without groups),
+# and sums the systems of each group. "output" is "monthly_average_day" (AC) or "energy", and
+# "sites" optionally restricts the sites.
+#
+# Every (site, system, time range) is run through a task graph. Nodes are keyed by the parameters
+# they depend on rather than by names, so the time axis, solar geometry, clear sky and weather
+# load of a site are computed once and fanned out to all systems that need them, and two sites
+# or systems with identical parameters share all of their work.
+
+def load_scenario(path : str):
+    with open(path) as f:
+        scenario = json.load(f)
+    for field in ['sites', 'systems', 'time_ranges']:
+        if not scenario.get(field):
+            raise ValueError("Scenario " + path + " has no " + field)
+    scenario.setdefault('name', os.path.splitext(os.path.basename(path))[0])
+    scenario.setdefault('outputs', [] if scenario.get('requests') else ['ac'])
+    for output in scenario['outputs']:
+        if output not in outputs:
+            raise ValueError("Unknown output: " + str(output))
+    for request in scenario.get('requests', []):
+        if request.get('output') not in request_outputs:
+            raise ValueError("Unknown request output: " + str(request.get('output')))
+    return scenario
+
+
+# Outputs ----------------------------------------------------------------------------------------
+#
+# Aggregate outputs are computed as partial results that merge exactly (daily energy sums, sums
+# and counts of the average day) and only finalized into tables when a run is complete, so a
+# range computed in time chunks gives the same result as one computed at once.
+
+def monthly_average_day(result : pd.DataFrame):
+    # Average day profile of every month, one column per month and 'HH:MM' rows once
+    # finalized, like the df_by_month_avg dicts of the scripts
+    return time_axis.AverageDay().add(result['ac'].to_numpy(), result.index)
+
+
+def energy_rollup(result : pd.DataFrame):
+    r = energy.EnergyRollup()
+    r.add(None, 'ac', result['ac'])
+    r.add(None, 'dc', result['p_mp'])
+    return r
+
+
+outputs = {'ac' : lambda result: result['ac'],
+           'dc' : lambda result: result['p_mp'],
+           'poa_global' : lambda result: result['poa_global'],
+           'monthly_average_day' : monthly_average_day,
+           'energy' : energy_rollup}
+
+# Outputs that are full-resolution series, kept in memory for the whole run
+series_outputs = ['ac', 'dc', 'poa_global']
+
+# Model chain columns each output reads; system results keep only these
+output_columns = {'ac' : ['ac'],
+                  'dc' : ['p_mp'],
+                  'poa_global' : ['poa_global'],
+                  'monthly_average_day' : ['ac'],
+                  'energy' : ['ac', 'p_mp']}
+
+finalize = {'monthly_average_day' : lambda value: value.profile(),
+            'energy' : lambda value: value.table()}
+
+
+def merge_parts(output : str, parts : list):
+    # Joins the outputs of consecutive time chunks of one unit, given in time order
+    if output in series_outputs:
+        return pd.concat(parts)
+    merged = parts[0]
+    for part in parts[1:]:
+        merged = merged.merge(part)
+    return merged
+
+
+def finish(results : dict):
+    # Turns the partial aggregates of every unit into tables
+    return {unit: {output: finalize[output](value) if output in finalize else value
+                   for output, value in unit_outputs.items()}
+            for unit, unit_outputs in results.items()}
+
+
+def energy_table(scenario : dict, results : dict):
+    # Combines the 'energy' output of every unit into one rollup table
+    kwp = {system['name']: energy.rated_kwp(simulation.load_components(
+               system.get('module', simulation.module_name), system.get('inverter', simulation.inverter_name))[0])
+           for system in scenario['systems']}
+    frames = []
+    for (site, system, time_range), unit_outputs in results.items():
+        table = unit_outputs['energy'].copy()
+        table['system'] = system
+        table['specific_yield'] = table['energy_kwh'] / kwp[system]
+        table.insert(0, 'site', site)
+        table.insert(2, 'time_range', time_range)
+        frames.append(table)
+    return pd.concat(frames, ignore_index=True)
+
+
+# Task graph -------------------------------------------------------------------------------------
+
+class TaskGraph:
+
+    def __init__(self):
+        self.nodes = {}
+
+    def add(self, key : tuple, func, *deps):
+        # Adding a key that is already in the graph returns the existing node
+        telemetry.cache('task_graph', hits=key in self.nodes, misses=key not in self.nodes)
+        if key not in self.nodes:
+            self.nodes[key] = (func, deps)
+        return key
+
+    def run(self, targets : list, workers : int = 1, on_done=None):
+        # Runs everything the targets depend on, each node once, independent nodes in parallel.
+        # Threads are enough here: the heavy lifting is NumPy, which releases the GIL.
+        targets = set(targets)
+        needed = set()
+        stack = list(targets)
+        while stack:
+            key = stack.pop()
+            if key not in needed:
+                needed.add(key)
+                stack.extend(self.nodes[key][1])
+
+        waiting = {key: set(self.nodes[key][1]) for key in needed}
+        dependents = {key: [] for key in needed}
+        for key in needed:
+            for dep in self.nodes[key][1]:
+                dependents[dep].append(key)
+        # Intermediate values are dropped as soon as their last dependent has run
+        remaining = {key: len(dependents[key]) for key in needed}
+
+        values = {}
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            running = {}
+
+            def submit_ready():
+                for key in [k for k, deps in waiting.items() if not deps]:
+                    del waiting[key]
+                    func, deps = self.nodes[key]
+                    running[pool.submit(func, *[values[d] for d in deps])] = key
+
+            submit_ready()
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    values[key] = future.result()
+                    # Nodes are keyed by their kind first ('geometry', 'system', ...)
+                    rows = telemetry.count_rows(values[key])
+                    if rows:
+                        telemetry.add_rows(key[0], rows)
+                    if on_done is not None:
+                        on_done(key, values[key])
+                    for dep in self.nodes[key][1]:
+                        remaining[dep] -= 1
+                        if remaining[dep] == 0 and dep not in targets:
+                            del values[dep]
+                    for dependent in dependents[key]:
+                        waiting[dependent].discard(key)
+                submit_ready()
+
+        return {key: values[key] for key in targets}
+
+
+def site_key(site : dict):
+    return (site['latitude'], site['longitude'], site.get('altitude', 0), site.get('tz', 'UTC'))
+
+
+def make_times(start : str, end : str, freq : str, tz : str):
+    return time_axis.TimeAxis.from_range(start, end, freq, tz)
+
+
+def axis_geometry(location, axis : time_axis.TimeAxis, **kwargs):
+    # The index is only materialized here, as the input of the solar position
+    return simulation.solar_geometry(location, axis.to_index(), **kwargs)
+
+
+@lru_cache(maxsize=4)
+def _cached_weather(path : str, tz : str, size : int, mtime : float):
+    return simulation.load_weather(path, tz)
+
+
+def load_weather_file(path : str, tz : str):
+    # Parsed once per process while the file is unchanged, since chunked runs load the same
+    # file for every chunk and all of them share the one parsed copy
+    return _cached_weather(path, tz, os.path.getsize(path), os.path.getmtime(path))
+
+
+telemetry.watch_cache('weather_file', _cached_weather.cache_info)
+
+
+def select_weather(weather : pd.DataFrame, start : str, end : str):
+    return weather.loc[start:end]
+
+
+def weather_geometry(location, weather : pd.DataFrame, **kwargs):
+    temperature = weather['temp_air'].to_numpy() if 'temp_air' in weather else 12
+    return simulation.solar_geometry(location, weather.index, temperature=temperature, **kwargs)
+
+
+def solar_position_options(scenario : dict):
+    options = scenario.get('solar_position', 'spa')
+    return dict(options) if isinstance(options, dict) else {'strategy' : options}
+
+
+def run_system(system : dict, geometry : pd.DataFrame, weather : pd.DataFrame, shading_table=None, columns : list = None):
+    module, inverter = simulation.load_components(system.get('module', simulation.module_name),
+                                                  system.get('inverter', simulation.inverter_name))
+    result = simulation.run_system(geometry, weather, system['surface_tilt'], system['surface_azimuth'],
+                                   module, inverter, albedo=system.get('albedo', 0.25), shading=shading_table)
+    # Intermediates no output reads are dropped right away instead of living as long as the node
+    return result if columns is None else result[columns]
+
+
+def shading_key(site : dict):
+    return json.dumps([site.get('horizon'), site.get('obstructions')], sort_keys=True)
+
+
+def system_key(system : dict):
+    return (system['surface_tilt'], system['surface_azimuth'],
+            system.get('module', simulation.module_name), system.get('inverter', simulation.inverter_name),
+            system.get('albedo', 0.25))
+
+
+def build_graph(scenario : dict):
+    # Returns the graph and a {(site, system, time range): {output: node}} mapping
+    graph = TaskGraph()
+    targets = {}
+    position = solar_position_options(scenario)
+    position_key = tuple(sorted(position.items()))
+    # Shading tables are compiled once per distinct horizon/obstruction description
+    tables = {}
+    columns = sorted({column for output in scenario['outputs'] for column in output_columns[output]})
+
+    for site in scenario['sites']:
+        location = simulation.make_location(site)
+        skey = site_key(site)
+        tz = skey[3]
+        source = site.get('weather', 'clearsky')
+        hkey = shading_key(site)
+        if hkey not in tables:
+            tables[hkey] = shading.from_site(site)
+        table = tables[hkey]
+
+        for time_range in scenario['time_ranges']:
+            start, end = time_range['start'], time_range['end']
+            if source == 'clearsky':
+                freq = time_range.get('freq', '1min')
+                times = graph.add(('times', start, end, freq, tz), partial(make_times, start, end, freq, tz))
+                geometry = graph.add(('geometry', skey, times, position_key, hkey),
+                                     partial(axis_geometry, location, shading=table, **position), times)
+                weather = graph.add(('clearsky', skey, times), partial(simulation.clear_sky, location), geometry)
+            else:
+                raw = graph.add(('weather_file', source, tz), partial(load_weather_file, source, tz))
+                weather = graph.add(('weather', source, tz, start, end), partial(select_weather, start=start, end=end), raw)
+                geometry = graph.add(('geometry', skey, weather, position_key, hkey),
+                                     partial(weather_geometry, location, shading=table, **position), weather)
+
+            for system in scenario['systems']:
+                result = graph.add(('system', geometry, weather, system_key(system), tuple(columns)),
+                                   partial(run_system, system, shading_table=table, columns=columns),
+                                   geometry, weather)
+
+                unit = (site['name'], system['name'], time_range['name'])
+                targets[unit] = {output: graph.add(('output', output, result), outputs[output], result)
+                                 for output in scenario['outputs']}
+
+    return graph, targets
+
+
+def unit_key(scenario : dict, unit : tuple):
+    # Checkpoint key of a (site, system, time range): everything its outputs depend on
+    site, system, time_range = [next(entry for entry in scenario[field] if entry['name'] == name)
+                                for field, name in zip(['sites', 'systems', 'time_ranges'], unit)]
+    source = site.get('weather', 'clearsky')
+    if source != 'clearsky':
+        # A weather file that changed since the checkpoint was written does not match it
+        source = [source, os.path.getsize(source), os.path.getmtime(source)]
+    return ['scenario_unit', site, source, system, time_range, solar_position_options(scenario),
+            sorted(scenario['outputs'])]
+
+
+def run_units(scenario : dict, workers : int = 1, checkpoint_dir : str = None):
+    # Unfinished outputs of every unit. With `checkpoint_dir` every unit is saved there as soon as
+    # all of its outputs are done, and units saved by an earlier, interrupted run of the scenario
+    # are loaded instead of recomputed.
+    graph, targets = build_graph(scenario)
+    store = checkpoint.CheckpointStore(checkpoint_dir) if checkpoint_dir is not None else None
+    results = {}
+    if store is not None:
+        results = {unit: store.load(unit_key(scenario, unit)) for unit in targets
+                   if store.done(unit_key(scenario, unit))}
+        if results:
+            print("Resuming:", len(results), "of", len(targets), "units loaded from", checkpoint_dir)
+    pending = {unit: unit_outputs for unit, unit_outputs in targets.items() if unit not in results}
+    telemetry.add_units(len(targets))
+    telemetry.unit_done(len(results))
+    if store is not None:
+        telemetry.cache('checkpoint', hits=len(results), misses=len(pending))
+
+    # Output nodes can be shared by units with identical parameters
+    units_of = {}
+    for unit, unit_outputs in pending.items():
+        for node in unit_outputs.values():
+            units_of.setdefault(node, []).append(unit)
+    finished = {}
+    saved = set()
+
+    def on_done(node, value):
+        for unit in units_of.get(node, []):
+            finished[node] = value
+            if unit not in saved and all(n in finished for n in pending[unit].values()):
+                saved.add(unit)
+                telemetry.unit_done()
+                if store is not None:
+                    store.save(unit_key(scenario, unit),
+                               {output: finished[n] for output, n in pending[unit].items()})
+
+    try:
+        values = graph.run(list(units_of), workers=workers, on_done=on_done)
+    except BaseException:
+        # Units this run did not finish are counted as failed, so none is left pending
+        telemetry.unit_done(len(pending) - len(saved), failed=True)
+        raise
+    results.update({unit: {output: values[node] for output, node in unit_outputs.items()}
+                    for unit, unit_outputs in pending.items()})
+    return {unit: results[unit] for unit in targets}
+
+
+def run_scenario(scenario : dict, workers : int = 1, checkpoint_dir : str = None):
+    return finish(run_units(scenario, workers, checkpoint_dir))
+
+
+# Output requests --------------------------------------------------------------------------------
+
+request_outputs = ['monthly_average_day', 'energy']
+
+# The SAPM cell temperature model is steady state (no thermal memory), so by default no rows
+# before a requested month are simulated. A request's "warmup" adds some for models that need it.
+default_warmup = '0min'
+
+
+def narrow_time_ranges(time_ranges : list, months : list, warmup : str = default_warmup):
+    # Sub-ranges of every time range covering its `months` (1-12), each run of consecutive
+    # months preceded by `warmup`. Returns [(time range name, sub-range)] in time order.
+    warmup = pd.Timedelta(warmup)
+    narrowed = []
+    for time_range in time_ranges:
+        start, end = pd.Timestamp(time_range['start']), pd.Timestamp(time_range['end'])
+        spans = []
+        for period in pd.period_range(start, end, freq='M'):
+            if period.month not in months:
+                continue
+            first, last = max(start, period.start_time - warmup), min(end, period.end_time)
+            if spans and first <= spans[-1][1]:
+                spans[-1][1] = last
+            else:
+                spans.append([first, last])
+        for i, (first, last) in enumerate(spans):
+            narrowed.append((time_range['name'], dict(time_range, name=time_range['name'] + "#" + str(i),
+                                                      start=first.strftime('%Y-%m-%d %H:%M:%S'),
+                                                      end=last.strftime('%Y-%m-%d %H:%M:%S'))))
+    return narrowed
+
+
+def run_request(scenario : dict, request : dict, workers : int = 1, checkpoint_dir : str = None, max_memory=None):
+    # Result of one request: the average day profiles ('HH:MM' rows, (site, time range, group,
+    # month) columns) or monthly energy rows of every group of systems. `checkpoint_dir` and
+    # `max_memory` work as for run_units and planner.run_planned_units.
+    output = request['output']
+    months = request.get('months', list(range(1, 13)))
+    groups = request.get('groups') or {system['name']: [system['name']] for system in scenario['systems']}
+    members = {name for names in groups.values() for name in names}
+    narrowed = narrow_time_ranges(scenario['time_ranges'], months, request.get('warmup', default_warmup))
+    config = dict(scenario,
+                  sites=[site for site in scenario['sites'] if site['name'] in request.get('sites', [site['name']])],
+                  systems=[system for system in scenario['systems'] if system['name'] in members],
+                  time_ranges=[sub for _, sub in narrowed],
+                  outputs=[output])
+
+    if max_memory is None:
+        units = run_units(config, workers, checkpoint_dir)
+    else:
+        import planner
+        units = planner.run_planned_units(config, max_memory, workers, checkpoint_dir)
+
+    parent = {sub['name']: name for name, sub in narrowed}
+    parts = {}
+    for (site, system, sub), unit_outputs in units.items():
+        parts.setdefault((site, system, parent[sub]), []).append(unit_outputs[output])
+    results = finish({unit: {output: merge_parts(output, values)} for unit, values in parts.items()})
+
+    combined = {}
+    for (site, system, time_range), unit_outputs in results.items():
+        value = unit_outputs[output]
+        if output == 'monthly_average_day':
+            # Warm-up rows fall into the month before and are dropped with it
+            value = value[[month for month in months if month in value.columns]]
+        else:
+            value = value[value['level'] == 'month']
+            value = value[value['period'].str[5:7].astype(int).isin(months)]
+            value = value.set_index(['quantity', 'period'])['energy_kwh']
+        for group, names in groups.items():
+            if system in names:
+                key = (site, time_range, group)
+                combined[key] = value if key not in combined else combined[key] + value
+
+    if output == 'monthly_average_day':
+        return pd.concat(combined, axis=1, names=['site', 'time_range', 'group', 'month'])
+    return pd.concat(combined, names=['site', 'time_range', 'group']).reset_index()
+
+
+def save_results(scenario : dict, results : dict, directory : str):
+    os.makedirs(directory, exist_ok=True)
+    if 'energy' in scenario['outputs']:
+        energy_table(scenario, results).to_csv(os.path.join(directory, "energy.csv"), index=False)
+    for (site, system, time_range), unit_outputs in results.items():
+        for output, value in unit_outputs.items():
+            if output == 'energy':
+                continue
+            name = "_".join([site, system, time_range, output]) + ".csv"
+            value.to_csv(os.path.join(directory, name))
+
+
+def store_results(results : dict, directory : str):
+    # Writes the 'ac' output of every (site, system) into a resolution pyramid store, joining
+    # the scenario's time ranges in order
+    series = {}
+    for (site, system, time_range), unit_outputs in results.items():
+        series.setdefault((site, system), []).append(unit_outputs['ac'])
+    store = result_store.PyramidStore(directory)
+    for (site, system), parts in series.items():
+        store.write(site, system, pd.concat(parts).sort_index())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a scenario file")
+    parser.add_argument('scenario')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output-dir', default=None)
+    parser.add_argument('--store', default=None, help="Also write AC power into a pyramid store here")
+    parser.add_argument('--checkpoint', default=None, help="Save finished units here and skip them on a rerun")
+    parser.add_argument('--max-memory', default=None, help="Run in chunks that fit this budget, e.g. 2GB")
+    telemetry.add_arguments(parser)
+    args = parser.parse_args()
+
+    start_time = time.time()
+    scenario = load_scenario(args.scenario)
+    if args.store is not None and 'ac' not in scenario['outputs']:
+        parser.error("--store needs the 'ac' output in the scenario")
+    output_dir = args.output_dir or str(scenario['name'] + "_" + time.strftime("%Y_%m_%d_%H-%M"))
+
+    with telemetry.from_args(scenario['name'], args):
+        for request in scenario.get('requests', []):
+            os.makedirs(output_dir, exist_ok=True)
+            result = run_request(scenario, request, workers=args.workers, checkpoint_dir=args.checkpoint,
+                                 max_memory=args.max_memory)
+            result.to_csv(os.path.join(output_dir, request['name'] + ".csv"))
+            print("Request", request['name'], "finished in", "{:.2f}".format(time.time() - start_time), "seconds.")
+        if not scenario['outputs']:
+            print("Scenario", scenario['name'], "lists no outputs, only requests; request results saved to", output_dir)
+            raise SystemExit
+
+        if args.max_memory is None:
+            results = run_scenario(scenario, workers=args.workers, checkpoint_dir=args.checkpoint)
+        else:
+            import planner
+            results = planner.run_planned(scenario, args.max_memory, workers=args.workers, checkpoint_dir=args.checkpoint)
+        print("Scenario", scenario['name'], "finished in", "{:.2f}".format(time.time() - start_time), "seconds.")
+
+        save_results(scenario, results, output_dir)
+        print("Results saved to", output_dir)
+
+        if args.store is not None:
+            store_results(results, args.store)
+            print("AC power stored in", args.store)
@@ -0,0 +1,232 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+# pvlib imports
+import pvlib
+
+import simulation
+import energy
+import checkpoint
+
+
+# Module x inverter catalogue screening ----------------------------------------------------------
+#
+# Ranks SandiaMod modules paired with CEC inverters by annual energy for a site, without building
+# a ModelChain per pair. Per orientation the plane-of-array irradiance, angle of incidence and
+# cell temperature are computed once (none of them depend on the module). The catalogue is then
+# evaluated a block of modules at a time, with the module parameters as (modules, 1) columns
+# broadcast against the time axis, and the Sandia inverter model likewise across pairs. Night
+# rows are skipped and accounted for with what the model chain returns for them: the inverter
+# tare, or NaN for modules whose SAPM voltage is undefined at zero irradiance. Rows with NaN
+# power (at night, by day or for missing weather) are left out of the energy, as in energy sums
+# of run_system results.
+#
+# Every pair is one module on one (micro)inverter, like the scripts' CS5P + ABB MICRO system.
+# Inverters are compatible with a module when its STC Vmp lies in the MPPT window, its STC Voc
+# stays below the maximum DC voltage and the DC/AC ratio lies in `dc_ac_range`; the
+# `inverters_per_module` candidates closest to `target_dc_ac` are evaluated.
+
+# Module parameters needed for p_mp and v_mp; modules missing any of them are skipped
+module_parameters = ['Isco', 'Impo', 'Voco', 'Vmpo', 'Aisc', 'Aimp', 'Bvoco', 'Mbvoc', 'Bvmpo', 'Mbvmp',
+                     'N', 'Cells_in_Series', 'C0', 'C1', 'C2', 'C3', 'A0', 'A1', 'A2', 'A3', 'A4',
+                     'B0', 'B1', 'B2', 'B3', 'B4', 'B5', 'FD']
+# Only needed for pvlib's i_x/i_xx outputs, which screening does not use
+optional_module_parameters = ['C4', 'C5', 'C6', 'C7', 'IXO', 'IXXO']
+inverter_parameters = ['Paco', 'Pdco', 'Vdco', 'Pso', 'C0', 'C1', 'C2', 'C3', 'Pnt', 'Vdcmax',
+                       'Mppt_low', 'Mppt_high']
+
+# float64 arrays of shape (block, day rows) alive at once while a block is evaluated
+intermediates = 16
+
+
+def catalogue_table(name : str, parameters : list, pattern : str = None, optional : tuple = ()):
+    # Catalogue as a numeric table with one row per entry
+    table = simulation.load_catalogue(name).T
+    if pattern is not None:
+        table = table[table.index.str.contains(pattern, regex=True)]
+    table = table[list(parameters) + list(optional)].apply(pd.to_numeric, errors='coerce')
+    return table.dropna(subset=parameters)
+
+
+def pair_inverters(modules : pd.DataFrame,
+                   inverters : pd.DataFrame,
+                   dc_ac_range : tuple = (0.9, 1.5),
+                   target_dc_ac : float = 1.2,
+                   inverters_per_module : int = 5):
+    # Returns a table of (module, inverter, dc_ac_ratio) candidate pairs
+    vmp = modules['Vmpo'].to_numpy()[:, None]
+    ratio = (modules['Impo'] * modules['Vmpo']).to_numpy()[:, None] / inverters['Paco'].to_numpy()
+    fits = ((inverters['Mppt_low'].to_numpy() <= vmp) & (vmp <= inverters['Mppt_high'].to_numpy()) &
+            (modules['Voco'].to_numpy()[:, None] <= inverters['Vdcmax'].to_numpy()) &
+            (ratio >= dc_ac_range[0]) & (ratio <= dc_ac_range[1]))
+    distance = np.where(fits, np.abs(ratio - target_dc_ac), np.inf)
+    best = np.argsort(distance, axis=1, kind='stable')[:, :inverters_per_module]
+    m, k = np.nonzero(np.take_along_axis(fits, best, axis=1))
+    i = best[m, k]
+    return pd.DataFrame({'module' : modules.index[m], 'inverter' : inverters.index[i], 'dc_ac_ratio' : ratio[m, i]})
+
+
+def sandia_clipped(v_dc : np.ndarray, p_dc : np.ndarray, inverter : dict):
+    # Sandia inverter model with parameters as (pairs, 1) columns. Returns (ac, clipped power).
+    dv = v_dc - inverter['Vdco']
+    A = inverter['Pdco'] * (1 + inverter['C1'] * dv)
+    B = inverter['Pso'] * (1 + inverter['C2'] * dv)
+    C = inverter['C0'] * (1 + inverter['C3'] * dv)
+    unclipped = (inverter['Paco'] / (A - B) - C * (A - B)) * (p_dc - B) + C * (p_dc - B) ** 2
+    ac = np.minimum(unclipped, inverter['Paco'])
+    below = p_dc < inverter['Pso']
+    ac = np.where(below, -abs(inverter['Pnt']), ac)
+    clipped = np.where(below, 0, unclipped - ac)
+    return ac, clipped
+
+
+def screen_orientation(geometry : pd.DataFrame,
+                       weather : pd.DataFrame,
+                       surface_tilt : float,
+                       surface_azimuth : float,
+                       modules : pd.DataFrame,
+                       inverters : pd.DataFrame,
+                       pairs : pd.DataFrame,
+                       albedo : float = 0.25,
+                       max_memory : int = 2**30):
+    step = energy.step_hours(geometry.index)
+    zenith = geometry['apparent_zenith'].to_numpy()
+    azimuth = geometry['azimuth'].to_numpy()
+    irrad = pvlib.irradiance.get_total_irradiance(surface_tilt, surface_azimuth, zenith, azimuth,
+                                                  weather['dni'].to_numpy(), weather['ghi'].to_numpy(),
+                                                  weather['dhi'].to_numpy(),
+                                                  dni_extra=geometry['dni_extra'].to_numpy(),
+                                                  airmass=geometry['airmass_relative'].to_numpy(),
+                                                  albedo=albedo, model='haydavies')
+    poa_global = np.asarray(irrad['poa_global'])
+
+    # Only daylight rows need the module and inverter models. Rows with missing POA are neither:
+    # their power is NaN like in run_system, so they are not charged the night tare.
+    day = poa_global > 0
+    n_night = int((poa_global <= 0).sum())
+    poa_global = np.nan_to_num(poa_global)
+    poa_direct = np.nan_to_num(np.asarray(irrad['poa_direct']))[day]
+    poa_diffuse = np.nan_to_num(np.asarray(irrad['poa_diffuse']))[day]
+    aoi = pvlib.irradiance.aoi(surface_tilt, surface_azimuth, zenith, azimuth)[day]
+    airmass_absolute = geometry['airmass_absolute'].to_numpy()[day]
+    temp_air = weather['temp_air'].to_numpy()[day] if 'temp_air' in weather else 20.0
+    wind_speed = weather['wind_speed'].to_numpy()[day] if 'wind_speed' in weather else 0.0
+    params = simulation.temperature_model_parameters
+    cell_temperature = pvlib.temperature.sapm_cell(poa_global[day], temp_air, wind_speed,
+                                                   params['a'], params['b'], params['deltaT'])
+    spectral = simulation.reference_spectral_model() == 'sapm'
+
+    block = max(int(max_memory / (day.sum() * intermediates * 8)), 1)
+    # Modules without a compatible inverter are not evaluated at all, and catalogue entries
+    # that only differ by name (e.g. 208 V / 240 V listings with equal coefficients) once
+    modules = modules[modules.index.isin(pairs['module'])]
+    codes = pd.Series(pd.factorize(pd.MultiIndex.from_frame(inverters))[0], index=inverters.index)
+    pairs = pairs.assign(inverter_code=codes[pairs['inverter']].to_numpy())
+    evaluated = pairs.drop_duplicates(['module', 'inverter_code'])
+    rows = []
+    for start in range(0, len(modules), block):
+        names = modules.index[start:start + block]
+        module = {name: modules.loc[names, name].to_numpy()[:, None] for name in modules.columns}
+
+        effective_irradiance = poa_direct * pvlib.iam.sapm(aoi, module) + module['FD'] * poa_diffuse
+        if spectral:
+            effective_irradiance = effective_irradiance * simulation.spectral_factor(airmass_absolute, module)
+        dc = pvlib.pvsystem.sapm(effective_irradiance, cell_temperature, module)
+        v_mp, p_mp = dc['v_mp'], dc['p_mp']
+        del effective_irradiance, dc
+        # One night row per module, the same at any cell temperature
+        night_dc = pvlib.pvsystem.sapm(np.zeros(1), 25.0, module)
+
+        block_pairs = evaluated[evaluated['module'].isin(names)]
+        position = pd.Series(np.arange(len(names)), index=names)
+        for pair_start in range(0, len(block_pairs), block):
+            chunk = block_pairs.iloc[pair_start:pair_start + block]
+            rows_index = position[chunk['module']].to_numpy()
+            inverter = {name: inverters.loc[chunk['inverter'], name].to_numpy()[:, None] for name in inverters.columns}
+            ac, clipped = sandia_clipped(v_mp[rows_index], p_mp[rows_index], inverter)
+            night_ac, _ = sandia_clipped(night_dc['v_mp'][rows_index], night_dc['p_mp'][rows_index], inverter)
+            night = n_night * np.nan_to_num(night_ac[:, 0])
+            rows.append(pd.DataFrame({'module' : chunk['module'].to_numpy(),
+                                      'inverter_code' : chunk['inverter_code'].to_numpy(),
+                                      'dc_kwh' : np.nansum(p_mp[rows_index], axis=1) * step / 1000,
+                                      'ac_kwh' : (np.nansum(ac, axis=1) + night) * step / 1000,
+                                      'clipping_kwh' : np.nansum(clipped, axis=1) * step / 1000}))
+
+    results = pd.concat(rows, ignore_index=True) if rows else \
+        pd.DataFrame(columns=['module', 'inverter_code', 'dc_kwh', 'ac_kwh', 'clipping_kwh'])
+    table = pairs.merge(results, on=['module', 'inverter_code']).drop(columns='inverter_code')
+    table.insert(0, 'surface_azimuth', surface_azimuth)
+    table.insert(0, 'surface_tilt', surface_tilt)
+    return table
+
+
+def screen(geometry : pd.DataFrame,
+           weather : pd.DataFrame,
+           orientations : tuple = ((30, 180),),
+           module_filter : str = None,
+           inverter_filter : str = None,
+           dc_ac_range : tuple = (0.9, 1.5),
+           target_dc_ac : float = 1.2,
+           inverters_per_module : int = 5,
+           albedo : float = 0.25,
+           max_memory : int = 2**30,
+           rank_by : str = 'specific_yield',
+           checkpoint_dir : str = None):
+    # Ranked table of module x inverter pairs for every (surface_tilt, surface_azimuth). With
+    # `checkpoint_dir` each finished orientation is saved and skipped when the sweep is rerun.
+    modules = catalogue_table('SandiaMod', module_parameters, module_filter, optional_module_parameters)
+    inverters = catalogue_table('cecinverter', inverter_parameters, inverter_filter)
+    pairs = pair_inverters(modules, inverters, dc_ac_range, target_dc_ac, inverters_per_module)
+
+    store = checkpoint.CheckpointStore(checkpoint_dir) if checkpoint_dir is not None else None
+    inputs = checkpoint.fingerprint(geometry, weather) if store is not None else None
+    tables = []
+    for tilt, az in orientations:
+        key = ['screen_orientation', inputs, tilt, az, module_filter, inverter_filter, list(dc_ac_range),
+               target_dc_ac, inverters_per_module, albedo]
+        if store is not None and store.done(key):
+            tables.append(store.load(key))
+            continue
+        tables.append(screen_orientation(geometry, weather, tilt, az, modules, inverters, pairs, albedo, max_memory))
+        if store is not None:
+            store.save(key, tables[-1])
+    table = pd.concat(tables, ignore_index=True)
+    kwp = (modules['Impo'] * modules['Vmpo'] / 1000)[table['module']].to_numpy()
+    table['specific_yield'] = table['ac_kwh'] / kwp
+    table['clipping_pct'] = 100 * table['clipping_kwh'] / (table['ac_kwh'] + table['clipping_kwh'])
+    table = table.sort_values(rank_by, ascending=False, ignore_index=True)
+    table.insert(0, 'rank', np.arange(1, len(table) + 1))
+    return table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rank module x inverter pairs for a site")
+    parser.add_argument('--module-filter', default=None, help="Regular expression on module names")
+    parser.add_argument('--inverter-filter', default=None, help="Regular expression on inverter names")
+    parser.add_argument('--weather', default=None, help="StarkeDFC weather file (clear sky if omitted)")
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--output', default=None, help="Write the full table to this CSV")
+    parser.add_argument('--checkpoint', default=None, help="Save finished orientations here and skip them on a rerun")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    site = {'name' : 'Turku', 'latitude' : 60.45, 'longitude' : 22.29, 'altitude' : 50, 'tz' : 'Europe/Helsinki'}
+    location = simulation.make_location(site)
+    if args.weather is None:
+        times = pd.date_range('2021-01-01', '2021-12-31', freq='1min', tz=site['tz'])
+        geometry = simulation.solar_geometry(location, times)
+        weather = simulation.clear_sky(location, geometry)
+    else:
+        weather = simulation.load_weather(args.weather, site['tz'])
+        geometry = simulation.solar_geometry(location, weather.index, temperature=weather['temp_air'].to_numpy())
+
+    table = screen(geometry, weather, orientations=[(90, 90), (30, 180), (90, 270)],
+                   module_filter=args.module_filter, inverter_filter=args.inverter_filter,
+                   checkpoint_dir=args.checkpoint)
+    print(table.head(args.top).to_string(index=False))
+    print("Screened", len(table), "pairs in", "{:.2f}".format(time.time() - start_time), "seconds.")
+    if args.output is not None:
+        table.to_csv(args.output, index=False)
@@ -0,0 +1,85 @@
+import numpy as np
+
+
+# Horizon and obstruction shading ----------------------------------------------------------------
+#
+# A site's far horizon (terrain) and near obstructions (buildings, trees) are compiled once into
+# a table of beam visibility over sun position bins (azimuth x elevation). Runs then only gather
+# the factor of each time step from the cached solar position, so shading costs an index lookup
+# per row instead of any geometry.
+#
+# In a site dict:
+#
+#   "horizon": [[0, 2.5], [90, 4], [180, 1], [270, 6]]       (azimuth, horizon elevation) points,
+#                                                             interpolated around the circle
+#   "obstructions": [{"azimuth": [200, 240], "elevation": 25},                     a building
+#                    {"azimuth": [100, 130], "elevation": [5, 18], "transmittance": 0.4}]  a tree
+#
+# Obstruction azimuth spans may wrap through north ([340, 20]). "elevation" is the top edge, or
+# [bottom, top]. Direct irradiance and the circumsolar part of sky diffuse are scaled by the beam
+# factor of the sun's position; isotropic sky diffuse by the visible share of the sky dome as
+# seen from the tilted plane (the same table integrated over the dome). Ground-reflected
+# irradiance is left unshaded.
+
+class ShadingTable:
+
+    def __init__(self, horizon : list = None, obstructions : list = None,
+                 azimuth_step : float = 1.0, elevation_step : float = 0.5, supersample : int = 4):
+        self.azimuth_step = azimuth_step
+        self.elevation_step = elevation_step
+        n_azimuth = int(round(360 / azimuth_step))
+        n_elevation = int(round(90 / elevation_step))
+        # Every bin is the mean visibility of supersample x supersample directions inside it, so
+        # bins that straddle an edge get a fractional factor
+        offsets = (np.arange(supersample) + 0.5) / supersample
+        azimuth = ((np.arange(n_azimuth)[:, None] + offsets) * azimuth_step).ravel()
+        elevation = ((np.arange(n_elevation)[:, None] + offsets) * elevation_step).ravel()
+        visible = self._visibility(azimuth[:, None], elevation[None, :], horizon, obstructions)
+        self.beam = visible.reshape(n_azimuth, supersample, n_elevation, supersample).mean(axis=(1, 3))
+        self._diffuse = {}
+
+    @staticmethod
+    def _visibility(azimuth, elevation, horizon, obstructions):
+        visible = np.ones(np.broadcast_shapes(azimuth.shape, elevation.shape))
+        if horizon:
+            points = np.array(sorted(horizon), dtype=float)
+            # Periodic interpolation around the full circle
+            xp = np.concatenate([points[:, 0] - 360, points[:, 0], points[:, 0] + 360])
+            fp = np.tile(points[:, 1], 3)
+            visible = visible * (elevation > np.interp(azimuth, xp, fp))
+        for obstruction in obstructions or []:
+            start, end = obstruction['azimuth']
+            bottom, top = obstruction['elevation'] if np.ndim(obstruction['elevation']) else (0, obstruction['elevation'])
+            inside = ((azimuth - start) % 360 <= (end - start) % 360) & (elevation >= bottom) & (elevation <= top)
+            visible = visible * np.where(inside, obstruction.get('transmittance', 0.0), 1.0)
+        return visible
+
+    def beam_factor(self, azimuth : np.ndarray, elevation : np.ndarray):
+        # Gathers the factor of every (azimuth, elevation) in degrees; 0 with the sun below 0
+        azimuth = np.nan_to_num(np.asarray(azimuth, dtype=float))
+        elevation = np.nan_to_num(np.asarray(elevation, dtype=float), nan=-1.0)
+        i = (azimuth // self.azimuth_step).astype(np.intp) % self.beam.shape[0]
+        j = np.clip((elevation // self.elevation_step).astype(np.intp), 0, self.beam.shape[1] - 1)
+        return np.where(elevation > 0, self.beam[i, j], 0.0)
+
+    def diffuse_factor(self, surface_tilt : float, surface_azimuth : float):
+        # Visible share of isotropic sky diffuse on a plane, cached per orientation
+        key = (float(surface_tilt), float(surface_azimuth))
+        if key not in self._diffuse:
+            azimuth = np.radians((np.arange(self.beam.shape[0]) + 0.5) * self.azimuth_step)[:, None]
+            elevation = np.radians((np.arange(self.beam.shape[1]) + 0.5) * self.elevation_step)[None, :]
+            tilt, plane_azimuth = np.radians(surface_tilt), np.radians(surface_azimuth)
+            # Radiance from each dome cell reaches the plane with weight cos(incidence) x solid angle
+            incidence = np.maximum(np.cos(elevation) * np.sin(tilt) * np.cos(azimuth - plane_azimuth) +
+                                   np.sin(elevation) * np.cos(tilt), 0)
+            weight = incidence * np.cos(elevation)
+            total = weight.sum()
+            self._diffuse[key] = float((weight * self.beam).sum() / total) if total > 0 else 1.0
+        return self._diffuse[key]
+
+
+def from_site(site : dict, **kwargs):
+    # The site's ShadingTable, or None when it describes no horizon or obstructions
+    if not site.get('horizon') and not site.get('obstructions'):
+        return None
+    return ShadingTable(site.get('horizon'), site.get('obstructions'), **kwargs)
@@ -0,0 +1,178 @@
+import os
+import uuid
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+import pandas as pd
+
+import simulation
+import checkpoint
+
+
+# Zero-copy arrays for worker processes ----------------------------------------------------------
+#
+# Sending weather to a pool as pickled rows (or a whole DataFrame per task) copies the full year
+# into every worker. Instead the parent packs the columns once into a single shared memory block
+# (or a memory-mapped file when `directory` is given) and only sends a small spec describing where
+# each column lives. Workers attach to the block and get NumPy views onto the same memory, so the
+# per-worker cost stays constant as workers are added.
+
+alignment = 64 # bytes, keeps every column cache-line aligned
+
+# Blocks attached by this process, released again by detach() when the task using them finishes
+_attached = {}
+
+
+def _layout(arrays : dict):
+    fields = []
+    offset = 0
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        fields.append((name, array.dtype.str, array.shape, offset))
+        offset += -(-array.nbytes // alignment) * alignment
+    return fields, max(offset, alignment)
+
+
+def _views(buffer, fields : list):
+    return {name: np.ndarray(shape, dtype=np.dtype(dtype), buffer=buffer, offset=offset)
+            for name, dtype, shape, offset in fields}
+
+
+class SharedArrays:
+    # Owner of a block of named arrays. `spec` is what gets sent to workers.
+
+    def __init__(self, arrays : dict, directory : str = None):
+        fields, size = _layout(arrays)
+        if directory is None:
+            self._block = shared_memory.SharedMemory(create=True, size=size)
+            buffer = self._block.buf
+            self.spec = {'backend' : 'shm', 'location' : self._block.name, 'size' : size, 'fields' : fields}
+        else:
+            path = os.path.join(directory, "shared_" + uuid.uuid4().hex + ".bin")
+            self._block = np.memmap(path, dtype=np.uint8, mode='w+', shape=(size,))
+            buffer = self._block
+            self.spec = {'backend' : 'mmap', 'location' : path, 'size' : size, 'fields' : fields}
+
+        self.arrays = _views(buffer, fields)
+        for name, array in arrays.items():
+            self.arrays[name][...] = array
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # Views must be gone before the block can be released; copy out anything still needed
+        self.arrays = None
+        if self.spec['backend'] == 'shm':
+            self._block.close()
+            self._block.unlink()
+        else:
+            location = self.spec['location']
+            del self._block
+            os.remove(location)
+
+
+def attach(spec : dict):
+    # Returns {name: view} for a block created by SharedArrays, attaching at most once per process
+    # until detach() is called
+    key = spec['location']
+    if key not in _attached:
+        if spec['backend'] == 'shm':
+            # Only the owner unlinks the block. Pool workers share the owner's resource tracker, so
+            # before Python 3.13 (no `track` argument) registering it again is harmless.
+            try:
+                block = shared_memory.SharedMemory(name=spec['location'], track=False)
+            except TypeError:
+                block = shared_memory.SharedMemory(name=spec['location'])
+            buffer = block.buf
+        else:
+            block = np.memmap(spec['location'], dtype=np.uint8, mode='r+', shape=(spec['size'],))
+            buffer = block
+        _attached[key] = (block, _views(buffer, spec['fields']))
+    return _attached[key][1]
+
+
+def detach(spec : dict):
+    # Releases a block attached by attach(). Long-running workers see many blocks over their
+    # lifetime, so each one is closed as soon as its task is done instead of kept until exit.
+    # Any views from attach() must be gone by now.
+    entry = _attached.pop(spec['location'], None)
+    if entry is None:
+        return
+    block, views = entry
+    del views
+    if spec['backend'] == 'shm':
+        block.close()
+
+
+# Parallel system runs ---------------------------------------------------------------------------
+
+geometry_columns = ['apparent_zenith', 'azimuth', 'airmass_relative', 'airmass_absolute', 'dni_extra']
+weather_columns = ['ghi', 'dni', 'dhi', 'temp_air', 'wind_speed']
+
+
+def _chunk_key(inputs : str, surface_tilt : float, surface_azimuth : float, start : int, stop : int):
+    return ['ac_chunk', inputs, surface_tilt, surface_azimuth, start, stop]
+
+
+def _chunk_ac(arrays : dict, index : int, surface_tilt : float, surface_azimuth : float, start : int, stop : int):
+    geometry = {name: arrays['geometry.' + name][start:stop] for name in geometry_columns}
+    weather = {name: arrays['weather.' + name][start:stop] for name in weather_columns
+               if 'weather.' + name in arrays}
+    ac = simulation.run_system(geometry, weather, surface_tilt, surface_azimuth)['ac'].to_numpy(copy=True)
+    arrays['ac.' + str(index)][start:stop] = ac
+    return ac
+
+
+def _run_chunk(spec : dict, index : int, surface_tilt : float, surface_azimuth : float, start : int, stop : int,
+               checkpoint_dir : str = None, inputs : str = None):
+    # The views only live inside _chunk_ac, so the block can be detached once it returns
+    try:
+        ac = _chunk_ac(attach(spec), index, surface_tilt, surface_azimuth, start, stop)
+    finally:
+        detach(spec)
+    if checkpoint_dir is not None:
+        checkpoint.CheckpointStore(checkpoint_dir).save(_chunk_key(inputs, surface_tilt, surface_azimuth, start, stop), ac)
+
+
+def run_systems_parallel(geometry : pd.DataFrame,
+                         weather : pd.DataFrame,
+                         systems : list,
+                         workers : int = None,
+                         chunk_rows : int = 50000,
+                         directory : str = None,
+                         checkpoint_dir : str = None):
+    # Runs every (surface_tilt, surface_azimuth) in `systems` over the shared inputs and returns
+    # the AC power of each as a Series. Workers write their chunk straight into a shared output.
+    # With `checkpoint_dir` every finished (system, chunk) is also saved there, and chunks
+    # already saved by an earlier, interrupted run are loaded instead of computed.
+    n = len(geometry)
+    arrays = {'geometry.' + name: geometry[name].to_numpy(dtype=float) for name in geometry_columns}
+    arrays.update({'weather.' + name: weather[name].to_numpy(dtype=float) for name in weather_columns
+                   if name in weather})
+    arrays.update({'ac.' + str(i): np.zeros(n) for i in range(len(systems))})
+    store = checkpoint.CheckpointStore(checkpoint_dir) if checkpoint_dir is not None else None
+    inputs = checkpoint.fingerprint(geometry[geometry_columns], weather[[c for c in weather_columns if c in weather]]) \
+        if store is not None else None
+
+    with SharedArrays(arrays, directory=directory) as shared:
+        tasks = []
+        loaded = 0
+        for i, (tilt, az) in enumerate(systems):
+            for start in range(0, n, chunk_rows):
+                stop = min(start + chunk_rows, n)
+                key = _chunk_key(inputs, tilt, az, start, stop)
+                if store is not None and store.done(key):
+                    shared.arrays['ac.' + str(i)][start:stop] = store.load(key)
+                    loaded += 1
+                else:
+                    tasks.append((shared.spec, i, tilt, az, start, stop, checkpoint_dir, inputs))
+        if loaded:
+            print("Resuming:", loaded, "chunks loaded from", checkpoint_dir)
+        with Pool(workers) as pool:
+            pool.starmap(_run_chunk, tasks)
+        return [pd.Series(shared.arrays['ac.' + str(i)].copy(), index=geometry.index)
+                for i in range(len(systems))]
@@ -0,0 +1,233 @@
+import functools
+
+import numpy as np
+import pandas as pd
+
+# pvlib imports
+import pvlib
+from pvlib.location import Location
+from pvlib.pvsystem import PVSystem
+from pvlib.modelchain import ModelChain
+from pvlib.temperature import TEMPERATURE_MODEL_PARAMETERS
+
+import solar_position
+import telemetry
+
+
+# Shared model building blocks ------------------------------------------------------------------
+#
+# The scripts rebuild a ModelChain per system, which recomputes solar position, airmass and
+# extraterrestrial irradiance for every system at the same site. Here the site/time dependent part
+# (solar_geometry) is separated from the per-system part (run_system) so that the former can be
+# computed once and shared. run_system follows the same steps as the ModelChain the scripts use
+# (haydavies transposition, SAPM IAM/spectral/DC, SAPM cell temperature, Sandia inverter).
+
+module_name = 'Canadian_Solar_CS5P_220M___2009_'
+inverter_name = 'ABB__MICRO_0_25_I_OUTD_US_208__208V_'
+temperature_model_parameters = TEMPERATURE_MODEL_PARAMETERS['sapm']['open_rack_glass_glass']
+
+# StarkeDFC weather files use these column names
+weather_columns = {'GHI' : 'ghi', 'DNI' : 'dni', 'DHI' : 'dhi', 'Tamb' : 'temp_air',
+                   'SunAz' : 'solar_azimuth', 'appZ' : 'apparent_zenith', 'WS' : 'wind_speed'}
+
+
+@functools.lru_cache(maxsize=None)
+def load_catalogue(name : str):
+    # retrieve_sam parses the whole CSV each call, so keep one copy per process
+    return pvlib.pvsystem.retrieve_sam(name)
+
+
+telemetry.watch_cache('sam_catalogue', load_catalogue.cache_info)
+
+
+def load_components(module : str = module_name, inverter : str = inverter_name):
+    return load_catalogue('SandiaMod')[module], load_catalogue('cecinverter')[inverter]
+
+
+@functools.lru_cache(maxsize=None)
+def reference_spectral_model():
+    # The spectral loss ModelChain infers for SAPM modules changed between pvlib versions
+    # ('sapm' before 0.11, no loss after), so ask the installed ModelChain which one it uses
+    module, inverter = load_components()
+    system = PVSystem(module_parameters=module, inverter_parameters=inverter,
+                      temperature_model_parameters=temperature_model_parameters)
+    mc = ModelChain(system, Location(0, 0))
+    return 'sapm' if mc.spectral_model.__name__ == 'sapm_spectral_loss' else 'no_loss'
+
+
+def spectral_factor(airmass_absolute : np.ndarray, module : pd.Series):
+    # SAPM spectral modifier f1(AMa), clipped at zero like pvlib does
+    coefficients = [module['A4'], module['A3'], module['A2'], module['A1'], module['A0']]
+    return np.maximum(0, np.nan_to_num(np.polyval(coefficients, airmass_absolute)))
+
+
+def make_location(site : dict):
+    return Location(site['latitude'], site['longitude'], site.get('tz', 'UTC'),
+                    site.get('altitude', 0), name=site.get('name'))
+
+
+def solar_geometry(location : Location, times : pd.DatetimeIndex, strategy : str = 'spa', temperature = 12,
+                   shading = None, **kwargs):
+    # Everything that only depends on the site and the time axis. See solar_position.py for the
+    # available solar position strategies. Pass the weather's temp_air as `temperature` to get the
+    # same apparent zenith (refraction) as a ModelChain run on that weather. With a
+    # shading.ShadingTable the beam shading factor of every step is gathered here once per site.
+    geometry = solar_position.get_solarposition(location, times, strategy, temperature, **kwargs).copy()
+    airmass = location.get_airmass(solar_position=geometry)
+    geometry['airmass_relative'] = airmass['airmass_relative']
+    geometry['airmass_absolute'] = airmass['airmass_absolute']
+    geometry['dni_extra'] = pvlib.irradiance.get_extra_radiation(times)
+    if shading is not None:
+        geometry['beam_shading'] = shading.beam_factor(geometry['azimuth'].to_numpy(),
+                                                       geometry['apparent_elevation'].to_numpy())
+    return geometry
+
+
+def clear_sky(location : Location, geometry : pd.DataFrame):
+    return location.get_clearsky(geometry.index, solar_position=geometry)
+
+
+def load_weather(path : str, tz : str):
+    # Reads a StarkeDFC irradiance file into a DataFrame with pvlib column names
+    return prepare_weather(pd.read_csv(path), tz)
+
+
+def read_weather_chunks(path : str, tz : str, rows : int = 100000):
+    # The same as load_weather, `rows` rows at a time
+    for chunk in pd.read_csv(path, chunksize=rows):
+        yield prepare_weather(chunk, tz)
+
+
+def prepare_weather(weather : pd.DataFrame, tz : str):
+    times = pd.DatetimeIndex(weather['dt'], tz=tz)
+    weather = weather.drop(columns=['dt_orig', 'dt']).rename(columns=weather_columns)
+    weather = weather.set_index(times)
+    weather.index.name = None
+    return weather
+
+
+def run_arrays(geometry,
+               weather,
+               surface_tilt : float,
+               surface_azimuth : float,
+               module,
+               inverter,
+               temperature_model_parameters : dict = temperature_model_parameters,
+               albedo = 0.25,
+               spectral_model : str = None,
+               soiling = 0.0,
+               shading = None):
+    # The model chain on plain arrays. Inputs only need to broadcast against each other, so a
+    # leading sample axis (e.g. per-sample irradiance, albedo or module currents of shape
+    # (samples, 1)) evaluates many variants in one pass. Returns {column: array}.
+    zenith = np.asarray(geometry['apparent_zenith'])
+    azimuth = np.asarray(geometry['azimuth'])
+    ghi = np.asarray(weather['ghi'])
+    dni = np.asarray(weather['dni'])
+    dhi = np.asarray(weather['dhi'])
+    temp_air = np.asarray(weather['temp_air']) if 'temp_air' in weather else 20.0
+    wind_speed = np.asarray(weather['wind_speed']) if 'wind_speed' in weather else 0.0
+
+    irrad = pvlib.irradiance.get_total_irradiance(surface_tilt, surface_azimuth, zenith, azimuth,
+                                                  dni, ghi, dhi,
+                                                  dni_extra=np.asarray(geometry['dni_extra']),
+                                                  airmass=np.asarray(geometry['airmass_relative']),
+                                                  albedo=albedo, model='haydavies',
+                                                  diffuse_components=shading is not None)
+    if shading is not None:
+        irrad = _shade(irrad, geometry, surface_tilt, surface_azimuth, shading)
+    aoi = pvlib.irradiance.aoi(surface_tilt, surface_azimuth, zenith, azimuth)
+    effective_irradiance = irrad['poa_direct'] * pvlib.iam.sapm(aoi, module) + module['FD'] * irrad['poa_diffuse']
+    if (spectral_model or reference_spectral_model()) == 'sapm':
+        effective_irradiance = effective_irradiance * spectral_factor(np.asarray(geometry['airmass_absolute']), module)
+    if np.any(soiling):
+        effective_irradiance = effective_irradiance * (1 - soiling)
+
+    cell_temperature = pvlib.temperature.sapm_cell(irrad['poa_global'], temp_air, wind_speed,
+                                                   temperature_model_parameters['a'],
+                                                   temperature_model_parameters['b'],
+                                                   temperature_model_parameters['deltaT'])
+    dc = pvlib.pvsystem.sapm(effective_irradiance, cell_temperature, module)
+    ac = pvlib.inverter.sandia(dc['v_mp'], dc['p_mp'], inverter)
+
+    return {'poa_global' : irrad['poa_global'],
+            'poa_direct' : irrad['poa_direct'],
+            'poa_diffuse' : irrad['poa_diffuse'],
+            'effective_irradiance' : effective_irradiance,
+            'cell_temperature' : cell_temperature,
+            'v_mp' : dc['v_mp'],
+            'p_mp' : dc['p_mp'],
+            'ac' : ac}
+
+
+def _shade(irrad, geometry, surface_tilt, surface_azimuth, shading):
+    # Beam and circumsolar diffuse take the sun position's beam factor (gathered in
+    # solar_geometry when the geometry carries it), isotropic sky diffuse the plane's view factor.
+    # `irrad` carries the sky diffuse components of the transposition (diffuse_components=True).
+    if 'beam_shading' in geometry:
+        beam = np.asarray(geometry['beam_shading'])
+    else:
+        beam = shading.beam_factor(np.asarray(geometry['azimuth']), 90 - np.asarray(geometry['apparent_zenith']))
+    circumsolar = np.nan_to_num(np.asarray(irrad['poa_circumsolar']))
+    poa_sky_diffuse = circumsolar * beam + (np.asarray(irrad['poa_sky_diffuse']) - circumsolar) * \
+        shading.diffuse_factor(surface_tilt, surface_azimuth)
+    poa_direct = np.asarray(irrad['poa_direct']) * beam
+    poa_diffuse = poa_sky_diffuse + np.asarray(irrad['poa_ground_diffuse'])
+    return {'poa_global' : poa_direct + poa_diffuse,
+            'poa_direct' : poa_direct,
+            'poa_diffuse' : poa_diffuse,
+            'poa_sky_diffuse' : poa_sky_diffuse,
+            'poa_ground_diffuse' : np.asarray(irrad['poa_ground_diffuse'])}
+
+
+def run_system(geometry : pd.DataFrame,
+               weather : pd.DataFrame,
+               surface_tilt : float,
+               surface_azimuth : float,
+               module : pd.Series = None,
+               inverter : pd.Series = None,
+               temperature_model_parameters : dict = temperature_model_parameters,
+               albedo : float = 0.25,
+               spectral_model : str = None,
+               skip_night : bool = False,
+               shading = None):
+    # geometry and weather may be DataFrames or plain {column: array} mappings
+    if module is None or inverter is None:
+        default_module, default_inverter = load_components()
+        module = default_module if module is None else module
+        inverter = default_inverter if inverter is None else inverter
+
+    if skip_night:
+        result = _run_daylight(geometry, weather, surface_tilt, surface_azimuth, module, inverter,
+                               temperature_model_parameters, albedo, spectral_model, shading)
+    else:
+        result = run_arrays(geometry, weather, surface_tilt, surface_azimuth, module, inverter,
+                            temperature_model_parameters, albedo, spectral_model, shading=shading)
+    return pd.DataFrame({name: np.asarray(values) for name, values in result.items()},
+                        index=getattr(geometry, 'index', None))
+
+
+def _run_daylight(geometry, weather, surface_tilt, surface_azimuth, module, inverter,
+                  temperature_model_parameters, albedo, spectral_model, shading):
+    # Rows without any irradiance (ghi, dni and dhi all <= 0) are not run through the model chain
+    # but filled with what it returns for them: no irradiance or DC power, cell temperature equal
+    # to air temperature and the inverter's night tare as AC. Rows with missing data still run.
+    night = ((np.asarray(weather['ghi']) <= 0) & (np.asarray(weather['dni']) <= 0) &
+             (np.asarray(weather['dhi']) <= 0))
+    day = ~night
+    g = {name: np.asarray(geometry[name])[day] for name in
+         ['apparent_zenith', 'azimuth', 'dni_extra', 'airmass_relative', 'airmass_absolute', 'beam_shading']
+         if name in geometry}
+    w = {name: np.asarray(weather[name])[day] for name in ['ghi', 'dni', 'dhi', 'temp_air', 'wind_speed']
+         if name in weather}
+    daylight = run_arrays(g, w, surface_tilt, surface_azimuth, module, inverter,
+                          temperature_model_parameters, albedo, spectral_model, shading=shading)
+
+    n = len(night)
+    result = {name: np.zeros(n) for name in daylight}
+    result['cell_temperature'] = np.asarray(weather['temp_air'], dtype=float).copy() if 'temp_air' in weather \
+        else np.full(n, 20.0)
+    result['ac'] = np.full(n, -abs(inverter['Pnt']))
+    for name, values in daylight.items():
+        result[name][day] = values
+    return result
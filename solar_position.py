@@ -0,0 +1,120 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+# pvlib imports
+import pvlib
+from pvlib.location import Location
+
+
+# Solar position strategies ----------------------------------------------------------------------
+#
+# Location.get_solarposition runs the full NREL SPA (accurate to ~0.0003 deg) for every time step,
+# which dominates clear-sky runs. Energy-yield studies can use something cheaper:
+#
+#   'spa'           full SPA in NumPy (the ModelChain default, used as the reference)
+#   'spa_numba'     the same algorithm JIT-compiled with numba (pvlib falls back to NumPy without it)
+#   'ephemeris'     pvlib's simpler analytical ephemeris
+#   'interpolated'  SPA at a coarse step (default 15 min) with the angles interpolated in between
+#
+# check_strategy reports how far a strategy is from SPA and what that does to energy. Zenith and
+# (sun up) azimuth stay within `tolerance` degrees of SPA; spa_numba is the same computation.
+
+strategies = ['spa', 'spa_numba', 'ephemeris', 'interpolated']
+tolerance = {'spa' : 0.0, 'spa_numba' : 1e-6, 'ephemeris' : 0.01, 'interpolated' : 0.05}
+columns = ['apparent_zenith', 'zenith', 'apparent_elevation', 'elevation', 'azimuth']
+
+
+def _ns(index : pd.DatetimeIndex):
+    return np.asarray(index.tz_convert('UTC') if index.tz is not None else index, dtype='datetime64[ns]').view('int64')
+
+
+def interpolated(location : Location, times : pd.DatetimeIndex, step : str = '15min', temperature = 12):
+    # Runs SPA on a coarse grid covering `times` and interpolates every angle onto `times`.
+    # Azimuth is unwrapped first so the interpolation does not cross the 0/360 seam the long way.
+    step = pd.Timedelta(step)
+    # The grid is floored in UTC: local flooring fails on times a DST change makes ambiguous and
+    # puts the grid off the UTC hour in zones with a fractional offset
+    first, last = times[0], times[-1]
+    if times.tz is not None:
+        first, last = first.tz_convert('UTC'), last.tz_convert('UTC')
+    coarse = pd.date_range(first.floor(step), last.ceil(step), freq=step)
+    if times.tz is not None:
+        coarse = coarse.tz_convert(times.tz)
+    x, xp = _ns(times), _ns(coarse)
+    if np.ndim(temperature):
+        temperature = np.interp(xp, x, np.asarray(temperature, dtype=float))
+    position = location.get_solarposition(coarse, temperature=temperature)
+
+    result = {name: np.interp(x, xp, position[name].to_numpy()) for name in columns if name != 'azimuth'}
+    azimuth = np.unwrap(position['azimuth'].to_numpy(), period=360)
+    result['azimuth'] = np.interp(x, xp, azimuth) % 360
+    return pd.DataFrame(result, index=times)[columns]
+
+
+def get_solarposition(location : Location, times : pd.DatetimeIndex, strategy : str = 'spa', temperature = 12,
+                      **kwargs):
+    # Solar position of `times` at `location` with the chosen strategy. `temperature` (air
+    # temperature in C, scalar or per time step) only affects the refraction correction of the
+    # apparent angles; ModelChain passes the weather's temp_air here.
+    if strategy == 'spa':
+        position = location.get_solarposition(times, temperature=temperature)
+    elif strategy == 'spa_numba':
+        position = location.get_solarposition(times, temperature=temperature, method='nrel_numba')
+    elif strategy == 'ephemeris':
+        position = location.get_solarposition(times, temperature=temperature, method='ephemeris')
+    elif strategy == 'interpolated':
+        return interpolated(location, times, temperature=temperature, **kwargs)
+    else:
+        raise ValueError("Unknown solar position strategy: " + str(strategy))
+    return position[columns]
+
+
+def check_strategy(location : Location,
+                   times : pd.DatetimeIndex,
+                   strategy : str,
+                   surface_tilt : float = 30,
+                   surface_azimuth : float = 180,
+                   **kwargs):
+    # Maximum angle errors against full SPA and the clear-sky energy difference they cause
+    import simulation
+
+    start = time.time()
+    reference = simulation.solar_geometry(location, times)
+    reference_seconds = time.time() - start
+    start = time.time()
+    geometry = simulation.solar_geometry(location, times, strategy=strategy, **kwargs)
+    seconds = time.time() - start
+
+    zenith_error = (geometry['zenith'] - reference['zenith']).abs()
+    # Azimuth is only meaningful with the sun up, and differences wrap around 360
+    up = reference['elevation'] > 0
+    azimuth_error = ((geometry['azimuth'] - reference['azimuth'] + 180) % 360 - 180).abs()[up]
+
+    energy = []
+    for g in [reference, geometry]:
+        ac = simulation.run_system(g, simulation.clear_sky(location, g), surface_tilt, surface_azimuth)['ac']
+        energy.append(ac.clip(lower=0).sum())
+    return {'strategy' : strategy,
+            'max_zenith_error' : zenith_error.max(),
+            'max_azimuth_error' : azimuth_error.max() if up.any() else 0.0,
+            'energy_difference' : (energy[1] - energy[0]) / energy[0] if energy[0] else 0.0,
+            'seconds' : seconds,
+            'speedup' : reference_seconds / seconds if seconds else float('inf')}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare solar position strategies against full SPA")
+    parser.add_argument('--start', default='2021-01-01')
+    parser.add_argument('--end', default='2021-12-31')
+    parser.add_argument('--freq', default='1min')
+    parser.add_argument('--strategy', choices=strategies, action='append')
+    args = parser.parse_args()
+
+    times = pd.date_range(args.start, args.end, freq=args.freq, tz='Etc/GMT-2')
+    location = Location(60.45, 22.29, 'Etc/GMT-2', 25, name='Turku')
+    report = pd.DataFrame([check_strategy(location, times, strategy)
+                           for strategy in args.strategy or strategies[1:]])
+    print(report.to_string(index=False))
@@ -0,0 +1,297 @@
+import collections
+import contextlib
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+
+# Live run telemetry -----------------------------------------------------------------------------
+#
+# Long runs report what they are doing to one process-wide registry:
+#
+#   add_rows(stage, n)          rows done by a stage (task graph node kinds, pipeline stages, ...)
+#   add_units(n) / unit_done()  (site, system, chunk) units queued and finished
+#   set_units(...)              absolute unit counts, for callers that know them (work queue)
+#   cache(name, hits, misses)   hits and misses of a cache kept by the caller
+#   watch_cache(name, info)     a functools.lru_cache's cache_info, read at every export
+#
+# and the registry is exported in the Prometheus text format, as a file rewritten every
+# `interval` seconds (for node_exporter's textfile collector; written to a temporary file and
+# renamed, so a scrape never sees half a file) and/or on a local HTTP endpoint (/metrics).
+# Rates and the ETA are taken over the last `rate_window` seconds, so a stall shows up as a
+# falling rate within a minute instead of being averaged away over hours. Resident memory is
+# that of this process; pool workers in other processes are not included.
+#
+# Updating costs a lock and a dict update, so the calls stay in place whether or not anything
+# is exported.
+
+rate_window = 60.0 # seconds
+interval = 15.0 # seconds between textfile rewrites
+prefix = 'pv_'
+
+
+def resident_memory():
+    # (current, peak) resident set size of this process in bytes, None where the platform
+    # does not tell (current needs /proc, peak the resource module)
+    peak = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = peak if sys.platform == 'darwin' else peak * 1024
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE'), peak
+    except OSError:
+        return None, peak
+
+
+def count_rows(value):
+    # Rows of a DataFrame/Series/array/TimeAxis result, 0 for anything else
+    if hasattr(value, 'shape') and len(getattr(value, 'shape')):
+        return int(value.shape[0])
+    if hasattr(value, 'step') and hasattr(value, '__len__'):
+        return len(value)
+    return 0
+
+
+class Telemetry:
+
+    def __init__(self, run : str = 'pv'):
+        self._lock = threading.Lock()
+        self.watched = {}
+        self.reset(run)
+
+    def reset(self, run : str = 'pv'):
+        # Starts a new run; watched caches stay registered
+        self.run = run
+        self.start = time.time()
+        self.last_progress = self.start
+        self.rows = {}
+        self.units = {'completed' : 0, 'pending' : 0, 'failed' : 0}
+        self.caches = {}
+        self._samples = collections.deque() # (time, rows by stage, completed units)
+
+    def add_rows(self, stage : str, n : int):
+        with self._lock:
+            self.rows[stage] = self.rows.get(stage, 0) + int(n)
+            self.last_progress = time.time()
+
+    def add_units(self, n : int = 1):
+        with self._lock:
+            self.units['pending'] += n
+
+    def unit_done(self, n : int = 1, failed : bool = False):
+        with self._lock:
+            self.units['pending'] = max(self.units['pending'] - n, 0)
+            self.units['failed' if failed else 'completed'] += n
+            self.last_progress = time.time()
+
+    def set_units(self, completed : int, pending : int, failed : int = 0):
+        with self._lock:
+            if completed > self.units['completed']:
+                self.last_progress = time.time()
+            self.units = {'completed' : completed, 'pending' : pending, 'failed' : failed}
+
+    def cache(self, name : str, hits : int = 0, misses : int = 0):
+        with self._lock:
+            counts = self.caches.setdefault(name, [0, 0])
+            counts[0] += hits
+            counts[1] += misses
+
+    def watch_cache(self, name : str, info):
+        self.watched[name] = info
+
+    def snapshot(self):
+        # Current values, with rates over the last rate_window seconds
+        now = time.time()
+        with self._lock:
+            rows = dict(self.rows)
+            units = dict(self.units)
+            caches = {name: tuple(counts) for name, counts in self.caches.items()}
+            last_progress = self.last_progress
+            self._samples.append((now, rows, units['completed']))
+            while len(self._samples) > 1 and now - self._samples[1][0] >= rate_window:
+                self._samples.popleft()
+            then, then_rows, then_completed = self._samples[0]
+        for name, info in self.watched.items():
+            info = info()
+            caches[name] = (info.hits, info.misses)
+
+        elapsed = now - then
+        if elapsed <= 0:
+            then, then_rows, then_completed, elapsed = self.start, {}, 0, max(now - self.start, 1e-9)
+        unit_rate = (units['completed'] - then_completed) / elapsed
+        memory, peak = resident_memory()
+        return {'rows' : rows,
+                'rows_per_second' : {stage: (n - then_rows.get(stage, 0)) / elapsed for stage, n in rows.items()},
+                'units' : units,
+                'eta_seconds' : units['pending'] / unit_rate if unit_rate > 0 else (0.0 if not units['pending'] else math.nan),
+                'caches' : caches,
+                'memory' : memory,
+                'peak_memory' : peak,
+                'start' : self.start,
+                'last_progress' : last_progress}
+
+    def render(self):
+        # The snapshot in the Prometheus text exposition format
+        values = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append("# HELP %s%s %s" % (prefix, name, help))
+            lines.append("# TYPE %s%s %s" % (prefix, name, kind))
+            for labels, value in samples:
+                labels = dict({'run' : self.run}, **labels)
+                text = ",".join('%s="%s"' % (key, str(label).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                                for key, label in labels.items())
+                lines.append("%s%s{%s} %s" % (prefix, name, text, _number(value)))
+
+        metric('rows_total', 'counter', "Rows processed per stage",
+               [({'stage' : stage}, n) for stage, n in sorted(values['rows'].items())])
+        metric('rows_per_second', 'gauge', "Rows per second per stage over the last %g s" % rate_window,
+               [({'stage' : stage}, n) for stage, n in sorted(values['rows_per_second'].items())])
+        metric('units', 'gauge', "Units of work by state",
+               [({'state' : state}, n) for state, n in values['units'].items()])
+        metric('eta_seconds', 'gauge', "Estimated seconds until the pending units are done", [({}, values['eta_seconds'])])
+        metric('cache_hits_total', 'counter', "Cache hits", [({'cache' : name}, hits) for name, (hits, _) in sorted(values['caches'].items())])
+        metric('cache_misses_total', 'counter', "Cache misses", [({'cache' : name}, misses) for name, (_, misses) in sorted(values['caches'].items())])
+        # A cache without lookups has no ratio, so it gets no sample rather than NaN
+        metric('cache_hit_ratio', 'gauge', "Share of cache lookups that hit",
+               [({'cache' : name}, hits / (hits + misses))
+                for name, (hits, misses) in sorted(values['caches'].items()) if hits + misses])
+        if values['memory'] is not None:
+            metric('resident_memory_bytes', 'gauge', "Resident set size of the process", [({}, values['memory'])])
+        if values['peak_memory'] is not None:
+            metric('peak_resident_memory_bytes', 'gauge', "Peak resident set size of the process", [({}, values['peak_memory'])])
+        metric('start_time_seconds', 'gauge', "Unix time the run started", [({}, values['start'])])
+        metric('last_progress_time_seconds', 'gauge', "Unix time rows or units last advanced", [({}, values['last_progress'])])
+        return "\n".join(lines) + "\n"
+
+
+def _number(value):
+    if isinstance(value, float) and math.isnan(value):
+        return 'NaN'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+current = Telemetry()
+
+
+def add_rows(stage : str, n : int):
+    current.add_rows(stage, n)
+
+
+def add_units(n : int = 1):
+    current.add_units(n)
+
+
+def unit_done(n : int = 1, failed : bool = False):
+    current.unit_done(n, failed)
+
+
+def set_units(completed : int, pending : int, failed : int = 0):
+    current.set_units(completed, pending, failed)
+
+
+def cache(name : str, hits : int = 0, misses : int = 0):
+    current.cache(name, hits, misses)
+
+
+def watch_cache(name : str, info):
+    current.watch_cache(name, info)
+
+
+# Exporters --------------------------------------------------------------------------------------
+
+class TextfileExporter:
+
+    def __init__(self, path : str, interval : float = interval, telemetry : Telemetry = current):
+        self.path = path
+        self.interval = interval
+        self.telemetry = telemetry
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def write(self):
+        # Rendered first, so a failure cannot leave a temporary file behind
+        text = self.telemetry.render()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, self.path)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.write()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.write() # the final state
+
+
+def serve(port : int, host : str = '127.0.0.1', telemetry : Telemetry = current):
+    # Serves the metrics on http://host:port/metrics from a daemon thread; returns the server
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = telemetry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@contextlib.contextmanager
+def exporting(run : str, metrics_file : str = None, metrics_port : int = None, metrics_interval : float = interval):
+    # Resets the registry for `run` and exports it for the duration of the block
+    current.reset(run)
+    exporter = TextfileExporter(metrics_file, metrics_interval).start() if metrics_file else None
+    server = serve(metrics_port) if metrics_port else None
+    if server is not None:
+        print("Metrics on http://%s:%d/metrics" % server.server_address[:2])
+    try:
+        yield current
+    finally:
+        if exporter is not None:
+            exporter.stop()
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+
+def add_arguments(parser):
+    parser.add_argument('--metrics-file', default=None,
+                        help="Rewrite Prometheus metrics into this file (e.g. a node_exporter textfile .prom)")
+    parser.add_argument('--metrics-port', type=int, default=None, help="Serve metrics on localhost at this port")
+    parser.add_argument('--metrics-interval', type=float, default=interval, help="Seconds between metrics file rewrites")
+
+
+def from_args(run : str, args):
+    return exporting(run, args.metrics_file, args.metrics_port, args.metrics_interval)
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+# The modules live at the top of the repository, next to the scripts
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import simulation
+import validation
+
+
+@pytest.fixture(scope='session')
+def weather_file(tmp_path_factory):
+    # Four days of synthetic 1-minute weather in the StarkeDFC layout, local time without DST
+    location = simulation.make_location({'name' : 'Turku', 'latitude' : 60.45, 'longitude' : 22.29,
+                                         'altitude' : 50, 'tz' : 'Etc/GMT-2'})
+    times = pd.date_range('2019-06-01', periods=4 * 1440, freq='1min', tz='Etc/GMT-2')
+    geometry = simulation.solar_geometry(location, times)
+    weather = validation.synthetic_weather(location, geometry)
+    dt = times.strftime('%Y-%m-%d %H:%M:%S')
+    columns = {value: key for key, value in simulation.weather_columns.items()}
+    frame = pd.DataFrame({'dt_orig' : dt, 'dt' : dt,
+                          'solar_azimuth' : geometry['azimuth'].to_numpy(),
+                          'apparent_zenith' : geometry['apparent_zenith'].to_numpy()})
+    for column in ['ghi', 'dni', 'dhi', 'temp_air', 'wind_speed']:
+        frame[column] = weather[column].to_numpy() if column in weather else 1.0
+    path = tmp_path_factory.mktemp('weather') / 'weather.csv'
+    frame.rename(columns=columns).to_csv(path, index=False)
+    return str(path)
@@ -0,0 +1,75 @@
+import os
+import time
+
+import pandas as pd
+import pytest
+
+import checkpoint
+import scenario
+
+
+def two_system_scenario():
+    return {'name' : 'test',
+            'sites' : [{'name' : 'Turku', 'latitude' : 60.45, 'longitude' : 22.29, 'altitude' : 25, 'tz' : 'Etc/GMT-2'}],
+            'systems' : [{'name' : 'S', 'surface_tilt' : 30, 'surface_azimuth' : 180},
+                         {'name' : 'E', 'surface_tilt' : 90, 'surface_azimuth' : 90}],
+            'time_ranges' : [{'name' : 'june', 'start' : '2021-06-01', 'end' : '2021-06-02 23:59', 'freq' : '1min'}],
+            'outputs' : ['ac', 'monthly_average_day', 'energy']}
+
+
+def assert_results_equal(left, right):
+    assert list(left) == list(right)
+    for unit in left:
+        pd.testing.assert_series_equal(left[unit]['ac'], right[unit]['ac'])
+        pd.testing.assert_frame_equal(left[unit]['monthly_average_day'], right[unit]['monthly_average_day'])
+        pd.testing.assert_frame_equal(left[unit]['energy'], right[unit]['energy'])
+
+
+def test_save_load_and_first_save_wins(tmp_path):
+    store = checkpoint.CheckpointStore(str(tmp_path))
+    assert not store.done(['unit', 1])
+    assert store.save(['unit', 1], {'value' : 1})
+    assert store.done(['unit', 1])
+    assert not store.save(['unit', 1], {'value' : 2}, replace=False)
+    assert store.load(['unit', 1]) == {'value' : 1}
+    store.save(['unit', 1], {'value' : 3})
+    assert store.load(['unit', 1]) == {'value' : 3}
+    assert store.keys() == [['unit', 1]]
+    assert [name for name in os.listdir(tmp_path) if name.endswith('.tmp')] == []
+
+
+def test_other_format_versions_are_ignored(tmp_path):
+    checkpoint.CheckpointStore(str(tmp_path), version=checkpoint.version - 1).save(['unit'], 'old format')
+    store = checkpoint.CheckpointStore(str(tmp_path))
+    assert not store.done(['unit'])
+    assert store.keys() == []
+
+
+def test_interrupted_run_resumes(tmp_path, monkeypatch):
+    expected = scenario.run_scenario(two_system_scenario())
+    run_system = scenario.run_system
+
+    def fail_east(system, *args, **kwargs):
+        # Interrupted once the other unit has been saved
+        if system['name'] == 'E':
+            deadline = time.time() + 30
+            while not any(name.endswith('.pkl') for name in os.listdir(tmp_path)) and time.time() < deadline:
+                time.sleep(0.01)
+            raise RuntimeError("interrupted")
+        return run_system(system, *args, **kwargs)
+
+    monkeypatch.setattr(scenario, 'run_system', fail_east)
+    with pytest.raises(RuntimeError):
+        scenario.run_scenario(two_system_scenario(), workers=2, checkpoint_dir=str(tmp_path))
+    assert len(checkpoint.CheckpointStore(str(tmp_path)).keys()) == 1
+
+    monkeypatch.setattr(scenario, 'run_system', run_system)
+    assert_results_equal(scenario.run_scenario(two_system_scenario(), checkpoint_dir=str(tmp_path)), expected)
+    assert len(checkpoint.CheckpointStore(str(tmp_path)).keys()) == 2
+
+    # A complete checkpoint directory needs no model runs at all
+    def no_run(*args, **kwargs):
+        raise AssertionError("a checkpointed unit was recomputed")
+
+    monkeypatch.setattr(scenario, 'run_system', no_run)
+    assert_results_equal(scenario.run_scenario(two_system_scenario(), checkpoint_dir=str(tmp_path)), expected)
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import energy
+
+
+def power_series(start : str, periods : int, seed : int, tz : str = 'Europe/Helsinki'):
+    times = pd.date_range(start, periods=periods, freq='1h', tz=tz)
+    return pd.Series(np.random.default_rng(seed).uniform(-2, 250, periods), index=times)
+
+
+def rollups():
+    # Three rollups with overlapping days and systems
+    parts = []
+    for i, (system, start) in enumerate([('S', '2021-03-01'), ('S', '2021-03-02 12:00'), ('E', '2021-03-01 06:00')]):
+        r = energy.EnergyRollup()
+        r.add(system, 'ac', power_series(start, 96, seed=i), kwp=1.0)
+        parts.append(r)
+    return parts
+
+
+def sorted_table(r):
+    return r.table().sort_values(['system', 'quantity', 'level', 'period']).reset_index(drop=True)
+
+
+def test_merge_is_associative():
+    a, b, c = rollups()
+    left = a.merge(b).merge(c)
+    a, b, c = rollups()
+    right = a.merge(b.merge(c))
+    pd.testing.assert_frame_equal(sorted_table(left), sorted_table(right))
+
+
+def test_merge_equals_adding_everything_to_one_rollup():
+    merged = rollups()
+    merged = merged[0].merge(merged[1]).merge(merged[2])
+    single = energy.EnergyRollup()
+    for i, (system, start) in enumerate([('S', '2021-03-01'), ('S', '2021-03-02 12:00'), ('E', '2021-03-01 06:00')]):
+        single.add(system, 'ac', power_series(start, 96, seed=i), kwp=1.0)
+    pd.testing.assert_frame_equal(sorted_table(merged), sorted_table(single))
+
+
+@pytest.mark.parametrize('month', ['2021-03', '2021-10'])
+def test_average_power_in_a_dst_month_matches_resample(month):
+    # March 2021 has 743 local hours in Helsinki and October 745
+    power = power_series('2021-03-01', 24 * 245, seed=7)
+    table = energy.rollup({'ac' : power}, system='S')
+    expected = power.resample('MS').mean()[pd.Timestamp(month, tz='Europe/Helsinki')]
+    assert energy.average_power(table, ['S'], month, tz='Europe/Helsinki') == pytest.approx(expected, rel=1e-12)
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import high_resolution
+
+
+inverter = pd.Series({'Paco' : 250.0, 'Pdco' : 260.0})
+systems = {'S' : (30, 180)}
+
+
+def synthetic(n : int = 7200):
+    # Two hours at 1 s: a slow swell with one clipping plateau, one step up and a short spell of
+    # overirradiance
+    times = pd.date_range('2021-06-01 10:00', periods=n, freq='1s', tz='Etc/GMT-2')
+    t = np.arange(n)
+    ac = 100 + 20 * np.sin(t / 600)
+    ac[1000:1100] = 250
+    ac[3000:] += 100
+    p_mp = ac + 5
+    p_mp[1000:1100] = 280
+    clear_ghi = np.full(n, 800.0)
+    ghi = clear_ghi * 0.9
+    ghi[5000:5010] = clear_ghi[5000:5010] * 1.1
+    weather = pd.DataFrame({'ghi' : ghi}, index=times)
+    result = pd.DataFrame({'ac' : ac, 'p_mp' : p_mp, 'poa_global' : ghi}, index=times)
+    return weather, {'S' : result}, clear_ghi
+
+
+def run(rows : int, weather, results, clear_ghi):
+    stats = high_resolution.HighResolutionStats(systems, inverter, 10**9)
+    for start in range(0, len(weather), rows):
+        part = slice(start, start + rows)
+        stats.add(weather.iloc[part], {name: result.iloc[part] for name, result in results.items()}, clear_ghi[part])
+    return stats.finish('Etc/GMT-2')
+
+
+def test_events_and_windows():
+    results = run(7200, *synthetic())
+    events = results['events']
+    # The plateau's edges are ramps too
+    assert events['kind'].value_counts().to_dict() == {'ramp' : 3, 'clipping' : 1, 'overirradiance' : 1}
+    ramp = events[events['kind'] == 'ramp'].iloc[-1]
+    events = events.set_index('kind')
+
+    clipping = events.loc['clipping']
+    assert clipping['start'] == pd.Timestamp('2021-06-01 10:16:40', tz='Etc/GMT-2')
+    assert clipping['duration_s'] == 100
+    assert clipping['peak'] == 280
+    # The step of 100 W is 40 % of rated power, flagged for the minute it stays in the window
+    assert ramp['start'] == pd.Timestamp('2021-06-01 10:50:00', tz='Etc/GMT-2')
+    assert ramp['duration_s'] == 60
+    assert ramp['peak'] == pytest.approx(40, abs=0.5)
+    assert events.loc['overirradiance', 'duration_s'] == 10
+
+    clip_row = results['clipping'].iloc[0]
+    assert clip_row['clipped_s'] == 100 and clip_row['clipping_events'] == 1
+    assert clip_row['clipped_dc_kwh'] == pytest.approx(100 * 20 / 3600 / 1000)
+
+    window = results['windows'][clipping['event']]
+    pad = pd.Timedelta(seconds=high_resolution.window_pad)
+    assert window.index[0] == clipping['start'] - pad
+    assert window.index[-1] == clipping['end'] + pad
+    assert len(window) == 100 + 2 * high_resolution.window_pad
+
+
+@pytest.mark.parametrize('rows', [61, 997])
+def test_results_do_not_depend_on_the_chunk_size(rows):
+    inputs = synthetic()
+    single, chunked = run(7200, *inputs), run(rows, *inputs)
+    for name in ['ramps', 'clipping', 'events']:
+        pd.testing.assert_frame_equal(single[name], chunked[name])
+    assert list(single['windows']) == list(chunked['windows'])
+    for event, window in single['windows'].items():
+        pd.testing.assert_frame_equal(window, chunked['windows'][event])
+
+
+def test_percentiles_match_numpy():
+    n = 20000
+    weather, results, clear_ghi = synthetic(n)
+    ac = 125 + np.cumsum(np.random.default_rng(0).normal(0, 1, n))
+    results['S']['ac'] = ac
+    ramps = run(5000, weather, results, clear_ghi)['ramps'].set_index('window_s')
+    width = high_resolution.ramp_bins[1] - high_resolution.ramp_bins[0]
+    for window in high_resolution.ramp_windows:
+        changes = np.abs(ac[window:] - ac[:-window]) / inverter['Paco'] * 100
+        row = ramps.loc[window]
+        assert row['max_pct'] == pytest.approx(changes.max())
+        for q in high_resolution.percentiles:
+            assert row['p' + str(q)] == pytest.approx(np.percentile(changes, q), abs=width)
+            assert row['p' + str(q)] <= row['max_pct']
+
+
+def test_percentiles_stay_within_the_largest_value():
+    # Every value sits low in its bin, so the bin centre would be above all of them
+    values = np.array([10.001, 10.002, 10.003, 10.004])
+    histogram = np.histogram(values, high_resolution.ramp_bins)[0]
+    for q in high_resolution.percentiles:
+        percentile = high_resolution.histogram_percentile(histogram, q, values.max())
+        assert values.min() - 0.05 <= percentile <= values.max()
+    assert np.isnan(high_resolution.histogram_percentile(np.zeros_like(histogram), 50, 0.0))
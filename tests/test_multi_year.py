@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import simulation
+import multi_year
+
+
+site = {'name' : 'Turku', 'latitude' : 60.45, 'longitude' : 22.29, 'altitude' : 25, 'tz' : 'Etc/GMT-2'}
+
+
+@pytest.fixture(scope='module')
+def weather():
+    # A leap year and a common year of hourly clear sky
+    location = simulation.make_location(site)
+    times = pd.date_range('2020-01-01', '2021-12-31 23:00', freq='1h', tz=site['tz'])
+    return simulation.clear_sky(location, simulation.solar_geometry(location, times))
+
+
+def test_unshared_geometry_equals_separate_runs(weather):
+    batch = multi_year.YearBatch(weather, step='1h')
+    per_year = multi_year.run_years(site, {'S' : (30, 180)}, batch, tolerance=0)['per_year']
+    location = simulation.make_location(site)
+    for year in [2020, 2021]:
+        w = weather[weather.index.year == year]
+        ac = simulation.run_system(simulation.solar_geometry(location, w.index), w, 30, 180)['ac']
+        expected = ac.groupby(ac.index.month).sum() / 1000
+        rows = per_year[per_year['year'] == year].set_index('month')
+        np.testing.assert_allclose(rows['energy_kwh'], expected, rtol=1e-9)
+        np.testing.assert_array_equal(rows['coverage'], 1.0)
+
+
+def test_29_february_is_missing_in_a_common_year(weather):
+    batch = multi_year.YearBatch(weather, step='1h')
+    leap, common = batch.years.index(2020), batch.years.index(2021)
+    grid_day = np.flatnonzero((batch.day_month == 2) & (batch.day_of_month == 29))[0]
+    day = slice(grid_day * batch.per_day, (grid_day + 1) * batch.per_day)
+    assert batch.present[leap, day].all()
+    assert not batch.present[common, day].any()
+    # 1 March follows on the next grid day in both years, not on the empty 29 February
+    march = slice(day.stop, day.stop + batch.per_day)
+    for i, year in [(leap, 2020), (common, 2021)]:
+        np.testing.assert_array_equal(batch.weather['ghi'][i, march], weather.loc[str(year) + '-03-01', 'ghi'])
+    _, coverage = batch.monthly_energy(np.zeros((len(batch.years), batch.n)))
+    np.testing.assert_array_equal(coverage, 1.0)
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+import simulation
+import energy
+import pipeline
+
+
+site = {'name' : 'Turku', 'latitude' : 60.45, 'longitude' : 22.29, 'altitude' : 50, 'tz' : 'Etc/GMT-2'}
+systems = {'E' : (90, 90), 'S' : (30, 180)}
+
+
+def test_pipeline_equals_direct_runs(weather_file, tmp_path):
+    results = pipeline.run_pipeline(weather_file, site, systems, output_dir=str(tmp_path), chunk_rows=1000,
+                                    workers=2, depth=2, writers=2)
+
+    weather = simulation.load_weather(weather_file, site['tz'])
+    geometry = simulation.solar_geometry(simulation.make_location(site), weather.index,
+                                         temperature=weather['temp_air'].to_numpy())
+    kwp = energy.rated_kwp(simulation.load_components()[0])
+    rollup = energy.EnergyRollup()
+    for name, (tilt, az) in systems.items():
+        ac = simulation.run_system(geometry, weather, tilt, az)['ac']
+        rollup.add(name, 'ac', ac, kwp=kwp)
+        written = pd.read_csv(pipeline.production_path(str(tmp_path), name, 6), index_col=0)['Power']
+        np.testing.assert_allclose(written.to_numpy(), ac.to_numpy(), rtol=1e-12)
+        assert len(written) == len(ac)
+
+    sort = ['system', 'quantity', 'level', 'period']
+    pd.testing.assert_frame_equal(results['energy'].sort_values(sort, ignore_index=True),
+                                  rollup.table().sort_values(sort, ignore_index=True), rtol=1e-12)
@@ -0,0 +1,75 @@
+import pandas as pd
+import pytest
+
+import planner
+import scenario
+
+
+def planned_scenario(site : dict, time_range : dict):
+    return {'name' : 'test', 'sites' : [site],
+            'systems' : [{'name' : 'E', 'surface_tilt' : 90, 'surface_azimuth' : 90},
+                         {'name' : 'S', 'surface_tilt' : 30, 'surface_azimuth' : 180}],
+            'time_ranges' : [time_range],
+            'outputs' : ['ac', 'monthly_average_day', 'energy']}
+
+
+def budget(config : dict, days : float):
+    # A memory budget that fits about `days` days of 1-minute rows per chunk
+    times, fixed = planner.range_times(config['sites'][0], config['time_ranges'][0])
+    shared, per_system = planner.row_costs()
+    systems = len(config['systems'])
+    kept = len(times) * systems * planner.series_row_bytes
+    return int(kept + fixed + days * 1440 * (shared + systems * per_system))
+
+
+def assert_results_equal(left, right):
+    assert list(left) == list(right)
+    for unit in left:
+        pd.testing.assert_series_equal(left[unit]['ac'], right[unit]['ac'], check_freq=False)
+        pd.testing.assert_frame_equal(left[unit]['monthly_average_day'], right[unit]['monthly_average_day'])
+        pd.testing.assert_frame_equal(left[unit]['energy'], right[unit]['energy'])
+
+
+def test_chunks_are_cut_at_local_midnight():
+    times = pd.date_range('2021-03-27', '2021-03-30 23:59', freq='1min', tz='Europe/Helsinki')
+    ranges = planner.split_rows(times, 2000)
+    assert len(ranges) == 4
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(times)
+    for start, stop in ranges[1:]:
+        assert times[start].hour == 0 and times[start].minute == 0
+
+
+def test_planned_clear_sky_run_equals_unchunked_run_across_dst():
+    config = planned_scenario({'name' : 'Turku', 'latitude' : 60.45, 'longitude' : 22.29, 'altitude' : 25,
+                               'tz' : 'Europe/Helsinki'},
+                              {'name' : 'spring', 'start' : '2021-03-26', 'end' : '2021-03-30 23:59', 'freq' : '1min'})
+    max_memory = budget(config, 1.5)
+    p = planner.plan(5 * 1440 - 60, 2, max_memory, series=1)
+    assert p['rows'] < 5 * 1440 - 60
+    assert_results_equal(planner.run_planned(config, max_memory), scenario.run_scenario(config))
+
+
+def test_planned_weather_file_run_equals_unchunked_run(weather_file):
+    config = planned_scenario({'name' : 'Turku', 'latitude' : 60.45, 'longitude' : 22.29, 'altitude' : 50,
+                               'tz' : 'Etc/GMT-2', 'weather' : weather_file},
+                              {'name' : 'june', 'start' : '2019-06-01', 'end' : '2019-06-04 23:59'})
+    expected = scenario.run_scenario(config)
+    scenario._cached_weather.cache_clear()
+    assert_results_equal(planner.run_planned(config, budget(config, 3), workers=2), expected)
+    # Planning and every chunk share one parsed copy of the file
+    assert scenario._cached_weather.cache_info().misses == 1
+
+
+def test_weather_file_is_parsed_again_when_it_changes(weather_file, tmp_path):
+    path = tmp_path / 'weather.csv'
+    path.write_text(open(weather_file).read())
+    first = scenario.load_weather_file(str(path), 'Etc/GMT-2')
+    assert scenario.load_weather_file(str(path), 'Etc/GMT-2') is first
+    lines = path.read_text().splitlines(keepends=True)
+    path.write_text("".join(lines[:-1440]))
+    assert len(scenario.load_weather_file(str(path), 'Etc/GMT-2')) == len(first) - 1440
+
+
+def test_a_budget_below_the_kept_series_is_rejected():
+    with pytest.raises(ValueError, match='series outputs'):
+        planner.plan(525600, 3, 1024, series=1)
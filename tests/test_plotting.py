@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+import plotting
+
+
+def noisy(n : int = 10000):
+    rng = np.random.default_rng(0)
+    return np.cumsum(rng.normal(0, 1, n))
+
+
+def test_lttb_keeps_the_endpoints_and_returns_the_threshold():
+    y = noisy()
+    idx = plotting.lttb_indices(y, 500)
+    assert len(idx) == 500
+    assert idx[0] == 0 and idx[-1] == len(y) - 1
+    assert np.all(np.diff(idx) > 0)
+
+
+def test_minmax_keeps_the_endpoints_and_extremes():
+    y = noisy()
+    idx = plotting.minmax_indices(y, 250)
+    assert idx[0] == 0 and idx[-1] == len(y) - 1
+    assert len(idx) <= 3 * 250 + 1
+    assert np.all(np.diff(idx) > 0)
+    assert y.argmin() in idx and y.argmax() in idx
+
+
+def test_short_series_are_returned_unchanged():
+    y = noisy(100)
+    np.testing.assert_array_equal(plotting.lttb_indices(y, 100), np.arange(100))
+    np.testing.assert_array_equal(plotting.lttb_indices(y, 500), np.arange(100))
+    np.testing.assert_array_equal(plotting.minmax_indices(y, 50), np.arange(100))
+    series = pd.Series(y)
+    assert plotting.downsample(series, 200, 'lttb').equals(series)
+    assert plotting.downsample(series, 200, 'minmax').equals(series)
+
+
+def test_minmax_ignores_nan():
+    y = noisy(1000)
+    y[::7] = np.nan
+    idx = plotting.minmax_indices(y, 100)
+    assert np.nanargmax(y) in idx and np.nanargmin(y) in idx
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import result_store
+
+
+@pytest.fixture(scope='module')
+def stored(tmp_path_factory):
+    # Three weeks of 1-minute power across the spring DST change, with a gap
+    times = pd.date_range('2021-03-15', '2021-04-05', freq='1min', tz='Europe/Helsinki', inclusive='left')
+    power = pd.Series(np.random.default_rng(0).random(len(times)) * 1000, index=times)
+    power.iloc[1000:1100] = np.nan
+    store = result_store.PyramidStore(str(tmp_path_factory.mktemp('store')))
+    store.write('Turku', 'S', power)
+    return store, power
+
+
+def test_daily_energy_across_dst(stored):
+    store, power = stored
+    energy = store.energy('Turku', 'S', '1D', '2021-03-27', '2021-03-30')
+    expected = power['2021-03-27':'2021-03-29'].resample('1D').sum() / 60 / 1000
+    assert list(energy.index) == list(expected.index)
+    np.testing.assert_allclose(energy, expected)
+    # The day of the change has 23 hours
+    counts = store.query('Turku', 'S', '1D', '2021-03-27', '2021-03-30', stat='count')
+    assert counts.tolist() == [1440, 1380, 1440]
+
+
+def test_queries_read_the_coarsest_level(stored):
+    store, power = stored
+    assert store.choose_level('1D', pd.Timestamp('2021-03-28', tz='Europe/Helsinki')) == '1D'
+    assert store.choose_level('2h') == '1h'
+    assert store.choose_level('1MS') == '1MS'
+    hourly = store.query('Turku', 'S', '2h', '2021-03-16', '2021-03-17')
+    expected = power['2021-03-16':'2021-03-16 23:59']
+    np.testing.assert_allclose(hourly['mean'], expected.resample('2h').mean())
+    np.testing.assert_allclose(hourly['max'], expected.resample('2h').max())
+
+
+def test_monthly_energy_equals_the_sum(stored):
+    store, power = stored
+    energy = store.energy('Turku', 'S', '1MS')
+    np.testing.assert_allclose(energy.sum(), power.sum() / 60 / 1000)
+
+
+def test_non_fixed_bins_are_rejected(stored):
+    store, _ = stored
+    with pytest.raises(ValueError, match='fixed length'):
+        store.query('Turku', 'S', '1W')
+
+
+def test_only_levels_at_or_above_the_input_step_are_stored(tmp_path):
+    times = pd.date_range('2021-06-01', '2021-06-08', freq='1h', tz='Europe/Helsinki', inclusive='left')
+    power = pd.Series(np.arange(len(times), dtype=float), index=times)
+    store = result_store.PyramidStore(str(tmp_path))
+    store.write('Turku', 'S', power)
+    assert store.meta('Turku', 'S')['levels'] == ['1h', '1D', '1MS']
+    assert not (tmp_path / 'Turku' / 'S' / '1min').exists()
+    np.testing.assert_allclose(store.query('Turku', 'S', '1D', stat='sum'), power.resample('1D').sum())
+    with pytest.raises(ValueError, match='No stored level'):
+        store.query('Turku', 'S', '15min')
+
+
+def test_entries_skip_stray_files(stored, tmp_path):
+    store, _ = stored
+    (tmp_path / 'notes.txt').write_text('')
+    (tmp_path / 'Turku').mkdir()
+    (tmp_path / 'Turku' / 'README').write_text('')
+    store = result_store.PyramidStore(str(tmp_path))
+    assert store.entries() == []
+    store.write('Turku', 'S', stored[1][:120])
+    assert store.entries() == [('Turku', 'S')]
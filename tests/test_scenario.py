@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+import scenario
+import time_axis
+
+
+def clear_sky_scenario(sites : int = 1, systems : int = 1, outputs : tuple = ('ac', 'energy')):
+    # Identical sites and systems under different names
+    return {'name' : 'test',
+            'sites' : [{'name' : 'site' + str(i), 'latitude' : 60.45, 'longitude' : 22.29, 'altitude' : 25,
+                        'tz' : 'Etc/GMT-2'} for i in range(sites)],
+            'systems' : [{'name' : 'system' + str(i), 'surface_tilt' : 30, 'surface_azimuth' : 180}
+                         for i in range(systems)],
+            'time_ranges' : [{'name' : 'june', 'start' : '2021-06-01', 'end' : '2021-06-02 23:59', 'freq' : '1min'}],
+            'outputs' : list(outputs)}
+
+
+def test_adding_a_key_twice_keeps_one_node():
+    graph = scenario.TaskGraph()
+    first = graph.add(('value', 1), lambda: 1)
+    second = graph.add(('value', 1), lambda: 2)
+    assert first == second
+    assert len(graph.nodes) == 1
+
+
+def test_shared_dependencies_run_once():
+    calls = []
+
+    def node(name, value):
+        def run(*deps):
+            calls.append(name)
+            return value + sum(deps)
+        return run
+
+    graph = scenario.TaskGraph()
+    root = graph.add(('root',), node('root', 1))
+    left = graph.add(('left',), node('left', 10), root)
+    right = graph.add(('right',), node('right', 100), root)
+    top = graph.add(('top',), node('top', 1000), left, right)
+    assert graph.run([top, left], workers=4) == {top : 1112, left : 11}
+    assert sorted(calls) == ['left', 'right', 'root', 'top']
+
+
+def test_identical_sites_and_systems_share_every_node():
+    graph, targets = scenario.build_graph(clear_sky_scenario(sites=2, systems=2))
+    kinds = pd.Series([key[0] for key in graph.nodes]).value_counts()
+    assert len(targets) == 4
+    assert kinds['times'] == 1
+    assert kinds['geometry'] == 1
+    assert kinds['system'] == 1
+    # Every unit points at the same output nodes
+    assert len({tuple(sorted(unit_outputs.items())) for unit_outputs in targets.values()}) == 1
+
+
+def test_shared_units_equal_a_single_unit():
+    shared = scenario.run_scenario(clear_sky_scenario(sites=2, systems=2), workers=2)
+    single = scenario.run_scenario(clear_sky_scenario())
+    reference = single[('site0', 'system0', 'june')]
+    for unit_outputs in shared.values():
+        pd.testing.assert_series_equal(unit_outputs['ac'], reference['ac'])
+        pd.testing.assert_frame_equal(unit_outputs['energy'], reference['energy'])
+    assert np.nansum(reference['ac']) > 0
+
+
+def test_one_month_request_matches_the_month_of_a_full_run():
+    config = clear_sky_scenario(outputs=('ac',))
+    config['systems'].append({'name' : 'E', 'surface_tilt' : 90, 'surface_azimuth' : 90})
+    config['time_ranges'] = [{'name' : 'summer', 'start' : '2021-05-30', 'end' : '2021-07-02 23:55', 'freq' : '5min'}]
+    full = scenario.run_scenario(config)
+    june = {system: full[('site0', system, 'summer')]['ac']['2021-06'] for system in ['system0', 'E']}
+
+    request = {'name' : 'june', 'months' : [6], 'groups' : {'both' : ['system0', 'E']}}
+    profile = scenario.run_request(config, dict(request, output='monthly_average_day'))
+    expected = sum(time_axis.AverageDay().add(ac.to_numpy(), ac.index).profile()[6] for ac in june.values())
+    pd.testing.assert_series_equal(profile[('site0', 'summer', 'both', 6)], expected, check_names=False, rtol=1e-12)
+
+    table = scenario.run_request(config, dict(request, output='energy'))
+    assert table['period'].unique().tolist() == ['2021-06']
+    ac = table.loc[table['quantity'] == 'ac', 'energy_kwh'].item()
+    np.testing.assert_allclose(ac, sum(power.sum() for power in june.values()) * 5 / 60 / 1000, rtol=1e-12)
@@ -0,0 +1,47 @@
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import simulation
+import screening
+
+
+@pytest.fixture(scope='module')
+def inputs():
+    # Two clear-sky days with missing weather both at night and by day
+    location = simulation.make_location({'name' : 'Turku', 'latitude' : 60.45, 'longitude' : 22.29,
+                                         'altitude' : 25, 'tz' : 'Europe/Helsinki'})
+    times = pd.date_range('2021-06-01', periods=2 * 288, freq='5min', tz='Europe/Helsinki')
+    geometry = simulation.solar_geometry(location, times)
+    weather = simulation.clear_sky(location, geometry)
+    weather.iloc[10:20] = np.nan
+    weather.iloc[150:160] = np.nan
+    return geometry, weather
+
+
+def test_screening_matches_run_system(inputs):
+    geometry, weather = inputs
+    modules = screening.catalogue_table('SandiaMod', screening.module_parameters,
+                                        '^' + re.escape(simulation.module_name) + '$',
+                                        screening.optional_module_parameters)
+    inverters = screening.catalogue_table('cecinverter', screening.inverter_parameters,
+                                          '^' + re.escape(simulation.inverter_name) + '$')
+    pairs = pd.DataFrame({'module' : modules.index, 'inverter' : inverters.index, 'dc_ac_ratio' : 1.0})
+    table = screening.screen_orientation(geometry, weather, 30, 180, modules, inverters, pairs)
+
+    result = simulation.run_system(geometry, weather, 30, 180)
+    step = 5 / 60
+    assert table['ac_kwh'].iloc[0] == pytest.approx(np.nansum(result['ac']) * step / 1000, rel=1e-9)
+    assert table['dc_kwh'].iloc[0] == pytest.approx(np.nansum(result['p_mp']) * step / 1000, rel=1e-9)
+
+
+def test_night_ac_is_the_negative_tare_whatever_its_sign():
+    inverter = {name: np.array([[value]]) for name, value in
+                {'Paco' : 250, 'Pdco' : 260, 'Vdco' : 40, 'Pso' : 2, 'C0' : 0, 'C1' : 0, 'C2' : 0, 'C3' : 0,
+                 'Pnt' : 0.1}.items()}
+    for pnt in [0.1, -0.1]:
+        inverter['Pnt'] = np.array([[pnt]])
+        ac, clipped = screening.sandia_clipped(np.array([[30.0]]), np.array([[0.0]]), inverter)
+        assert ac[0, 0] == -0.1 and clipped[0, 0] == 0
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+import shading
+
+
+azimuth, elevation = np.meshgrid(np.arange(0, 360, 7.3), np.arange(0.3, 90, 1.7))
+
+
+def test_unobstructed_horizon_does_not_shade():
+    table = shading.ShadingTable(horizon=[[0, 0], [180, 0]])
+    np.testing.assert_array_equal(table.beam_factor(azimuth, elevation), 1.0)
+    assert table.diffuse_factor(30, 180) == pytest.approx(1.0)
+    assert table.diffuse_factor(90, 90) == pytest.approx(1.0)
+    assert shading.from_site({'name' : 'Turku'}) is None
+
+
+def test_horizon_wall_blocks_the_beam_below_it():
+    wall = 20
+    table = shading.ShadingTable(horizon=[[0, wall], [180, wall]])
+    factor = table.beam_factor(azimuth, elevation)
+    np.testing.assert_array_equal(factor[elevation < wall - table.elevation_step], 0.0)
+    np.testing.assert_array_equal(factor[elevation >= wall + table.elevation_step], 1.0)
+    # A horizontal plane sees the cos(elevation)-weighted sky above the wall, cos(wall)^2 of it
+    assert table.diffuse_factor(0, 180) == pytest.approx(np.cos(np.radians(wall)) ** 2, abs=1e-3)
+
+
+def test_obstruction_spanning_north():
+    table = shading.ShadingTable(obstructions=[{'azimuth' : [340, 20], 'elevation' : 30, 'transmittance' : 0.4}])
+    np.testing.assert_allclose(table.beam_factor([350, 10, 90], [10, 10, 10]), [0.4, 0.4, 1.0])
@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import simulation
+import shared_arrays
+
+
+@pytest.fixture(scope='module')
+def inputs():
+    location = simulation.make_location({'name' : 'Turku', 'latitude' : 60.45, 'longitude' : 22.29,
+                                         'altitude' : 25, 'tz' : 'Etc/GMT-2'})
+    times = pd.date_range('2021-06-01', periods=2 * 1440, freq='1min', tz='Etc/GMT-2')
+    geometry = simulation.solar_geometry(location, times)
+    return geometry, simulation.clear_sky(location, geometry)
+
+
+def test_attached_views_share_the_owners_memory(tmp_path):
+    for directory in [None, str(tmp_path)]:
+        with shared_arrays.SharedArrays({'a' : np.arange(5.0), 'b' : np.ones((2, 3), dtype=np.int32)}, directory) as shared:
+            views = shared_arrays.attach(shared.spec)
+            np.testing.assert_array_equal(views['b'], np.ones((2, 3)))
+            views['a'][0] = 42
+            assert shared.arrays['a'][0] == 42
+            del views
+            shared_arrays.detach(shared.spec)
+            assert shared.spec['location'] not in shared_arrays._attached
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize('backend', ['shm', 'mmap'])
+def test_parallel_systems_equal_direct_runs(inputs, tmp_path, backend):
+    geometry, weather = inputs
+    systems = [(30, 180), (90, 90)]
+    directory = str(tmp_path) if backend == 'mmap' else None
+    results = shared_arrays.run_systems_parallel(geometry, weather, systems, workers=2, chunk_rows=1000,
+                                                 directory=directory)
+    for (tilt, az), ac in zip(systems, results):
+        np.testing.assert_allclose(ac.to_numpy(), simulation.run_system(geometry, weather, tilt, az)['ac'].to_numpy())
+
+
+def test_parallel_systems_resume_from_checkpoints(inputs, tmp_path, monkeypatch):
+    geometry, weather = inputs
+    first = shared_arrays.run_systems_parallel(geometry, weather, [(30, 180)], workers=2, chunk_rows=1000,
+                                               checkpoint_dir=str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 3
+
+    def no_model_work(*args, **kwargs):
+        raise AssertionError("every chunk should have been loaded from the checkpoints")
+
+    monkeypatch.setattr(simulation, 'run_arrays', no_model_work)
+    again = shared_arrays.run_systems_parallel(geometry, weather, [(30, 180)], workers=2, chunk_rows=1000,
+                                               checkpoint_dir=str(tmp_path))
+    pd.testing.assert_series_equal(first[0], again[0])
@@ -0,0 +1,25 @@
+import pandas as pd
+import pytest
+from pvlib.location import Location
+
+import solar_position
+
+
+location = Location(60.45, 22.29, 'Europe/Helsinki', 25, name='Turku')
+
+
+@pytest.mark.parametrize('day', ['2021-03-28', '2021-10-31'])
+@pytest.mark.parametrize('strategy', solar_position.strategies[1:])
+def test_strategies_stay_within_tolerance_across_dst(day, strategy):
+    times = pd.date_range(day, periods=1440, freq='1min', tz='Europe/Helsinki')
+    report = solar_position.check_strategy(location, times, strategy)
+    assert report['max_zenith_error'] <= solar_position.tolerance[strategy]
+    assert report['max_azimuth_error'] <= solar_position.tolerance[strategy]
+
+
+def test_interpolated_grid_starting_in_the_repeated_hour():
+    # 03:30 happens twice on 31 October in Helsinki, so it cannot be floored in local time
+    times = pd.date_range('2021-10-31 00:30', periods=120, freq='1min', tz='UTC').tz_convert('Europe/Helsinki')
+    position = solar_position.interpolated(location, times)
+    reference = solar_position.get_solarposition(location, times)
+    assert (position['zenith'] - reference['zenith']).abs().max() <= solar_position.tolerance['interpolated']
@@ -0,0 +1,82 @@
+import os
+import re
+import threading
+
+import pytest
+
+import telemetry
+
+
+sample = re.compile(r'^(pv_[a-zA-Z_:][a-zA-Z0-9_:]*)\{((?:[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\[\\"n])*",?)*)\} (\S+)$')
+
+
+def test_render_follows_the_text_format():
+    registry = telemetry.Telemetry('run "A"\\1')
+    registry.add_rows('model', 1000)
+    registry.add_units(3)
+    registry.unit_done()
+    registry.cache('weather', hits=3, misses=1)
+    registry.cache('unused')
+
+    typed = {}
+    samples = {}
+    for line in registry.render().splitlines():
+        if line.startswith('# HELP '):
+            continue
+        if line.startswith('# TYPE '):
+            _, _, name, kind = line.split(' ')
+            assert kind in ('counter', 'gauge') and name not in typed
+            typed[name] = kind
+            continue
+        match = sample.match(line)
+        assert match, line
+        name, labels, value = match.groups()
+        assert name in typed, "sample before its TYPE line: " + line
+        assert 'run="run \\"A\\"\\\\1"' in labels
+        float(value)
+        samples.setdefault(name, []).append((labels, value))
+
+    assert typed['pv_rows_total'] == 'counter'
+    assert samples['pv_rows_total'] == [('run="run \\"A\\"\\\\1",stage="model"', '1000')]
+    # The cache without lookups has no ratio sample, and none of the ratios is NaN
+    ratios = samples['pv_cache_hit_ratio']
+    assert ratios == [('run="run \\"A\\"\\\\1",cache="weather"', '0.75')]
+    assert len(samples['pv_cache_hits_total']) == 2
+
+
+def test_textfile_exporter_writes_atomically(tmp_path, monkeypatch):
+    path = tmp_path / 'pv.prom'
+    registry = telemetry.Telemetry('test')
+    exporter = telemetry.TextfileExporter(str(path), telemetry=registry)
+    exporter.write()
+    first = path.read_text()
+    assert first.endswith('\n') and 'pv_units' in first
+    assert oct(os.stat(path).st_mode & 0o777) == '0o644'
+
+    # A scraper never sees a partial file while it is being rewritten
+    seen = []
+    stop = threading.Event()
+
+    def scrape():
+        while not stop.is_set():
+            seen.append(path.read_text())
+
+    scraper = threading.Thread(target=scrape)
+    scraper.start()
+    for i in range(200):
+        registry.add_rows('model', i)
+        exporter.write()
+    stop.set()
+    scraper.join()
+    assert all(text.endswith('\n') and 'pv_last_progress_time_seconds' in text for text in seen)
+
+    # A failing render leaves the previous file and no temporary files
+    def broken():
+        raise RuntimeError("render failed")
+
+    monkeypatch.setattr(registry, 'render', broken)
+    before = path.read_text()
+    with pytest.raises(RuntimeError):
+        exporter.write()
+    assert path.read_text() == before
+    assert os.listdir(tmp_path) == ['pv.prom']
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import time_axis
+
+
+@pytest.mark.parametrize('start, end', [('2021-03-27', '2021-03-29 23:45'), ('2021-10-30', '2021-11-01 23:45')])
+def test_axis_matches_date_range_across_dst(start, end):
+    axis = time_axis.TimeAxis.from_range(start, end, '15min', 'Europe/Helsinki')
+    expected = pd.date_range(start, end, freq='15min', tz='Europe/Helsinki')
+    pd.testing.assert_index_equal(axis.to_index(), expected.as_unit('ns'))
+    np.testing.assert_array_equal(axis.month(), expected.month)
+    np.testing.assert_array_equal(axis.minute_of_day(), expected.hour * 60 + expected.minute)
+    np.testing.assert_array_equal(axis.day_of_year(), expected.dayofyear)
+    assert time_axis.TimeAxis.from_index(expected) == axis
+
+
+def test_average_day_matches_groupby():
+    times = pd.date_range('2021-03-20', '2021-04-10', freq='5min', tz='Europe/Helsinki', inclusive='left')
+    values = pd.Series(np.random.default_rng(0).random(len(times)), index=times)
+    values.iloc[::7] = np.nan
+    axis = time_axis.TimeAxis.from_index(times)
+    # Two chunks merged, as the pipeline does
+    half = len(times) // 2
+    profile = time_axis.AverageDay().add(values.to_numpy()[:half], axis.slice(0, half)) \
+        .merge(time_axis.AverageDay().add(values.to_numpy()[half:], axis.slice(half, len(times)))).profile()
+
+    expected = values.groupby([times.month, times.strftime('%H:%M')]).mean().unstack(level=0)
+    expected.columns = expected.columns.astype(profile.columns.dtype)
+    pd.testing.assert_frame_equal(profile, expected, check_names=False, rtol=1e-12)
@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import simulation
+import uncertainty
+
+
+@pytest.fixture(scope='module')
+def inputs():
+    # Two clear-sky days either side of a month boundary
+    location = simulation.make_location({'name' : 'Turku', 'latitude' : 60.45, 'longitude' : 22.29,
+                                         'altitude' : 25, 'tz' : 'Europe/Helsinki'})
+    times = pd.date_range('2021-06-30', periods=2 * 288, freq='5min', tz='Europe/Helsinki')
+    geometry = simulation.solar_geometry(location, times)
+    return geometry, simulation.clear_sky(location, geometry)
+
+
+def test_zero_uncertainty_reproduces_the_deterministic_energy(inputs):
+    geometry, weather = inputs
+    none = {'module_power' : 0, 'albedo' : 0, 'soiling' : (0, 0), 'irradiance' : 0}
+    totals, summary = uncertainty.run_uncertainty(geometry, weather, 30, 180, n_samples=4, seed=1, uncertainty=none)
+    ac = simulation.run_system(geometry, weather, 30, 180)['ac']
+    expected = ac.groupby(ac.index.strftime('%Y-%m')).sum() * 5 / 60 / 1000
+    for month, kwh in expected.items():
+        np.testing.assert_allclose(totals[month], kwh, rtol=1e-12)
+    assert summary.loc['total', 'std'] == pytest.approx(0, abs=1e-9)
+
+
+def test_results_do_not_depend_on_the_worker_count(inputs):
+    geometry, weather = inputs
+    runs = [uncertainty.run_uncertainty(geometry, weather, 30, 180, n_samples=6, seed=3, samples_per_pass=2,
+                                        max_memory=2**22, workers=workers)[0]
+            for workers in [1, 2]]
+    pd.testing.assert_frame_equal(runs[0], runs[1], rtol=1e-12)
@@ -0,0 +1,13 @@
+import validation
+
+
+def test_fast_paths_stay_within_the_error_budget():
+    # Two days at both sites instead of the full year of the command line check. Over two days
+    # of synthetic weather, sampling every 15th minute misses too much of the noise for the
+    # annual coarse_step budget, so that combination is only checked on clear sky here.
+    table = validation.validate('2021-06-20', '2021-06-21 23:59', '1min')
+    assert len(table) == len(validation.sites) * len(validation.weathers) * len(validation.orientations) * \
+        len(validation.error_budget)
+    table = table[(table['path'] != 'coarse_step') | (table['weather'] == 'clearsky')]
+    failed = table[~table['passed']]
+    assert failed.empty, failed.to_string(index=False)
@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+
+import pandas as pd
+
+import scenario
+import work_queue
+
+
+def queued_scenario():
+    return {'name' : 'test',
+            'sites' : [{'name' : 'Turku', 'latitude' : 60.45, 'longitude' : 22.29, 'altitude' : 25,
+                        'tz' : 'Europe/Helsinki'}],
+            'systems' : [{'name' : 'S', 'surface_tilt' : 30, 'surface_azimuth' : 180},
+                         {'name' : 'E', 'surface_tilt' : 90, 'surface_azimuth' : 90}],
+            'time_ranges' : [{'name' : 'spring', 'start' : '2021-03-27', 'end' : '2021-03-29 23:59', 'freq' : '1min'}],
+            'outputs' : ['ac', 'monthly_average_day', 'energy']}
+
+
+def coordinate_with_worker(config : dict, directory : str, timeout : float = 120):
+    # A coordinator and one worker thread, like --local-workers 1. Both must finish in time.
+    started = time.time()
+    worker = threading.Thread(target=work_queue.work, args=(directory, 'test-worker'), kwargs={'since' : started},
+                              daemon=True)
+    results = {}
+    coordinator = threading.Thread(target=lambda: results.update(work_queue.coordinate(config, directory, chunk_days=1)),
+                                   daemon=True)
+    worker.start()
+    coordinator.start()
+    coordinator.join(timeout)
+    worker.join(timeout)
+    assert not coordinator.is_alive(), "the coordinator did not finish"
+    assert not worker.is_alive(), "the worker did not stop"
+    return results
+
+
+def assert_results_equal(left, right):
+    assert list(left) == list(right)
+    for unit in left:
+        pd.testing.assert_series_equal(left[unit]['ac'], right[unit]['ac'], check_freq=False)
+        pd.testing.assert_frame_equal(left[unit]['monthly_average_day'], right[unit]['monthly_average_day'])
+        pd.testing.assert_frame_equal(left[unit]['energy'], right[unit]['energy'])
+
+
+def test_queued_run_equals_scenario_run_and_restarts(tmp_path):
+    expected = scenario.run_scenario(queued_scenario())
+    assert_results_equal(coordinate_with_worker(queued_scenario(), str(tmp_path)), expected)
+    # A second coordinator on the same directory finds the results of the first
+    assert_results_equal(coordinate_with_worker(queued_scenario(), str(tmp_path)), expected)
+
+
+def test_failed_tasks_get_fresh_attempts_on_restart(tmp_path):
+    queue = work_queue.WorkQueue(str(tmp_path))
+    tasks = work_queue.make_tasks(queued_scenario(), chunk_days=1)
+    key = work_queue.task_id(tasks[0])
+    work_queue._write_json(os.path.join(str(tmp_path), 'failed', key + '.json'),
+                           dict(tasks[0], attempts=work_queue.max_attempts, error="RuntimeError: earlier run"))
+    queue.stop()
+    coordinate_with_worker(queued_scenario(), str(tmp_path))
+    assert queue.failed() == {}
+    assert queue.results.done(key)
+
+
+def test_expired_claims_are_requeued(tmp_path):
+    queue = work_queue.WorkQueue(str(tmp_path))
+    key = queue.put(work_queue.make_tasks(queued_scenario(), chunk_days=1)[0])
+    claimed_key, task, claim = queue.claim('lost-worker')
+    assert claimed_key == key
+    assert queue.claim('other-worker') is None
+    assert queue.requeue_expired(lease=60) == 0
+    os.utime(claim, (time.time() - 120, time.time() - 120))
+    assert queue.requeue_expired(lease=60) == 1
+    claimed_key, task, claim = queue.claim('other-worker')
+    assert claimed_key == key and task['attempts'] == 1
+
+
+def test_first_completion_wins(tmp_path):
+    queue = work_queue.WorkQueue(str(tmp_path))
+    key = queue.put(work_queue.make_tasks(queued_scenario(), chunk_days=1)[0])
+    _, _, claim = queue.claim('slow-worker')
+    assert queue.complete(key, claim, 'first')
+    assert not queue.complete(key, claim, 'second')
+    assert queue.results.load(key) == 'first'
+    # Done tasks are not queued again
+    assert queue.put(work_queue.make_tasks(queued_scenario(), chunk_days=1)[0]) == key
+    assert queue.claim('worker') is None
+
+
+def test_tasks_fail_after_max_attempts(tmp_path):
+    queue = work_queue.WorkQueue(str(tmp_path))
+    key = queue.put(work_queue.make_tasks(queued_scenario(), chunk_days=1)[0])
+    for attempt in range(work_queue.max_attempts):
+        assert queue.failed() == {}
+        _, task, claim = queue.claim('worker')
+        queue.fail(key, claim, task, "RuntimeError: attempt " + str(attempt))
+    assert list(queue.failed()) == [key]
+    assert queue.claim('worker') is None
+
+
+def test_failures_of_other_scenarios_are_not_reported(tmp_path):
+    queue = work_queue.WorkQueue(str(tmp_path))
+    other = dict(queued_scenario(), systems=[{'name' : 'W', 'surface_tilt' : 90, 'surface_azimuth' : 270}])
+    task = work_queue.make_tasks(other, chunk_days=1)[0]
+    key = work_queue.task_id(task)
+    work_queue._write_json(os.path.join(str(tmp_path), 'failed', key + '.json'),
+                           dict(task, attempts=work_queue.max_attempts, error="RuntimeError: other scenario"))
+    assert_results_equal(coordinate_with_worker(queued_scenario(), str(tmp_path)), scenario.run_scenario(queued_scenario()))
+    # Left for its own coordinator to restart
+    assert list(queue.failed()) == [key]
+
+
+def test_local_worker_processes_take_over_a_lost_claim(tmp_path, capsys):
+    # A worker on another host claimed a task and vanished; two local worker processes finish the
+    # scenario once its lease has expired
+    directory = str(tmp_path)
+    queue = work_queue.WorkQueue(directory)
+    tasks = work_queue.make_tasks(queued_scenario(), chunk_days=1)
+    key = queue.put(tasks[0])
+    _, _, claim = queue.claim('lost-worker')
+    os.utime(claim, (time.time() - 10, time.time() - 10))
+
+    results = work_queue.coordinate(queued_scenario(), directory, chunk_days=1, lease=5, local_workers=2)
+    assert_results_equal(results, scenario.run_scenario(queued_scenario()))
+    assert "Requeued 1 tasks with expired leases" in capsys.readouterr().out
+    assert not os.path.exists(claim)
+    assert queue.failed() == {}
+    assert queue.results.done(key)
@@ -0,0 +1,199 @@
+import numpy as np
+import pandas as pd
+
+
+# Lazy regular time axis -------------------------------------------------------------------------
+#
+# A regular axis is fully described by (start_utc, step, n, tz), so there is no need to build and
+# keep a tz-aware DatetimeIndex just to ask for .month or to strftime it. Calendar fields are
+# derived arithmetically as integer arrays from UTC nanoseconds plus the local offset. The offset
+# is looked up on a 15-minute grid, which is exact for every zone whose DST transitions fall on a
+# quarter hour (all of them today) and constant for fixed offsets like 'Etc/GMT-2'.
+# A DatetimeIndex is only built at the edges (pvlib inputs, files and plots) with to_index().
+
+minute_ns = 60 * 10**9
+day_ns = 1440 * minute_ns
+offset_grid_ns = 15 * minute_ns
+
+
+def _ns(values):
+    return np.asarray(values, dtype='datetime64[ns]').view('int64')
+
+
+def civil_from_days(days : np.ndarray):
+    # (year, month, day) of days since 1970-01-01, H. Hinnant's algorithm on integer arrays
+    z = np.asarray(days, dtype=np.int64) + 719468
+    era = z // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = np.where(mp < 10, mp + 3, mp - 9)
+    year = yoe + era * 400 + (month <= 2)
+    return year, month, day
+
+
+def days_from_civil(year : np.ndarray, month : np.ndarray, day : np.ndarray):
+    year = np.asarray(year, dtype=np.int64) - (np.asarray(month) <= 2)
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * np.where(np.asarray(month) > 2, np.asarray(month) - 3, np.asarray(month) + 9) + 2) // 5 + np.asarray(day) - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+class TimeAxis:
+
+    def __init__(self, start_utc : int, step : int, n : int, tz : str = 'UTC'):
+        # start_utc and step in integer nanoseconds
+        self.start_utc = int(start_utc)
+        self.step = int(step)
+        self.n = int(n)
+        self.tz = tz
+
+    @classmethod
+    def from_range(cls, start, end, freq : str = '1min', tz : str = 'UTC'):
+        # Same points as pd.date_range(start, end, freq=freq, tz=tz) for fixed-length steps
+        start = pd.Timestamp(start, tz=tz) if pd.Timestamp(start).tz is None else pd.Timestamp(start).tz_convert(tz)
+        end = pd.Timestamp(end, tz=tz) if pd.Timestamp(end).tz is None else pd.Timestamp(end).tz_convert(tz)
+        step = pd.Timedelta(freq).value
+        first = _ns(start.tz_convert('UTC').tz_localize(None).to_datetime64())
+        last = _ns(end.tz_convert('UTC').tz_localize(None).to_datetime64())
+        return cls(first, step, (last - first) // step + 1, tz)
+
+    @classmethod
+    def from_index(cls, index : pd.DatetimeIndex):
+        # Axis of an existing regular index (checked at both ends, not element by element)
+        tz = str(index.tz) if index.tz is not None else 'UTC'
+        utc = index.tz_convert('UTC') if index.tz is not None else index
+        first, second, last = _ns(utc[[0, min(1, len(utc) - 1), -1]])
+        step = (second - first) if len(index) > 1 else minute_ns
+        if first + step * (len(index) - 1) != last:
+            raise ValueError("Index is not regular")
+        return cls(first, step, len(index), tz)
+
+    def __len__(self):
+        return self.n
+
+    def __repr__(self):
+        return "TimeAxis(start=%s, step=%s, n=%d, tz=%s)" % (pd.Timestamp(self.start_utc, tz='UTC'),
+                                                            pd.Timedelta(self.step), self.n, self.tz)
+
+    def __eq__(self, other):
+        return isinstance(other, TimeAxis) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def key(self):
+        return (self.start_utc, self.step, self.n, self.tz)
+
+    @property
+    def step_hours(self):
+        return self.step / 3.6e12
+
+    def slice(self, start : int, stop : int):
+        start, stop = max(start, 0), min(stop, self.n)
+        return TimeAxis(self.start_utc + start * self.step, self.step, max(stop - start, 0), self.tz)
+
+    def chunks(self, rows : int):
+        # (offset, axis) of consecutive chunks of at most `rows` steps
+        for start in range(0, self.n, rows):
+            yield start, self.slice(start, start + rows)
+
+    def utc_ns(self):
+        return self.start_utc + self.step * np.arange(self.n, dtype=np.int64)
+
+    def offsets_ns(self):
+        # Local UTC offset of every step; a scalar for fixed-offset zones
+        if self.tz in (None, 'UTC'):
+            return 0
+        first = self.start_utc - self.start_utc % offset_grid_ns
+        last = self.start_utc + self.step * max(self.n - 1, 0)
+        grid = pd.DatetimeIndex(np.arange(first, last + offset_grid_ns, offset_grid_ns).astype('datetime64[ns]'), tz='UTC')
+        offsets = _ns(grid.tz_convert(self.tz).tz_localize(None)) - _ns(grid.tz_localize(None))
+        if (offsets == offsets[0]).all():
+            return int(offsets[0])
+        return offsets[(self.utc_ns() - first) // offset_grid_ns]
+
+    def local_ns(self):
+        return self.utc_ns() + self.offsets_ns()
+
+    def day_numbers(self):
+        # Local days since 1970-01-01
+        return self.local_ns() // day_ns
+
+    def minute_of_day(self):
+        return (self.local_ns() // minute_ns) % 1440
+
+    def calendar(self):
+        # (year, month, day) integer arrays in local time
+        return civil_from_days(self.day_numbers())
+
+    def month(self):
+        return self.calendar()[1]
+
+    def day_of_year(self):
+        days = self.day_numbers()
+        year = civil_from_days(days)[0]
+        return days - days_from_civil(year, 1, 1) + 1
+
+    def to_index(self):
+        index = pd.DatetimeIndex(self.utc_ns().astype('datetime64[ns]'), tz='UTC')
+        return index.tz_convert(self.tz) if self.tz not in (None, 'UTC') else index
+
+
+# Aggregation on local time fields ---------------------------------------------------------------
+
+def local_ns(times):
+    # Local wall-clock nanoseconds of a TimeAxis, or of a DatetimeIndex that may have gaps
+    if isinstance(times, TimeAxis):
+        return times.local_ns()
+    return _ns(times.tz_localize(None) if times.tz is not None else times)
+
+
+def month_codes(times):
+    # (labels 'YYYY-MM', code of every step into labels)
+    year, month, _ = civil_from_days(local_ns(times) // day_ns)
+    values, inverse = np.unique(year * 12 + month - 1, return_inverse=True)
+    labels = np.array(["%04d-%02d" % (v // 12, v % 12 + 1) for v in values])
+    return labels, inverse
+
+
+class AverageDay:
+    # Sums and counts per (month, minute of day), so partial profiles of consecutive time chunks
+    # merge exactly into the profile of the whole range
+
+    def __init__(self):
+        self.sums = np.zeros((12, 1440))
+        self.counts = np.zeros((12, 1440), dtype=np.int64)
+
+    def add(self, values : np.ndarray, times):
+        local = local_ns(times)
+        month = civil_from_days(local // day_ns)[1]
+        codes = (month - 1) * 1440 + (local // minute_ns) % 1440
+        values = np.asarray(values, dtype=float)
+        valid = ~np.isnan(values)
+        self.sums += np.bincount(codes[valid], weights=values[valid], minlength=12 * 1440).reshape(12, 1440)
+        self.counts += np.bincount(codes[valid], minlength=12 * 1440).reshape(12, 1440)
+        return self
+
+    def merge(self, other):
+        self.sums += other.sums
+        self.counts += other.counts
+        return self
+
+    def profile(self):
+        # One column per month (1-12) and 'HH:MM' rows; NaN values are left out of the mean
+        months = self.counts.sum(axis=1) > 0
+        minutes = np.flatnonzero(self.counts.sum(axis=0) > 0)
+        with np.errstate(invalid='ignore'):
+            mean = self.sums[months][:, minutes] / self.counts[months][:, minutes]
+        return pd.DataFrame(mean.T, index=["%02d:%02d" % (m // 60, m % 60) for m in minutes],
+                            columns=np.arange(1, 13)[months])
+
+
+def monthly_average_day(values : np.ndarray, times):
+    # Average day profile of every month from a single bincount over month * 1440 + minute of day
+    return AverageDay().add(values, times).profile()
@@ -0,0 +1,182 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import simulation
+import shared_arrays
+import energy
+import time_axis
+
+
+# Monte Carlo uncertainty ------------------------------------------------------------------------
+#
+# Each sample perturbs the run with
+#
+#   module_power  relative std of the module currents (power tolerance of the datasheet)
+#   albedo        std of the ground albedo around the nominal value
+#   soiling       (low, high) of a uniformly drawn soiling loss on effective irradiance
+#   irradiance    relative std of a per-sample calibration error on GHI, DNI and DHI
+#
+# Samples are evaluated as a (samples, rows) block per pass through simulation.run_arrays. Blocks
+# are sized to a memory budget and sample groups are spread over processes that read the inputs
+# from shared memory. Only per-sample monthly energies are kept (never the sample paths), and
+# P50/P90 are taken over those at the end.
+
+default_uncertainty = {'module_power' : 0.03,
+                       'albedo' : 0.05,
+                       'soiling' : (0.0, 0.05),
+                       'irradiance' : 0.03}
+
+# float64 arrays of shape (samples, rows) alive at once inside run_arrays
+intermediates = 32
+
+module_currents = ['Isco', 'Impo', 'IXO', 'IXXO']
+
+
+def draw_samples(n_samples : int, seed : int = None, uncertainty : dict = None, albedo : float = 0.25):
+    uncertainty = dict(default_uncertainty, **(uncertainty or {}))
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'power_factor' : rng.normal(1, uncertainty['module_power'], n_samples),
+                         'albedo' : np.clip(rng.normal(albedo, uncertainty['albedo'], n_samples), 0, 1),
+                         'soiling' : rng.uniform(*uncertainty['soiling'], n_samples),
+                         'irradiance_factor' : rng.normal(1, uncertainty['irradiance'], n_samples)})
+
+
+def chunk_rows(n_samples : int, max_memory : int, workers : int = 1):
+    # Rows per pass so that `workers` passes of `n_samples` fit in the budget
+    return max(int(max_memory / (workers * n_samples * intermediates * 8)), 1)
+
+
+def sample_energy(geometry : dict,
+                  weather : dict,
+                  months : np.ndarray,
+                  n_months : int,
+                  samples : pd.DataFrame,
+                  surface_tilt : float,
+                  surface_azimuth : float,
+                  module : pd.Series,
+                  inverter : pd.Series,
+                  step : float,
+                  rows : int):
+    # AC energy in Wh of every sample and month, evaluated `rows` time steps at a time
+    n = len(months)
+    column = lambda name: samples[name].to_numpy()[:, None]
+
+    perturbed = dict(module)
+    for name in module_currents:
+        perturbed[name] = module[name] * column('power_factor')
+    spectral_model = simulation.reference_spectral_model()
+
+    totals = np.zeros((len(samples), n_months))
+    for start in range(0, n, rows):
+        stop = min(start + rows, n)
+        g = {name: np.asarray(values)[start:stop] for name, values in geometry.items()}
+        w = {name: np.asarray(values)[start:stop] for name, values in weather.items()}
+        for name in ['ghi', 'dni', 'dhi']:
+            w[name] = w[name] * column('irradiance_factor')
+        ac = simulation.run_arrays(g, w, surface_tilt, surface_azimuth, perturbed, inverter,
+                                   albedo=column('albedo'), spectral_model=spectral_model,
+                                   soiling=column('soiling'))['ac']
+        ac = np.nan_to_num(np.broadcast_to(ac, (len(samples), stop - start))) * step
+        chunk_months = months[start:stop]
+        for month in np.unique(chunk_months):
+            totals[:, month] += ac[:, chunk_months == month].sum(axis=1)
+    return totals
+
+
+def _sample_group(spec : dict, samples : pd.DataFrame, n_months : int, surface_tilt : float, surface_azimuth : float,
+                  module : pd.Series, inverter : pd.Series, step : float, rows : int):
+    try:
+        return _attached_sample_energy(shared_arrays.attach(spec), samples, n_months, surface_tilt, surface_azimuth,
+                                       module, inverter, step, rows)
+    finally:
+        shared_arrays.detach(spec)
+
+
+def _attached_sample_energy(arrays : dict, samples : pd.DataFrame, n_months : int, surface_tilt : float,
+                            surface_azimuth : float, module : pd.Series, inverter : pd.Series, step : float, rows : int):
+    # Keeps the views local, so _sample_group can detach once this returns
+    geometry = {name[9:]: values for name, values in arrays.items() if name.startswith('geometry.')}
+    weather = {name[8:]: values for name, values in arrays.items() if name.startswith('weather.')}
+    return sample_energy(geometry, weather, arrays['months'], n_months, samples,
+                         surface_tilt, surface_azimuth, module, inverter, step, rows)
+
+
+def run_uncertainty(geometry : pd.DataFrame,
+                    weather : pd.DataFrame,
+                    surface_tilt : float,
+                    surface_azimuth : float,
+                    n_samples : int = 500,
+                    seed : int = None,
+                    uncertainty : dict = None,
+                    module : pd.Series = None,
+                    inverter : pd.Series = None,
+                    albedo : float = 0.25,
+                    max_memory : int = 2**30,
+                    samples_per_pass : int = 50,
+                    workers : int = 1):
+    # Returns (per-sample monthly and total AC energy in kWh, mean/std/P50/P90 of each)
+    if module is None or inverter is None:
+        module, inverter = simulation.load_components()
+    samples = draw_samples(n_samples, seed, uncertainty, albedo)
+
+    labels, month_codes = time_axis.month_codes(geometry.index)
+    step = energy.step_hours(geometry.index)
+
+    groups = [samples.iloc[i:i + samples_per_pass] for i in range(0, n_samples, samples_per_pass)]
+    rows = chunk_rows(min(samples_per_pass, n_samples), max_memory, workers)
+
+    if workers == 1:
+        g = {name: geometry[name].to_numpy() for name in shared_arrays.geometry_columns}
+        w = {name: weather[name].to_numpy() for name in shared_arrays.weather_columns if name in weather}
+        parts = [sample_energy(g, w, month_codes, len(labels), group, surface_tilt, surface_azimuth,
+                               module, inverter, step, rows) for group in groups]
+    else:
+        arrays = {'geometry.' + name: geometry[name].to_numpy(dtype=float) for name in shared_arrays.geometry_columns}
+        arrays.update({'weather.' + name: weather[name].to_numpy(dtype=float)
+                       for name in shared_arrays.weather_columns if name in weather})
+        arrays['months'] = month_codes
+        with shared_arrays.SharedArrays(arrays) as shared:
+            with ProcessPoolExecutor(workers) as pool:
+                futures = [pool.submit(_sample_group, shared.spec, group, len(labels), surface_tilt, surface_azimuth,
+                                       module, inverter, step, rows) for group in groups]
+                parts = [future.result() for future in futures]
+
+    totals = pd.DataFrame(np.vstack(parts) / 1000, columns=labels)
+    totals['total'] = totals.sum(axis=1)
+    return totals, summarize(totals)
+
+
+def summarize(totals : pd.DataFrame):
+    # P90 is the energy exceeded with 90 % probability, i.e. the 10th percentile
+    return pd.DataFrame({'mean' : totals.mean(),
+                         'std' : totals.std(),
+                         'P50' : totals.quantile(0.5),
+                         'P90' : totals.quantile(0.1)})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="P50/P90 energy of one system from perturbed runs")
+    parser.add_argument('--weather', default=None, help="StarkeDFC weather file (clear sky if omitted)")
+    parser.add_argument('--tilt', type=float, default=30)
+    parser.add_argument('--azimuth', type=float, default=180)
+    parser.add_argument('--samples', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    site = {'name' : 'Turku', 'latitude' : 60.45, 'longitude' : 22.29, 'altitude' : 50, 'tz' : 'Europe/Helsinki'}
+    location = simulation.make_location(site)
+    if args.weather is None:
+        times = pd.date_range('2021-01-01', '2021-12-31', freq='1min', tz=site['tz'])
+        geometry = simulation.solar_geometry(location, times)
+        weather = simulation.clear_sky(location, geometry)
+    else:
+        weather = simulation.load_weather(args.weather, site['tz'])
+        geometry = simulation.solar_geometry(location, weather.index, temperature=weather['temp_air'].to_numpy())
+
+    totals, summary = run_uncertainty(geometry, weather, args.tilt, args.azimuth, n_samples=args.samples,
+                                      seed=args.seed, workers=args.workers)
+    print(summary)
@@ -0,0 +1,168 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.signal import lfilter
+
+# pvlib imports
+import pvlib
+from pvlib.pvsystem import PVSystem
+from pvlib.modelchain import ModelChain
+
+import simulation
+
+
+# Accuracy versus speed of the fast paths --------------------------------------------------------
+#
+# Every scenario (site x weather x orientation) is run once through a plain pvlib ModelChain, the
+# way the scripts do it, and then through each fast path:
+#
+#   vectorized    shared solar geometry + simulation.run_system
+#   night_skip    run_system(skip_night=True)
+#   float32       inputs stored as float32 before run_system
+#   coarse_step   every 15th time step only (energy = power x 15 min)
+#   fast_solar    solar_position 'interpolated' strategy
+#
+# For each path the table reports the relative AC energy error, the largest instantaneous AC
+# power error (at the time steps the path evaluates) and the speedup over the ModelChain run,
+# timed including the path's own solar geometry for a single system, so the gain from sharing
+# it between systems is not included. Any error above `error_budget` fails the run.
+
+sites = [{'name' : 'Turku', 'latitude' : 60.45, 'longitude' : 22.29, 'altitude' : 25, 'tz' : 'Etc/GMT-2'},
+         {'name' : 'Madrid', 'latitude' : 40.42, 'longitude' : -3.70, 'altitude' : 650, 'tz' : 'Etc/GMT-1'}]
+orientations = {'E' : (90, 90), 'S' : (30, 180), 'W' : (90, 270)} # (surface_tilt, surface_azimuth)
+weathers = ['clearsky', 'synthetic']
+
+# (relative energy error, max power error in W) allowed per path
+error_budget = {'vectorized' : (1e-9, 1e-6),
+                'night_skip' : (1e-9, 1e-6),
+                'float32' : (1e-4, 0.5),
+                'coarse_step' : (1e-2, 1e-6),
+                'fast_solar' : (2e-3, 2.0)}
+
+coarse_every = 15
+
+
+def synthetic_weather(location, geometry : pd.DataFrame, seed : int = 0):
+    # A reproducible stand-in for a measured year: clear sky scaled by a clearness index with
+    # day-to-day and minute-to-minute variability, split into DNI/DHI with Erbs, and a seasonal
+    # and diurnal air temperature
+    rng = np.random.default_rng(seed)
+    clear = simulation.clear_sky(location, geometry)
+    n = len(geometry)
+    days = np.asarray(geometry.index.dayofyear) - 1
+    daily = rng.beta(2.0, 1.2, days.max() + 1)[days]
+    steps = rng.normal(0, 0.05, n)
+    steps[0] = 0
+    # AR(1) noise, noise[i] = 0.98 * noise[i - 1] + steps[i], as one linear filter pass
+    noise = lfilter([1], [1, -0.98], steps)
+    kt = np.clip(daily + noise, 0.05, 1.1)
+    ghi = clear['ghi'].to_numpy() * kt
+
+    split = pvlib.irradiance.erbs(ghi, geometry['zenith'].to_numpy(), geometry.index)
+    hours = np.asarray(geometry.index.hour + geometry.index.minute / 60)
+    season = -np.cos(2 * np.pi * (days - 15) / 365)
+    temp_air = 8 + 12 * season + 4 * np.sin(2 * np.pi * (hours - 9) / 24) + rng.normal(0, 0.5, n)
+    return pd.DataFrame({'ghi' : ghi, 'dni' : np.nan_to_num(np.asarray(split['dni'])),
+                         'dhi' : np.nan_to_num(np.asarray(split['dhi'])),
+                         'temp_air' : temp_air, 'wind_speed' : np.abs(3 + rng.normal(0, 1, n))},
+                        index=geometry.index)
+
+
+def reference(location, weather : pd.DataFrame, surface_tilt : float, surface_azimuth : float):
+    module, inverter = simulation.load_components()
+    system = PVSystem(surface_tilt=surface_tilt, surface_azimuth=surface_azimuth,
+                      module_parameters=module, inverter_parameters=inverter,
+                      temperature_model_parameters=simulation.temperature_model_parameters)
+    mc = ModelChain(system, location)
+    mc.run_model(weather)
+    return mc.results.ac
+
+
+def make_weather(location, geometry : pd.DataFrame, kind : str):
+    return simulation.clear_sky(location, geometry) if kind == 'clearsky' else synthetic_weather(location, geometry)
+
+
+def fast_paths(location, times : pd.DatetimeIndex, weather : pd.DataFrame, surface_tilt : float, surface_azimuth : float):
+    # {path: function returning the AC power of the time steps it evaluates}
+    temperature = weather['temp_air'].to_numpy() if 'temp_air' in weather else 12
+
+    def vectorized():
+        geometry = simulation.solar_geometry(location, times, temperature=temperature)
+        return simulation.run_system(geometry, weather, surface_tilt, surface_azimuth)['ac']
+
+    def night_skip():
+        geometry = simulation.solar_geometry(location, times, temperature=temperature)
+        return simulation.run_system(geometry, weather, surface_tilt, surface_azimuth, skip_night=True)['ac']
+
+    def float32():
+        geometry = simulation.solar_geometry(location, times, temperature=temperature).astype(np.float32)
+        return simulation.run_system(geometry, weather.astype(np.float32), surface_tilt, surface_azimuth)['ac']
+
+    def coarse_step():
+        coarse = times[::coarse_every]
+        geometry = simulation.solar_geometry(location, coarse, temperature=np.asarray(temperature)[::coarse_every]
+                                             if np.ndim(temperature) else temperature)
+        return simulation.run_system(geometry, weather.loc[coarse], surface_tilt, surface_azimuth)['ac']
+
+    def fast_solar():
+        geometry = simulation.solar_geometry(location, times, strategy='interpolated', temperature=temperature)
+        return simulation.run_system(geometry, weather, surface_tilt, surface_azimuth)['ac']
+
+    return {'vectorized' : vectorized, 'night_skip' : night_skip, 'float32' : float32,
+            'coarse_step' : coarse_step, 'fast_solar' : fast_solar}
+
+
+def validate(start : str = '2021-01-01', end : str = '2021-12-31', freq : str = '1min', paths : list = None):
+    rows = []
+    for site in sites:
+        location = simulation.make_location(site)
+        times = pd.date_range(start, end, freq=freq, tz=site['tz'])
+        step = (times[1] - times[0]).total_seconds() / 3600
+        geometry = simulation.solar_geometry(location, times)
+        for kind in weathers:
+            weather = make_weather(location, geometry, kind)
+            for name, (tilt, az) in orientations.items():
+                begin = time.time()
+                ac_reference = reference(location, weather, tilt, az)
+                reference_seconds = time.time() - begin
+                reference_energy = ac_reference.sum() * step
+
+                for path, run in fast_paths(location, times, weather, tilt, az).items():
+                    if paths is not None and path not in paths:
+                        continue
+                    begin = time.time()
+                    ac = run()
+                    seconds = time.time() - begin
+                    path_step = step * (len(times) / len(ac))
+                    rows.append({'site' : site['name'], 'weather' : kind, 'orientation' : name, 'path' : path,
+                                 'energy_error' : (ac.sum() * path_step - reference_energy) / reference_energy,
+                                 'max_power_error' : (ac - ac_reference.loc[ac.index]).abs().max(),
+                                 'speedup' : reference_seconds / seconds})
+                print("Validated", site['name'], kind, name)
+
+    table = pd.DataFrame(rows)
+    budget = table['path'].map(error_budget)
+    table['passed'] = ((table['energy_error'].abs() <= budget.str[0]) &
+                       (table['max_power_error'] <= budget.str[1]))
+    return table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check the fast paths against a pvlib ModelChain")
+    parser.add_argument('--start', default='2021-01-01')
+    parser.add_argument('--end', default='2021-12-31')
+    parser.add_argument('--freq', default='1min')
+    parser.add_argument('--path', choices=list(error_budget), action='append')
+    parser.add_argument('--output', default=None, help="Write the table to this CSV")
+    args = parser.parse_args()
+
+    table = validate(args.start, args.end, args.freq, args.path)
+    print(table.to_string(index=False))
+    if args.output is not None:
+        table.to_csv(args.output, index=False)
+    if not table['passed'].all():
+        print(len(table) - table['passed'].sum(), "results exceed the error budget")
+        sys.exit(1)
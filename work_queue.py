@@ -0,0 +1,355 @@
+import argparse
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+import pandas as pd
+
+import scenario
+import planner
+import checkpoint
+import time_axis
+import telemetry
+
+
+# Coordinator/worker execution -------------------------------------------------------------------
+#
+# A coordinator splits a scenario into (site, system, time chunk) tasks and puts them in a queue
+# directory, which workers on any host that mounts it pull from:
+#
+#   tasks/<id>.json                  waiting
+#   running/<id>@<worker>.json       claimed by a worker
+#   results/                         a checkpoint.CheckpointStore of {unit: {output: partial}}
+#   failed/<id>.json                 out of attempts, with the last error
+#   stop                             written by the coordinator when everything is done
+#
+# A coordinator started on a directory clears the stop marker of an earlier run and gives the
+# failed tasks of its scenario fresh attempts; workers only stop for a marker written after they
+# started (or, for the local workers of a coordinator, after the coordinator started).
+#
+# A worker claims a task by renaming it into running/, which succeeds for exactly one worker.
+# While it runs the task it touches the claim every `lease` / 4 seconds; a claim not touched for
+# `lease` seconds (a killed worker or a lost host) is put back in tasks/ by the coordinator. A
+# task that raises goes back too, until it has failed `max_attempts` times.
+#
+# Task ids are hashes of the task, so a requeued task that ends up completed twice (the first
+# worker was only slow) and a coordinator restarted on the same directory find the same result:
+# the first completion is kept, later ones are discarded. Workers return the unfinished partial
+# outputs of scenario.run_units (average day sums, daily energy), which the coordinator merges
+# in time order, so the results equal those of scenario.run_scenario.
+#
+# Leases compare file modification times with the coordinator's clock, so hosts sharing a queue
+# over a network file system need synchronized clocks. Weather files are read by path and must
+# be reachable at the same path from every worker; each worker parses a file once and keeps it
+# for the following chunks (scenario.load_weather_file).
+
+chunk_days = 7
+lease = 60.0 # seconds
+max_attempts = 3
+poll = 1.0 # seconds
+
+
+def _write_json(path : str, value):
+    # Atomic, like checkpoint saves: the file is complete or absent
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(value, f, default=str)
+    os.replace(temporary, path)
+
+
+def task_id(task : dict):
+    # A weather file that changed since an earlier run does not match that run's results
+    files = [[site['weather'], os.path.getsize(site['weather']), os.path.getmtime(site['weather'])]
+             for site in task['config']['sites'] if site.get('weather', 'clearsky') != 'clearsky']
+    return hashlib.sha1(json.dumps([task['config'], files], sort_keys=True, default=str).encode()).hexdigest()
+
+
+class WorkQueue:
+
+    def __init__(self, directory : str):
+        self.directory = directory
+        for name in ['tasks', 'running', 'failed']:
+            os.makedirs(os.path.join(directory, name), exist_ok=True)
+        self.results = checkpoint.CheckpointStore(os.path.join(directory, 'results'))
+
+    def _path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    def _claims(self):
+        # {task id: claim path}
+        return {name.split('@')[0]: self._path('running', name)
+                for name in os.listdir(self._path('running')) if name.endswith('.json')}
+
+    def put(self, task : dict):
+        # Queues the task unless it is done, waiting or running already
+        key = task_id(task)
+        if not (self.results.done(key) or os.path.exists(self._path('tasks', key + '.json')) or key in self._claims()):
+            _write_json(self._path('tasks', key + '.json'), dict(task, attempts=0))
+        return key
+
+    def claim(self, worker : str):
+        # (id, task, claim path) of a waiting task, or None when there is none
+        for name in sorted(os.listdir(self._path('tasks'))):
+            if not name.endswith('.json'):
+                continue
+            claim = self._path('running', name[:-5] + '@' + worker + '.json')
+            try:
+                os.rename(self._path('tasks', name), claim)
+            except FileNotFoundError:
+                continue # another worker was faster
+            os.utime(claim)
+            with open(claim) as f:
+                return name[:-5], json.load(f), claim
+        return None
+
+    def complete(self, key : str, claim : str, value):
+        # False if the task had already been completed by another worker
+        first = self.results.save(key, value, replace=False)
+        self._release(claim)
+        return first
+
+    def fail(self, key : str, claim : str, task : dict, error : str):
+        task = dict(task, attempts=task['attempts'] + 1, error=error)
+        if self.results.done(key):
+            pass
+        elif task['attempts'] >= max_attempts:
+            _write_json(self._path('failed', key + '.json'), task)
+        else:
+            _write_json(self._path('tasks', key + '.json'), task)
+        self._release(claim)
+
+    def _release(self, claim : str):
+        try:
+            os.remove(claim)
+        except FileNotFoundError:
+            pass # taken back by the coordinator after the lease expired
+
+    def requeue_expired(self, lease : float = lease):
+        # Puts claims that have not been touched for `lease` seconds back in tasks/
+        requeued = 0
+        for key, claim in self._claims().items():
+            try:
+                if time.time() - os.path.getmtime(claim) < lease:
+                    continue
+                with open(claim) as f:
+                    task = json.load(f)
+            except FileNotFoundError:
+                continue # finished meanwhile
+            self.fail(key, claim, task, "lease expired")
+            requeued += 1
+        return requeued
+
+    def failed(self):
+        found = {}
+        for name in os.listdir(self._path('failed')):
+            if name.endswith('.json'):
+                with open(self._path('failed', name)) as f:
+                    found[name[:-5]] = json.load(f)
+        return found
+
+    def restart(self, keys : list):
+        # Clears the stop marker and the failed/ entries of `keys`, which put() then queues again
+        for path in [self._path('stop')] + [self._path('failed', key + '.json') for key in keys]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stop(self):
+        _write_json(self._path('stop'), {'stopped' : time.time()})
+
+    def stopped(self, since : float = None):
+        # True if the coordinator has stopped the queue (at or after `since`)
+        try:
+            return since is None or os.path.getmtime(self._path('stop')) >= since
+        except FileNotFoundError:
+            return False
+
+
+# Coordinator ------------------------------------------------------------------------------------
+
+def make_tasks(config : dict, chunk_days : int = chunk_days, systems_per_task : int = 1):
+    # One task per (site, system group, time range, chunk of whole days). A task's config is a
+    # scenario of its own; 'chunk' orders the parts of a unit for merging.
+    tasks = []
+    systems = config['systems']
+    groups = [systems[i:i + systems_per_task] for i in range(0, len(systems), systems_per_task)]
+    for site in config['sites']:
+        for time_range in config['time_ranges']:
+            times, _ = planner.range_times(site, time_range)
+            step = times.step if isinstance(times, time_axis.TimeAxis) else int(pd.Timedelta(times[1] - times[0]).value)
+            rows = chunk_days * int(round(86400e9 / step))
+            for chunk, (start, stop) in enumerate(planner.split_rows(times, rows)):
+                part = planner.chunk_range(time_range, times, start, stop)
+                # ISO strings with their offset, turned back into Timestamps by the worker
+                part = dict(part, start=part['start'].isoformat(), end=part['end'].isoformat())
+                for group in groups:
+                    job = {key: value for key, value in config.items() if key != 'requests'}
+                    tasks.append({'chunk' : chunk,
+                                  'config' : dict(job, sites=[site], systems=group, time_ranges=[part])})
+    return tasks
+
+
+def start_local_workers(directory : str, n : int, threads : int = 1, since : float = None):
+    # Workers that stop for a stop marker written at or after `since`
+    since = ['--since', repr(since)] if since is not None else []
+    return [subprocess.Popen([sys.executable, os.path.abspath(__file__), 'worker', directory,
+                              '--threads', str(threads), '--name', socket.gethostname() + "-local" + str(i)] + since)
+            for i in range(n)]
+
+
+def coordinate(config : dict, directory : str, chunk_days : int = chunk_days, systems_per_task : int = 1,
+               lease : float = lease, local_workers : int = 0):
+    # Queues the scenario, waits for workers to finish it and returns the same results as
+    # scenario.run_scenario(config)
+    started = time.time()
+    queue = WorkQueue(directory)
+    tasks = make_tasks(config, chunk_days, systems_per_task)
+    queue.restart([task_id(task) for task in tasks])
+    keys = [queue.put(task) for task in tasks]
+    # Other scenarios may share the directory; only their own failures are theirs to report
+    submitted = set(keys)
+    reused = sum(queue.results.done(key) for key in keys)
+    telemetry.cache('task_results', hits=reused, misses=len(keys) - reused)
+    print("Queued", len(tasks), "tasks in", directory)
+    workers = start_local_workers(directory, local_workers, since=started) if local_workers else []
+
+    try:
+        reported = None
+        while True:
+            requeued = queue.requeue_expired(lease)
+            if requeued:
+                print("Requeued", requeued, "tasks with expired leases")
+            failed = {key: task for key, task in queue.failed().items() if key in submitted}
+            if failed:
+                raise RuntimeError("Tasks out of attempts: " +
+                                   "; ".join(task['error'].strip().splitlines()[-1] for task in failed.values()))
+            done = sum(queue.results.done(key) for key in keys)
+            telemetry.set_units(done, len(keys) - done, len(failed))
+            if done != reported:
+                print("Completed", done, "of", len(keys), "tasks")
+                reported = done
+            if done == len(keys):
+                break
+            time.sleep(poll)
+    finally:
+        queue.stop()
+        for worker in workers:
+            worker.wait()
+
+    parts = {}
+    for task, key in sorted(zip(tasks, keys), key=lambda item: item[0]['chunk']):
+        for unit, unit_outputs in queue.results.load(key).items():
+            for output, value in unit_outputs.items():
+                parts.setdefault(unit, {}).setdefault(output, []).append(value)
+    merged = {unit: {output: scenario.merge_parts(output, values) for output, values in unit_parts.items()}
+              for unit, unit_parts in parts.items()}
+    order = [(site['name'], system['name'], time_range['name']) for site in config['sites']
+             for time_range in config['time_ranges'] for system in config['systems']]
+    return scenario.finish({unit: merged[unit] for unit in order})
+
+
+# Worker -----------------------------------------------------------------------------------------
+
+def _decode(config : dict):
+    # Back to tz-aware Timestamps, which slice an index across a DST change where strings fail
+    return dict(config, time_ranges=[dict(time_range, start=pd.Timestamp(time_range['start']),
+                                          end=pd.Timestamp(time_range['end']))
+                                     for time_range in config['time_ranges']])
+
+
+def _heartbeat(claim : str, running : threading.Event, lease : float):
+    while running.is_set():
+        try:
+            os.utime(claim)
+        except FileNotFoundError:
+            return # taken back by the coordinator
+        running.wait(lease / 4)
+
+
+def work(directory : str, name : str = None, threads : int = 1, lease : float = lease, exit_when_idle : bool = False,
+         since : float = None):
+    # Runs tasks until the coordinator stops the queue (or, with exit_when_idle, none are left).
+    # A stop marker written before `since` (default: now) is left from an earlier run.
+    queue = WorkQueue(directory)
+    name = name or socket.gethostname() + "-" + str(os.getpid())
+    completed = 0
+    since = time.time() if since is None else since
+    while not queue.stopped(since=since):
+        claimed = queue.claim(name)
+        if claimed is None:
+            if exit_when_idle:
+                break
+            time.sleep(poll)
+            continue
+        key, task, claim = claimed
+        if queue.results.done(key):
+            # A requeued task that its first worker completed after all
+            queue._release(claim)
+            continue
+
+        running = threading.Event()
+        running.set()
+        threading.Thread(target=_heartbeat, args=(claim, running, lease), daemon=True).start()
+        try:
+            value = scenario.run_units(_decode(task['config']), threads)
+        except Exception:
+            running.clear()
+            queue.fail(key, claim, task, traceback.format_exc())
+            print(name, "failed task", key[:8], "attempt", task['attempts'] + 1)
+            continue
+        running.clear()
+        # Units are counted by run_units, finished or failed
+        if queue.complete(key, claim, value):
+            completed += 1
+        else:
+            print(name, "discarded a duplicate completion of task", key[:8])
+    print(name, "completed", completed, "tasks")
+    return completed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a scenario through a shared work queue directory")
+    commands = parser.add_subparsers(dest='command', required=True)
+    coordinator = commands.add_parser('coordinator', help="Queue a scenario and collect its results")
+    coordinator.add_argument('scenario')
+    coordinator.add_argument('queue')
+    coordinator.add_argument('--chunk-days', type=int, default=chunk_days)
+    coordinator.add_argument('--systems-per-task', type=int, default=1,
+                             help="Systems of a task share its solar geometry")
+    coordinator.add_argument('--lease', type=float, default=lease)
+    coordinator.add_argument('--local-workers', type=int, default=0, help="Also start this many workers here")
+    coordinator.add_argument('--output-dir', default=None)
+    worker = commands.add_parser('worker', help="Run queued tasks")
+    worker.add_argument('queue')
+    worker.add_argument('--threads', type=int, default=1)
+    worker.add_argument('--name', default=None)
+    worker.add_argument('--lease', type=float, default=lease)
+    worker.add_argument('--exit-when-idle', action='store_true')
+    worker.add_argument('--since', type=float, default=None,
+                        help="Unix time before which a stop marker is ignored (default: the worker's start)")
+    for command in [coordinator, worker]:
+        telemetry.add_arguments(command)
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        with telemetry.from_args(args.name or 'worker', args):
+            work(args.queue, args.name, args.threads, args.lease, args.exit_when_idle, args.since)
+    else:
+        start_time = time.time()
+        config = scenario.load_scenario(args.scenario)
+        if not config['outputs']:
+            raise SystemExit("The scenario has no outputs to distribute")
+        with telemetry.from_args(config['name'], args):
+            results = coordinate(config, args.queue, args.chunk_days, args.systems_per_task, args.lease, args.local_workers)
+        print("Scenario", config['name'], "finished in", "{:.2f}".format(time.time() - start_time), "seconds.")
+        output_dir = args.output_dir or str(config['name'] + "_" + time.strftime("%Y_%m_%d_%H-%M"))
+        scenario.save_results(config, results, output_dir)
+        print("Results saved to", output_dir)